@@ -7,24 +7,18 @@ import requests
 import csv
 import io
 import re
+import json
+import base64
+from decimal import Decimal
+import tempfile
+import threading
+import time
+import uuid
+import zipfile
 # import pandas as pd  # 軽量化のため削除
-from datetime import datetime
+from datetime import datetime, date
 from unit_converter import UnitConverter
-from flask import Flask, request, abort, render_template, jsonify, send_file, redirect, url_for, flash
-from linebot.v3.webhook import WebhookHandler
-from linebot.v3.exceptions import InvalidSignatureError
-from linebot.v3.webhooks import MessageEvent, TextMessageContent, ImageMessageContent, PostbackEvent
-from linebot.v3.messaging import (
-    Configuration,
-    ApiClient,
-    MessagingApi,
-    MessagingApiBlob,
-    ReplyMessageRequest,
-    PushMessageRequest,
-    TextMessage,
-    FlexMessage,
-    FlexContainer
-)
+from flask import Flask, request, abort, render_template, jsonify, send_file, redirect, url_for, flash, Response, stream_with_context
 from typing import Optional # 追加
 
 # LINE UI機能は一時的に無効化（安定性を優先）
@@ -35,6 +29,23 @@ from azure_vision import AzureVisionAnalyzer
 from groq_parser import GroqRecipeParser
 from cost_calculator import CostCalculator
 from cost_master_manager import CostMasterManager
+from search_index import normalize_search_key
+from flex_templates import INGREDIENT_BUBBLE, ADD_INGREDIENT_BUBBLE, SEARCH_MORE_BUBBLE, RECIPE_REVIEW_BUBBLE
+from conversation_state import compact_state, expand_state, load_cost_result, ConversationStateSweeper
+from ttl_cache import TTLCache
+from supabase_paging import fetch_keyset_page, order_by
+from upload_pipeline import run_cost_master_upload, UploadReport
+from price_reducers import get_price_reducer
+from price_history import price_history_row, record_price_history
+from transaction_import import (
+    extract_transaction_materials, extract_transaction_files, iter_transaction_archive,
+    merge_transaction_materials, save_transaction_materials, MAX_BULK_FILES
+)
+from upload_jobs import UploadJobStore, UploadJobRunner
+from supplier_cache import SupplierCache
+from recipe_recoster import RecipeRecoster, cost_master_fingerprints, diff_cost_master
+from lazy_services import LazyImport, LazyService
+from recipe_costing import RecipeCostModel, build_cost_terms, cost_recipe_batch, load_recipe_ingredients, load_recipes_by_id
 from supabase import create_client, Client
 
 load_dotenv()
@@ -46,12 +57,37 @@ app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'your-secret-key-here')
 csrf = None
 print("⚠️ CSRF保護は無効化されています（フォーム機能を優先）")
 
-# LINE Bot設定
-configuration = Configuration(access_token=os.getenv('LINE_CHANNEL_ACCESS_TOKEN'))
-handler = WebhookHandler(os.getenv('LINE_CHANNEL_SECRET'))
-api_client = ApiClient(configuration)
-line_bot_api = MessagingApi(api_client)
-line_bot_blob_api = MessagingApiBlob(api_client)
+# LINE SDK（linebot.v3）はモデルの読み込みに約1秒かかるため、起動時にはimportせず最初に使う時に読み込む
+ReplyMessageRequest = LazyImport('linebot.v3.messaging', 'ReplyMessageRequest')
+PushMessageRequest = LazyImport('linebot.v3.messaging', 'PushMessageRequest')
+TextMessage = LazyImport('linebot.v3.messaging', 'TextMessage')
+FlexMessage = LazyImport('linebot.v3.messaging', 'FlexMessage')
+FlexCarousel = LazyImport('linebot.v3.messaging', 'FlexCarousel')
+MessagingApi = LazyImport('linebot.v3.messaging', 'MessagingApi')
+MessagingApiBlob = LazyImport('linebot.v3.messaging', 'MessagingApiBlob')
+
+
+def create_line_api_client():
+    from linebot.v3.messaging import ApiClient, Configuration
+    return ApiClient(Configuration(access_token=os.getenv('LINE_CHANNEL_ACCESS_TOKEN')))
+
+
+def create_webhook_handler():
+    """Webhookのハンドラーを作り、イベントごとの処理関数を登録する"""
+    from linebot.v3.webhook import WebhookHandler
+    from linebot.v3.webhooks import MessageEvent, TextMessageContent, ImageMessageContent, PostbackEvent
+    webhook_handler = WebhookHandler(os.getenv('LINE_CHANNEL_SECRET'))
+    webhook_handler.add(MessageEvent, message=ImageMessageContent)(handle_image_message)
+    webhook_handler.add(MessageEvent, message=TextMessageContent)(handle_text_message)
+    webhook_handler.add(PostbackEvent)(handle_postback_event)
+    return webhook_handler
+
+
+# LINE Bot設定（Webhookのハンドラー・APIクライアントは最初に使う時に作る）
+handler = LazyService('LINE Webhook', create_webhook_handler)
+api_client = LazyService('LINE APIクライアント', create_line_api_client)
+line_bot_api = LazyService('LINE Messaging API', lambda: MessagingApi(api_client.get()))
+line_bot_blob_api = LazyService('LINE Messaging API（Blob）', lambda: MessagingApiBlob(api_client.get()))
 
 # Supabase設定
 supabase_url = os.getenv('SUPABASE_URL')
@@ -62,8 +98,8 @@ if not supabase_key:
 
 supabase: Client = create_client(supabase_url, supabase_key)
 
-# 各種サービスの初期化
-azure_analyzer = AzureVisionAnalyzer()
+# 各種サービスは最初に使う時に初期化する（起動時間の短縮）
+azure_analyzer = LazyService('Azure Vision', AzureVisionAnalyzer)
 
 # AIプロバイダーの選択（環境変数で制御、DBで永続化）
 def get_ai_provider():
@@ -98,182 +134,85 @@ def set_ai_provider(provider):
     except Exception as e:
         print(f"❌ AIプロバイダー設定保存エラー: {e}")
 
-# Supabaseクライアントが初期化された後にAIプロバイダーを取得
-ai_provider = get_ai_provider()
-print(f"🤖 AIプロバイダー: {ai_provider}")
+def resolve_ai_provider():
+    """AI解析エンジンの初期化時にAIプロバイダーを決定"""
+    ai_provider = get_ai_provider()
+    print(f"🤖 AIプロバイダー: {ai_provider}")
 
-# Groqに強制設定（デバッグ用）
-if ai_provider != 'groq':
-    print(f"🔄 Groqに強制切り替え: {ai_provider} → groq")
-    set_ai_provider('groq')
-    ai_provider = 'groq'
+    # Groqに強制設定（デバッグ用）
+    if ai_provider != 'groq':
+        print(f"🔄 Groqに強制切り替え: {ai_provider} → groq")
+        set_ai_provider('groq')
+        ai_provider = 'groq'
+    return ai_provider
 
-groq_parser = GroqRecipeParser(ai_provider=ai_provider)
+groq_parser = LazyService('AI解析エンジン', lambda: GroqRecipeParser(ai_provider=resolve_ai_provider()))
 cost_calculator = CostCalculator(supabase) # 修正: Supabaseクライアントを渡す
-cost_master_manager = CostMasterManager()
+cost_master_manager = CostMasterManager(supabase)
 
-# 原価表の事前読み込み
-try:
-    cost_calculator.load_cost_master() # 修正: DBから直接読み込む
-except Exception as e:
-    print(f"原価表の初期読み込みでエラーが発生しました: {e}")
+# 取引先名 → IDのキャッシュ（アップロードやフォームで全件取得しない）
+supplier_cache = SupplierCache(supabase)
+cost_master_manager.supplier_cache = supplier_cache
 
+# 管理画面の統計情報キャッシュ（複数タブからの同時更新でも集計は1回）
+admin_stats_cache = TTLCache(float(os.getenv('ADMIN_STATS_CACHE_TTL_SECONDS', 30)))
 
-def read_file_data(file):
-    """CSV/Excelファイルを読み込んで辞書のリストを返す"""
-    try:
-        filename = file.filename.lower()
-        file.seek(0)  # ファイルポインタを先頭に戻す
-        
-        if filename.endswith('.csv'):
-            # CSVファイルの読み込み（複数エンコーディング対応）
-            file_content = file.read()
-            csv_data = None
-            
-            # 複数のエンコーディングを試行（日本語ファイルに最適化）
-            encodings = [
-                'shift_jis',     # 最も一般的な日本語エンコーディング
-                'cp932',         # Windows版Shift-JIS
-                'utf-8-sig',     # UTF-8 with BOM
-                'utf-8',         # UTF-8 without BOM
-                'euc-jp',        # EUC-JP
-                'iso-2022-jp'    # ISO-2022-JP
-            ]
-            
-            for encoding in encodings:
-                try:
-                    file.seek(0)
-                    # エラーを無視してデコードを試行
-                    csv_data = file_content.decode(encoding, errors='ignore')
-                    print(f"🔍 CSV file decoded as {encoding} (with error handling): {len(csv_data)} characters")
-                    
-                    # デコードされた内容が妥当かチェック（最低限の文字数があるか）
-                    if len(csv_data.strip()) > 10:
-                        break
-                    else:
-                        print(f"🔍 {encoding} decoded but content too short, trying next encoding")
-                        continue
-                        
-                except (UnicodeDecodeError, UnicodeError) as e:
-                    print(f"🔍 {encoding} decode failed: {e}")
-                    continue
-            
-            if csv_data is None:
-                raise ValueError(f"ファイルのエンコーディングが判別できません。試行したエンコーディング: {', '.join(encodings)}")
-            
-            csv_reader = csv.DictReader(io.StringIO(csv_data))
-            data_rows = list(csv_reader)
-            print(f"🔍 CSV file loaded: {len(data_rows)} rows")
-        elif filename.endswith('.xlsx'):
-            # Excelファイルの読み込み（openpyxl使用）
-            from openpyxl import load_workbook
-            workbook = load_workbook(file)
-            worksheet = workbook.active
-            data_rows = []
-            
-            # ヘッダー行を取得
-            headers = []
-            for cell in worksheet[1]:
-                headers.append(cell.value)
-            
-            # データ行を取得
-            for row in worksheet.iter_rows(min_row=2, values_only=True):
-                row_dict = {}
-                for i, value in enumerate(row):
-                    if i < len(headers):
-                        row_dict[headers[i]] = value
-                data_rows.append(row_dict)
-            
-            print(f"🔍 Excel file loaded: {len(data_rows)} rows")
-        elif filename.endswith('.xls'):
-            # Excelファイルの読み込み（xlrd使用）
-            import xlrd
-            workbook = xlrd.open_workbook(file_contents=file.read())
-            worksheet = workbook.sheet_by_index(0)
-            data_rows = []
-            
-            # ヘッダー行を取得
-            headers = []
-            for col in range(worksheet.ncols):
-                headers.append(worksheet.cell_value(0, col))
-            
-            # データ行を取得
-            for row in range(1, worksheet.nrows):
-                row_dict = {}
-                for col in range(worksheet.ncols):
-                    row_dict[headers[col]] = worksheet.cell_value(row, col)
-                data_rows.append(row_dict)
-            
-            print(f"🔍 Excel file loaded: {len(data_rows)} rows")
-        else:
-            raise ValueError(f"Unsupported file format: {filename}")
-        
-        return data_rows
-    except Exception as e:
-        print(f"❌ File reading error: {e}")
-        raise
+# 単価シミュレーション用の保存レシピの原価モデル（原価表の再読み込みで破棄）
+recipe_cost_model_cache = TTLCache(float(os.getenv('RECIPE_COST_MODEL_TTL_SECONDS', 300)))
+
+# 単価が変わった原価表の行に依存する保存レシピをバックグラウンドで再計算する
+recipe_recoster = RecipeRecoster(supabase, cost_calculator)
 
-def extract_capacity_from_spec(spec_text, product_name="", unit_column=""):
+# 原価表の再読み込みは1つずつ行う（起動時の読み込みとアップロード後の更新が重ならないように）
+cost_cache_lock = threading.Lock()
+
+def refresh_cost_cache(recost: bool = True):
     """
-    規格や商品名、単位列から容量を抽出する関数
-    
-    Args:
-        spec_text: 規格テキスト
-        product_name: 商品名
-        unit_column: CSVの単位列の内容（そのまま保持、変換しない）
-    
-    Returns:
-        tuple: (capacity, unit, unit_column)
-            - capacity: 容量の数値（kg→g, L→mlに変換済み）
-            - unit: 容量の単位（g, ml, 個など、変換済み）
-            - unit_column: CSVの単位列をそのまま保持（PC, kg, Lなど、変換しない）
+    原価表キャッシュと材料検索インデックスを再構築
+
+    recostがTrueの場合は、再読み込み前後で値が変わった原価表の行に依存する
+    保存レシピの原価をバックグラウンドで再計算する。
     """
-    if not spec_text:
-        spec_text = ""
-    
-    # 規格から「×入数」パターンを除去
-    # 「750ml×12」→「750ml」
-    spec_cleaned = re.sub(r'×\d+$', '', spec_text.strip())
-    
-    # 容量パターンマッチング（優先順位順）
-    patterns = [
-        # 重量系
-        (r'(\d+(?:\.\d+)?)\s*kg', lambda m: (float(m.group(1)) * 1000, 'g')),
-        (r'(\d+(?:\.\d+)?)\s*g', lambda m: (float(m.group(1)), 'g')),
-        # 容量系
-        (r'(\d+(?:\.\d+)?)\s*L', lambda m: (float(m.group(1)) * 1000, 'ml')),
-        (r'(\d+(?:\.\d+)?)\s*ml', lambda m: (float(m.group(1)), 'ml')),
-        # 個数系
-        (r'(\d+(?:\.\d+)?)\s*pc', lambda m: (float(m.group(1)), 'pc')),
-        (r'(\d+(?:\d+)?)\s*個', lambda m: (float(m.group(1)), '個')),
-        (r'(\d+(?:\.\d+)?)\s*本', lambda m: (float(m.group(1)), '本')),
-        (r'(\d+(?:\.\d+)?)\s*枚', lambda m: (float(m.group(1)), '枚')),
-        # パック系
-        (r'(\d+(?:\.\d+)?)\s*p', lambda m: (float(m.group(1)), 'p')),
-    ]
-    
-    # 規格から容量を抽出
-    for pattern, converter in patterns:
-        match = re.search(pattern, spec_cleaned, re.IGNORECASE)
-        if match:
-            capacity, unit = converter(match)
-            # unit_columnは絶対に変換せず、そのまま返す
-            return (capacity, unit, unit_column)
-    
-    # 商品名から容量を抽出（規格で見つからない場合）
-    if product_name:
-        for pattern, converter in patterns:
-            match = re.search(pattern, product_name, re.IGNORECASE)
-            if match:
-                capacity, unit = converter(match)
-                # unit_columnは絶対に変換せず、そのまま返す
-                return (capacity, unit, unit_column)
-    
-    # デフォルト値
-    # 規格や商品名から容量が抽出できない場合
-    # - unit: 容量の単位として'個'を使用
-    # - unit_column: CSVの単位列を絶対にそのまま保持（変換しない）
-    return (1, '個', unit_column)
+    with cost_cache_lock:
+        before = cost_master_fingerprints(cost_calculator.cost_master) if recost else {}
+        cost_calculator.load_cost_master() # 修正: DBから直接読み込む
+        cost_master_manager.build_search_index(cost_calculator.cost_master)
+        # 単価履歴は次に過去の日付で原価を計算する時に読み直す
+        cost_calculator.price_history = None
+        admin_stats_cache.invalidate()
+        recipe_cost_model_cache.invalidate()
+        if recost:
+            changed, rows_added_or_removed = diff_cost_master(before, cost_master_fingerprints(cost_calculator.cost_master))
+            recipe_recoster.enqueue(changed, relink=rows_added_or_removed)
+
+# 原価表の事前読み込み
+# 起動（/healthの応答）をブロックしないようバックグラウンドで読み込み、
+# 読み込みが終わるまでは他のリクエストを待たせる
+COST_CACHE_WARMUP_TIMEOUT_SECONDS = float(os.getenv('COST_CACHE_WARMUP_TIMEOUT_SECONDS', 30))
+cost_cache_ready = threading.Event()
+
+def warm_cost_cache():
+    """原価表の初期読み込み（失敗しても待っているリクエストは解放する）"""
+    try:
+        refresh_cost_cache(recost=False)
+    except Exception as e:
+        print(f"原価表の初期読み込みでエラーが発生しました: {e}")
+    finally:
+        cost_cache_ready.set()
+
+threading.Thread(target=warm_cost_cache, name='cost-cache-warmup', daemon=True).start()
+
+@app.before_request
+def wait_for_cost_cache():
+    """原価表の初期読み込みが終わるまで待つ（ヘルスチェックと静的ファイルは待たない）"""
+    if cost_cache_ready.is_set() or request.endpoint in ('health_check', 'static'):
+        return
+    if not cost_cache_ready.wait(COST_CACHE_WARMUP_TIMEOUT_SECONDS):
+        print(f"⚠️ 原価表の初期読み込みが{COST_CACHE_WARMUP_TIMEOUT_SECONDS}秒で終わらないため待たずに処理します")
+
+# 期限切れの会話状態を定期的に削除
+conversation_state_sweeper = ConversationStateSweeper(supabase)
+conversation_state_sweeper.start()
 
 
 def get_user_state(user_id):
@@ -281,7 +220,7 @@ def get_user_state(user_id):
     try:
         result = supabase.table('conversation_state').select('state').eq('user_id', user_id).execute()
         if result.data:
-            return result.data[0].get('state', {})
+            return expand_state(result.data[0].get('state'))
     except Exception as e:
         print(f"ユーザー状態の取得エラー: {e}")
     return {}
@@ -296,11 +235,11 @@ def clear_user_state(user_id):
         print(f"会話状態クリアエラー: {e}")
 
 def set_user_state(user_id, state):
-    """ユーザーの状態をDBに保存"""
+    """ユーザーの状態をDBに保存（コンパクト形式）"""
     try:
         supabase.table('conversation_state').upsert({
             'user_id': user_id,
-            'state': state
+            'state': compact_state(state)
         }).execute()
     except Exception as e:
         print(f"ユーザー状態の保存エラー: {e}")
@@ -315,7 +254,7 @@ def admin_index():
 
 @app.route("/admin/upload", methods=['POST'])
 def admin_upload():
-    """原価表CSVファイルのアップロード"""
+    """原価表CSVファイルのアップロード（バックグラウンドで処理）"""
     try:
         if 'file' not in request.files:
             return jsonify({"error": "ファイルが選択されていません"}), 400
@@ -327,145 +266,8 @@ def admin_upload():
         if not any(file.filename.lower().endswith(ext) for ext in ['.csv', '.xlsx', '.xls']):
             return jsonify({"error": "CSV/Excelファイルのみアップロード可能です"}), 400
         
-        # ファイルを読み込み
-        data_rows = read_file_data(file)
-        
-        # 列名の自動検出
-        if data_rows:
-            fieldnames = list(data_rows[0].keys())
-        else:
-            fieldnames = []
-        print(f"🔍 File columns: {fieldnames}")
-        print(f"🔍 File data preview (first 3 rows):")
-        for i in range(min(3, len(data_rows))):
-            print(f"  Row {i+1}: {data_rows[i]}")
-        
-        # 列名マッピング（テンプレート形式を優先）
-        column_mapping = {}
-        
-        # まずテンプレート形式をチェック
-        if 'ingredient_name' in fieldnames:
-            column_mapping['ingredient_name'] = 'ingredient_name'
-        if 'capacity' in fieldnames:
-            column_mapping['capacity'] = 'capacity'
-        if 'unit' in fieldnames:
-            column_mapping['unit'] = 'unit'
-        if 'unit_price' in fieldnames:
-            column_mapping['unit_price'] = 'unit_price'
-        
-        # 新しい基本形式をチェック（cost_file.csv形式）
-        if '商品名' in fieldnames:
-            column_mapping['ingredient_name'] = '商品名'
-        if '容量' in fieldnames:
-            column_mapping['capacity'] = '容量'
-        if '単位' in fieldnames:
-            column_mapping['unit'] = '単位'
-        if '単価' in fieldnames:
-            column_mapping['unit_price'] = '単価'
-        if '取引先名' in fieldnames:
-            column_mapping['supplier'] = '取引先名'
-        if '伝票日付' in fieldnames:
-            column_mapping['date'] = '伝票日付'
-        
-        # テンプレート形式が見つからない場合は自動検出
-        if not column_mapping:
-            for field in fieldnames:
-                field_lower = field.lower().strip()
-                # 新しいCSV形式の対応（［］付きの列名）
-                if '商品名' in field or 'ingredient' in field_lower or '材料' in field_lower or 'name' in field_lower:
-                    column_mapping['ingredient_name'] = field
-                elif '容量' in field or 'capacity' in field_lower:
-                    column_mapping['capacity'] = field
-                elif ('単位' in field or 'unit' in field_lower) and 'price' not in field_lower:
-                    column_mapping['unit'] = field
-                elif '単価' in field or 'price' in field_lower or 'cost' in field_lower:
-                    column_mapping['unit_price'] = field
-                elif '取引先名' in field or 'supplier' in field_lower:
-                    column_mapping['supplier'] = field
-                elif '伝票日付' in field or 'date' in field_lower:
-                    column_mapping['date'] = field
-        
-        print(f"🔍 Column mapping: {column_mapping}")
-        
-        items_dict = {}
-        processed_count = 0
-        skipped_count = 0
-        
-        for row_num, row in enumerate(data_rows, 1):
-            try:
-                # データの検証と変換
-                ingredient_name = row.get(column_mapping.get('ingredient_name', ''), '').strip()
-                unit_price = row.get(column_mapping.get('unit_price', ''), '').strip()
-                
-                print(f"🔍 Row {row_num}: ingredient_name='{ingredient_name}', unit_price='{unit_price}'")
-                
-                if not ingredient_name or not unit_price:
-                    print(f"❌ Skipping row {row_num} due to missing ingredient_name or unit_price: {row}")
-                    skipped_count += 1
-                    continue
-                
-                # 容量の取得と処理
-                capacity_str = row.get(column_mapping.get('capacity', ''), '').strip()
-                unit = row.get(column_mapping.get('unit', ''), '個').strip()
-                
-                # 容量が空の場合は空白のまま（自動抽出しない）
-                if not capacity_str:
-                    capacity = None  # 空白のまま登録
-                    extracted_unit = unit if unit else '個'
-                    print(f"🔍 容量空白: {ingredient_name} → 容量なし、単位:{extracted_unit}")
-                else:
-                    # 容量が指定されている場合はその値を使用
-                    try:
-                        capacity = float(capacity_str)
-                        extracted_unit = unit if unit else '個'
-                        print(f"🔍 容量指定: {ingredient_name} → {capacity}{extracted_unit}")
-                    except ValueError:
-                        # 数値変換できない場合は空白のまま
-                        capacity = None
-                        extracted_unit = unit if unit else '個'
-                        print(f"🔍 容量変換エラー、空白で登録: {ingredient_name} → 容量なし、単位:{extracted_unit}")
-                
-                # 取引先情報の取得
-                supplier_name = row.get(column_mapping.get('supplier', ''), '').strip()
-                transaction_date = row.get(column_mapping.get('date', ''), '').strip()
-                
-                # Supabaseに挿入するデータを作成
-                data = {
-                    'ingredient_name': ingredient_name,
-                    'capacity': capacity,
-                    'unit': extracted_unit,
-                    'unit_price': float(unit_price),
-                    'supplier_name': supplier_name,
-                    'transaction_date': transaction_date,
-                    'updated_at': datetime.now().isoformat()
-                }
-                
-                # 辞書を使って重複を除去（後のものが優先される）
-                # 同じ商品名でも取引先や日付が異なる場合は別エントリとして扱う
-                unique_key = f"{ingredient_name}_{supplier_name}_{transaction_date}"
-                items_dict[unique_key] = data
-                processed_count += 1
-                
-                print(f"✅ Processed row {row_num}: {ingredient_name} (容量:{capacity}{extracted_unit}, 単価:{unit_price}円)")
-
-            except (ValueError, KeyError) as e:
-                print(f"❌ Skipping row {row_num} due to error: {e}. Row data: {row}")
-                skipped_count += 1
-                continue
-        
-        print(f"📊 Summary: processed={processed_count}, skipped={skipped_count}, unique_items={len(items_dict)}")
-        
-        items_to_upsert = list(items_dict.values())
-        count = 0
-        if items_to_upsert:
-            print(f"🔄 Upserting {len(items_to_upsert)} unique items in a batch.")
-            result = supabase.table('cost_master').upsert(items_to_upsert, on_conflict='ingredient_name').execute()
-            count = len(result.data)
-            print(f"✅ Successfully upserted {count} items to database.")
-        else:
-            print("❌ No items to upsert.")
-
-        return jsonify({"success": True, "count": count, "processed": processed_count, "skipped": skipped_count})
+        # 読み込み・検証・重複除去・チャンク単位のupsertはバックグラウンドのジョブで実行
+        return submit_upload_job('cost_master', file.filename, file.stream)
     
     except Exception as e:
         print(f"❌ アップロードエラー詳細: {e}")
@@ -481,9 +283,175 @@ def admin_upload():
         return jsonify({"error": error_message}), 500
 
 
+def run_transaction_upload(stream, filename: str, progress=None, price_policy: str = None,
+                           window_days: int = None) -> dict:
+    """
+    取引データCSVから材料を抽出してcost_masterに保存（バックグラウンドジョブから実行）
+    
+    Args:
+        progress: progress(rows_parsed=, rows_upserted=, rows_failed=, force=) の形で進捗を受け取る関数
+        price_policy: 単価の集約方法（min, last, mean, weighted_mean, trailing_mean。未指定は最安値）
+        window_days: trailing_meanの集計期間（日）
+    """
+    reducer = get_price_reducer(price_policy, window_days)
+    extract = extract_transaction_materials(stream, filename, progress=progress, reducer=reducer)
+    materials = extract['aggregate'].results()
+    failed_count = extract['failed']
+
+    def report_progress(report: UploadReport):
+        if progress:
+            progress(rows_parsed=extract['rows'], rows_upserted=report.saved,
+                     rows_failed=failed_count + report.error_count)
+
+    report = save_transaction_materials(supabase, materials, on_chunk=report_progress,
+                                        suppliers=supplier_cache)
+
+    if progress:
+        progress(rows_parsed=extract['rows'], rows_upserted=report.saved,
+                 rows_failed=failed_count + report.error_count, force=True)
+
+    return {
+        "success": True, 
+        "price_policy": reducer.describe(),
+        "processed": extract['processed'],
+        "extracted": len(materials),
+        "saved": report.saved,
+        "inserted": report.inserted,
+        "updated": report.updated,
+        "unchanged": report.unchanged,
+        "failed": failed_count + report.error_count,
+        "errors": report.errors,
+        "encoding": extract['encoding'],
+        "encoding_confidence": extract['encoding_confidence']
+    }
+
+
+def run_transaction_bulk_upload(stream, filename: str, progress=None, price_policy: str = None,
+                                window_days: int = None) -> dict:
+    """
+    zipにまとめた複数の取引データCSVを並列に集約し、統合してから1回だけ保存（バックグラウンドジョブから実行）
+    """
+    reducer = get_price_reducer(price_policy, window_days)
+    totals = {'rows': 0, 'failed': 0}
+
+    def on_file(extract: dict):
+        totals['rows'] += extract['rows']
+        totals['failed'] += extract['failed']
+        print(f"📄 {extract['filename']}: {extract['processed']}件の明細から{len(extract['aggregate'])}件を抽出")
+        if progress:
+            progress(rows_parsed=totals['rows'], rows_failed=totals['failed'])
+
+    extracts = extract_transaction_files(iter_transaction_archive(stream), on_file=on_file, reducer=reducer)
+    if not extracts:
+        raise ValueError("zipにCSVファイルが含まれていません")
+    materials = merge_transaction_materials(extracts, reducer).results()
+
+    def report_progress(report: UploadReport):
+        if progress:
+            progress(rows_parsed=totals['rows'], rows_upserted=report.saved,
+                     rows_failed=totals['failed'] + report.error_count)
+
+    # 単価履歴にはファイル（月）ごとの集約結果を記録し、月ごとの単価の推移を残す
+    observations = [item for extract in extracts for item in extract['aggregate'].results().values()]
+    report = save_transaction_materials(supabase, materials, on_chunk=report_progress,
+                                        observations=observations, suppliers=supplier_cache)
+
+    if progress:
+        progress(rows_parsed=totals['rows'], rows_upserted=report.saved,
+                 rows_failed=totals['failed'] + report.error_count, force=True)
+
+    return {
+        "success": True,
+        "price_policy": reducer.describe(),
+        "files": [{
+            "filename": extract['filename'],
+            "processed": extract['processed'],
+            "extracted": len(extract['aggregate']),
+            "failed": extract['failed'],
+            "encoding": extract['encoding']
+        } for extract in extracts],
+        "processed": sum(extract['processed'] for extract in extracts),
+        "extracted": len(materials),
+        "saved": report.saved,
+        "inserted": report.inserted,
+        "updated": report.updated,
+        "unchanged": report.unchanged,
+        "failed": totals['failed'] + report.error_count,
+        "errors": report.errors
+    }
+
+
+def record_cost_master_history(items: list, source: str):
+    """書き込んだcost_masterの行の単価を単価履歴に記録（伝票日付があればその日付）"""
+    record_price_history(supabase, (
+        price_history_row(item['ingredient_name'], item.get('supplier_id'), item.get('capacity'),
+                          item.get('unit'), item['unit_price'], item.get('transaction_date'), source)
+        for item in items
+    ))
+
+
+def run_cost_master_upload_job(stream, filename: str, progress=None) -> dict:
+    """原価表ファイルの取り込み（バックグラウンドジョブから実行）"""
+    report = run_cost_master_upload(supabase, stream, filename, progress=progress,
+                                    on_written=lambda items: record_cost_master_history(items, 'cost_master_upload'))
+    return dict(report.to_dict(), success=True, count=report.saved)
+
+
+def on_upload_job_finished(kind: str, result: dict = None):
+    """ジョブ完了後に原価表キャッシュと検索インデックスを更新（書き込みがなかった場合は更新しない）"""
+    if result is not None and not result.get('saved'):
+        print(f"ℹ️ 変更がないため原価表キャッシュは更新しません ({kind})")
+        return
+    refresh_cost_cache()
+
+
+# アップロードはジョブとして登録し、バックグラウンドのワーカーで処理する
+upload_job_runner = UploadJobRunner(
+    UploadJobStore(),
+    handlers={
+        'cost_master': run_cost_master_upload_job,
+        'transaction': run_transaction_upload,
+        'transaction_bulk': run_transaction_bulk_upload
+    },
+    on_finished=on_upload_job_finished
+)
+upload_job_runner.start()
+
+
+def price_policy_options() -> dict:
+    """
+    フォームの単価の集約方法（price_policy, window_days）をジョブの設定にする
+
+    Raises:
+        ValueError: 不明な集約方法、または不正な集計期間
+    """
+    price_policy = request.form.get('price_policy') or 'min'
+    window_days = request.form.get('window_days') or None
+    try:
+        window_days = int(window_days) if window_days else None
+    except ValueError:
+        raise ValueError(f"集計期間が数値ではありません: {window_days}")
+    get_price_reducer(price_policy, window_days)
+    options = {'price_policy': price_policy}
+    if window_days is not None:
+        options['window_days'] = window_days
+    return options
+
+
+def submit_upload_job(kind: str, filename: str, stream, options: dict = None):
+    """アップロードファイルをジョブとして登録し、202で受付結果を返す"""
+    job_id = upload_job_runner.submit(kind, filename, stream, options)
+    print(f"📥 アップロードジョブを登録しました: {job_id} ({kind}, {filename}, {options or {}})")
+    return jsonify({
+        "success": True,
+        "job_id": job_id,
+        "status_url": url_for('admin_job_status', job_id=job_id)
+    }), 202
+
+
 @app.route("/admin/upload-transaction", methods=['POST'])
 def admin_upload_transaction():
-    """取引データCSVファイルのアップロード（正規化対応）"""
+    """取引データCSVファイルのアップロード（正規化対応、バックグラウンドで処理）"""
     try:
         if 'file' not in request.files:
             return jsonify({"error": "ファイルが選択されていません"}), 400
@@ -491,122 +459,71 @@ def admin_upload_transaction():
         if not file.filename.lower().endswith('.csv'):
             return jsonify({"error": "CSVファイルのみアップロード可能です"}), 400
 
-        # 複数のエンコーディングを試行
-        file_content = file.read()
-        csv_data = None
-        
-        # 複数のエンコーディングを試行（日本語ファイルに最適化）
-        encodings = [
-            'shift_jis',     # 最も一般的な日本語エンコーディング
-            'cp932',         # Windows版Shift-JIS
-            'utf-8-sig',     # UTF-8 with BOM
-            'utf-8',         # UTF-8 without BOM
-            'euc-jp',        # EUC-JP
-            'iso-2022-jp'    # ISO-2022-JP
-        ]
-        
-        for encoding in encodings:
-            try:
-                file.seek(0)
-                # エラーを無視してデコードを試行
-                csv_data = file_content.decode(encoding, errors='ignore')
-                print(f"🔍 CSV file decoded as {encoding} (with error handling): {len(csv_data)} characters")
-                
-                # デコードされた内容が妥当かチェック（最低限の文字数があるか）
-                if len(csv_data.strip()) > 10:
-                    break
-                else:
-                    print(f"🔍 {encoding} decoded but content too short, trying next encoding")
-                    continue
-                    
-            except (UnicodeDecodeError, UnicodeError) as e:
-                print(f"🔍 {encoding} decode failed: {e}")
-                continue
-        
-        if csv_data is None:
-            raise ValueError(f"ファイルのエンコーディングが判別できません。試行したエンコーディング: {', '.join(encodings)}")
-
-        csv_reader = csv.reader(io.StringIO(csv_data))
-        
-        extracted_materials = {}
-        processed_count = 0
-        
-        for row in csv_reader:
-            try:
-                if not row or row[0] != 'D': continue
-
-                price_str = row[18].strip()
-                product = row[14].strip()
-                if not product or not price_str: continue
-
-                price = float(price_str.replace(',', ''))
-                if price <= 0: continue
+        return submit_upload_job('transaction', file.filename, file.stream, price_policy_options())
+    
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    except Exception as e:
+        print(f"取引データアップロードエラー: {e}")
+        import traceback
+        traceback.print_exc()
+        return jsonify({"error": f"取引データのアップロードに失敗しました: {str(e)}"}), 500
 
-                supplier = row[8].strip()
-                spec = row[15].strip()  # 規格（16列目）
-                unit_column = row[20].strip() if len(row) > 20 else ""  # 単位列（21番目、インデックス20）
-                capacity, unit, unit_column_data = extract_capacity_from_spec(spec, product, unit_column)
-                
-                # (商品名, 取引先名) のタプルをキーに重複排除
-                item_key = (product, supplier)
-                if item_key not in extracted_materials or price < extracted_materials[item_key]['price']:
-                    extracted_materials[item_key] = {
-                        'product': product,
-                        'supplier': supplier,
-                        'capacity': capacity,
-                        'unit': unit,
-                        'unit_column': unit_column_data,
-                        'spec': spec,  # 規格も保存
-                        'price': price
-                    }
-                processed_count += 1
-            except (IndexError, ValueError) as e:
-                print(f"行処理エラー（スキップ）: {e}")
-                continue
 
-        # 抽出した取引先名をDBに登録・更新
-        supplier_names = {item['supplier'] for item in extracted_materials.values() if item['supplier']}
-        if supplier_names:
-            supplier_insert_data = [{'name': name} for name in supplier_names]
-            supabase.table("suppliers").upsert(supplier_insert_data, on_conflict='name').execute()
-        
-        # 取引先名とIDのマップを作成
-        all_suppliers = supabase.table("suppliers").select("id, name").execute().data
-        supplier_name_to_id = {s['name']: s['id'] for s in all_suppliers}
-
-        # cost_masterに登録するためのデータを作成
-        items_to_upsert = []
-        for item in extracted_materials.values():
-            items_to_upsert.append({
-                'ingredient_name': item['product'],
-                'supplier_id': supplier_name_to_id.get(item['supplier']),
-                'capacity': item['capacity'],
-                'unit': item['unit'],
-                'unit_column': item['unit_column'],
-                'spec': item.get('spec', ''),  # 規格を追加
-                'unit_price': item['price'],
-                'updated_at': datetime.now().isoformat()
-            })
+@app.route("/admin/upload-transactions", methods=['POST'])
+def admin_upload_transactions():
+    """複数の取引データCSV（または CSVをまとめたzip）の一括アップロード（バックグラウンドで処理）"""
+    try:
+        files = [f for f in request.files.getlist('files') + request.files.getlist('file') if f.filename]
+        if not files:
+            return jsonify({"error": "ファイルが選択されていません"}), 400
+        if any(not f.filename.lower().endswith(('.csv', '.zip')) for f in files):
+            return jsonify({"error": "CSVファイルまたはzipファイルのみアップロード可能です"}), 400
+        if len(files) > MAX_BULK_FILES:
+            return jsonify({"error": f"ファイル数が多すぎます（最大{MAX_BULK_FILES}件）"}), 400
 
-        # データベースに一括で保存
-        saved_count = 0
-        if items_to_upsert:
-            # ingredient_name, supplier_id, capacity, unit を複合キーとして重複を判断
-            result = supabase.table('cost_master').upsert(items_to_upsert, on_conflict='ingredient_name,supplier_id,capacity,unit').execute()
-            saved_count = len(result.data)
+        try:
+            options = price_policy_options()
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        # zip1件はそのまま、それ以外は1つのzipにまとめてジョブに登録
+        if len(files) == 1 and files[0].filename.lower().endswith('.zip'):
+            if not zipfile.is_zipfile(files[0].stream):
+                return jsonify({"error": "zipファイルを読み込めません"}), 400
+            files[0].stream.seek(0)
+            return submit_upload_job('transaction_bulk', files[0].filename, files[0].stream, options)
+
+        with tempfile.SpooledTemporaryFile(max_size=16 * 1024 * 1024) as bundle:
+            with zipfile.ZipFile(bundle, 'w', zipfile.ZIP_STORED) as archive:
+                for index, f in enumerate(files):
+                    if f.filename.lower().endswith('.zip'):
+                        for name, data in iter_transaction_archive(f.stream):
+                            archive.writestr(f"{index:03d}_{name}", data)
+                    else:
+                        archive.writestr(f"{index:03d}_{os.path.basename(f.filename)}", f.stream.read())
+            bundle.seek(0)
+            return submit_upload_job('transaction_bulk', f"{len(files)}files.zip", bundle, options)
 
-        return jsonify({
-            "success": True, 
-            "processed": processed_count,
-            "extracted": len(extracted_materials),
-            "saved": saved_count
-        })
-    
+    except (ValueError, zipfile.BadZipFile) as e:
+        return jsonify({"error": f"ファイルを読み込めません: {e}"}), 400
     except Exception as e:
-        print(f"取引データアップロードエラー: {e}")
+        print(f"取引データ一括アップロードエラー: {e}")
         import traceback
         traceback.print_exc()
         return jsonify({"error": f"取引データのアップロードに失敗しました: {str(e)}"}), 500
+
+
+@app.route("/admin/jobs/<job_id>", methods=['GET'])
+def admin_job_status(job_id):
+    """アップロードジョブの進捗（解析・登録・失敗した行数とスループット）"""
+    job = upload_job_runner.store.get(job_id)
+    if not job:
+        return jsonify({"error": "ジョブが見つかりません"}), 404
+    return jsonify(job)
+
+
 @app.route("/admin/template", methods=['GET'])
 def admin_template():
     """CSVテンプレートのダウンロード"""
@@ -857,87 +774,339 @@ def admin_template_transaction():
         print(f"取引データテンプレート生成エラー: {e}")
         return jsonify({"error": "取引データテンプレートの生成に失敗しました"}), 500
 
+def compute_admin_stats() -> dict:
+    """件数はサーバー側のcount、最終更新日時はORDER BY ... LIMIT 1で取得"""
+    # 原価マスターの件数（行は1件だけ転送）
+    cost_master_result = supabase.table('cost_master').select('id', count='exact').limit(1).execute()
+    ingredients_count = cost_master_result.count or 0
+    
+    # 最新の更新日時（降順ではNULLが先頭になるため除外する）
+    latest_result = supabase.table('cost_master')\
+        .select('updated_at')\
+        .not_.is_('updated_at', 'null')\
+        .order('updated_at', desc=True)\
+        .limit(1)\
+        .execute()
+    
+    # レシピの件数
+    recipes_result = supabase.table('recipes').select('id', count='exact').limit(1).execute()
+    recipes_count = recipes_result.count or 0
+    
+    # 最終更新日時
+    last_update = None
+    if latest_result.data:
+        last_update = latest_result.data[0]['updated_at'].split('T')[0]
+    
+    return {
+        "ingredients": ingredients_count,
+        "recipes": recipes_count,
+        "last_update": last_update
+    }
+
 @app.route("/admin/stats", methods=['GET'])
 def admin_stats():
     """データベース統計情報の取得"""
     try:
-        # 原価マスターの件数
-        cost_master_result = supabase.table('cost_master').select('*').execute()
-        ingredients_count = len(cost_master_result.data) if cost_master_result.data else 0
-        
-        # レシピの件数
-        recipes_result = supabase.table('recipes').select('*').execute()
-        recipes_count = len(recipes_result.data) if recipes_result.data else 0
-        
-        # 最終更新日時
-        last_update = None
-        if cost_master_result.data:
-            # 最新のupdated_atを取得
-            latest = max(cost_master_result.data, key=lambda x: x.get('updated_at', ''))
-            last_update = latest.get('updated_at', '').split('T')[0] if latest.get('updated_at') else None
-        
-        return jsonify({
-            "ingredients": ingredients_count,
-            "recipes": recipes_count,
-            "last_update": last_update
-        })
+        return jsonify(admin_stats_cache.get_or_compute('admin_stats', compute_admin_stats))
     
     except Exception as e:
         print(f"統計取得エラー: {e}")
         return jsonify({"error": "統計情報の取得に失敗しました"}), 500
 
+# 管理画面のデータ一覧の1ページあたりの件数
+ADMIN_DATA_PAGE_SIZE = 100
+ADMIN_DATA_MAX_PAGE_SIZE = 500
+
+
+def _encode_cursor(values) -> str:
+    """キーセットのカーソルをヘッダーで渡せる文字列に変換"""
+    return base64.urlsafe_b64encode(json.dumps(values, ensure_ascii=False).encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor: Optional[str]):
+    """_encode_cursorの逆変換（不正な値はNone）"""
+    if not cursor:
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8'))
+    except (ValueError, UnicodeError):
+        return None
+
+
+def _json_default(value):
+    """Decimalなど標準のjsonで扱えない値の変換"""
+    if isinstance(value, Decimal):
+        return float(value)
+    return str(value)
+
+
+def stream_json_array(rows, headers: Optional[dict] = None) -> Response:
+    """行のリストをJSON配列として1行ずつ直列化しながら返す"""
+    def generate():
+        yield '['
+        for i, row in enumerate(rows):
+            yield (',' if i else '') + json.dumps(row, ensure_ascii=False, default=_json_default)
+        yield ']'
+    return Response(stream_with_context(generate()), mimetype='application/json', headers=headers)
+
+
+def _parse_price(value: Optional[str]) -> Optional[float]:
+    try:
+        return float(value) if value not in (None, '') else None
+    except ValueError:
+        return None
+
+
+def _cost_master_row_matches(row: dict, supplier: Optional[str], unit: Optional[str],
+                             min_price: Optional[float], max_price: Optional[float]) -> bool:
+    """列フィルターの判定（インデックスから読む場合）"""
+    if supplier and (row.get('suppliers') or {}).get('name') != supplier:
+        return False
+    if unit and row.get('unit') != unit:
+        return False
+    price = row.get('unit_price')
+    if min_price is not None and (price is None or float(price) < min_price):
+        return False
+    if max_price is not None and (price is None or float(price) > max_price):
+        return False
+    return True
+
+
+def fetch_cost_master_page(search: str, supplier: Optional[str], unit: Optional[str],
+                           min_price: Optional[float], max_price: Optional[float],
+                           after, limit: int, use_index: bool = True,
+                           columns: str = '*') -> list:
+    """
+    原価マスターを (ingredient_name, id) 順で1ページ分（limit+1件まで）取得
+    
+    インデックスが構築済みならメモリ上で絞り込み、未構築の場合（またはuse_index=False）はDBに問い合わせる。
+    どちらも文字コード順（DBの ingredient_name は照合順序C）のため、カーソルはどちらの経路でも使える。
+    """
+    index = cost_master_manager.search_index
+    if use_index and index.is_ready:
+        page = []
+        for row in index.scan(search or None, after=after):
+            if _cost_master_row_matches(row, supplier, unit, min_price, max_price):
+                page.append(row)
+                if len(page) > limit:
+                    break
+        return page
+    
+    # DBから取得（PostgRESTクライアントにor条件がないため、カーソルと同名の行はカーソル以前を読み飛ばす）
+    columns = f'{columns}, suppliers!inner(name)' if supplier else f'{columns}, suppliers(name)'
+    
+    def query():
+        query = supabase.table('cost_master').select(columns)
+        if search:
+            query = query.ilike('search_key', f'%{normalize_search_key(search)}%')
+        if supplier:
+            query = query.eq('suppliers.name', supplier)
+        if unit:
+            query = query.eq('unit', unit)
+        if min_price is not None:
+            query = query.gte('unit_price', min_price)
+        if max_price is not None:
+            query = query.lte('unit_price', max_price)
+        if after:
+            query = query.gte('ingredient_name', after[0])
+        return order_by(query, 'ingredient_name', 'id')
+    return fetch_keyset_page(query, index.sort_key, after, limit)
+
+
 @app.route("/admin/data", methods=['GET'])
 def admin_data():
-    """データベース内容の取得"""
+    """
+    データベース内容の取得（ページ単位・JSON配列をストリーミングで返す）
+    
+    クエリパラメータ:
+        table: cost_master（既定）または recipes
+        cursor: 前ページのレスポンスヘッダー X-Next-Cursor の値
+        limit: 1ページの件数
+        q: 材料名の部分一致検索（cost_masterのみ）
+        supplier / unit / min_price / max_price: 列フィルター（cost_masterのみ）
+    """
     try:
-        # 原価マスターの取得
-        cost_master_result = supabase.table('cost_master').select('*, suppliers(name)').order('ingredient_name').execute()
-        
-        # レシピの取得
-        recipes_result = supabase.table('recipes').select('*').order('created_at', desc=True).limit(20).execute()
+        try:
+            limit = max(1, min(int(request.args.get('limit', ADMIN_DATA_PAGE_SIZE)), ADMIN_DATA_MAX_PAGE_SIZE))
+        except ValueError:
+            limit = ADMIN_DATA_PAGE_SIZE
+        after = _decode_cursor(request.args.get('cursor'))
+        if not (isinstance(after, list) and len(after) == 2):
+            after = None
+        
+        if request.args.get('table') == 'recipes':
+            # レシピの取得（(created_at, id) 降順）
+            page = fetch_recipe_page(RECIPE_SUMMARY_COLUMNS, after, limit)
+            next_cursor = None
+            if len(page) > limit:
+                last = page[limit - 1]
+                next_cursor = _encode_cursor([last['created_at'], str(last['id'])])
+        else:
+            # 原価マスターの取得
+            page = fetch_cost_master_page(
+                search=request.args.get('q', '').strip(),
+                supplier=request.args.get('supplier', '').strip() or None,
+                unit=request.args.get('unit', '').strip() or None,
+                min_price=_parse_price(request.args.get('min_price')),
+                max_price=_parse_price(request.args.get('max_price')),
+                after=after,
+                limit=limit
+            )
+            next_cursor = None
+            if len(page) > limit:
+                last = page[limit - 1]
+                next_cursor = _encode_cursor([last['ingredient_name'], str(last['id'])])
         
-        return jsonify({
-            "cost_master": cost_master_result.data if cost_master_result.data else [],
-            "recipes": recipes_result.data if recipes_result.data else []
-        })
+        headers = {'X-Next-Cursor': next_cursor} if next_cursor else None
+        return stream_json_array(page[:limit], headers=headers)
     
     except Exception as e:
         print(f"データ取得エラー: {e}")
         return jsonify({"error": "データの取得に失敗しました"}), 500
 
+# エクスポート可能な列（指定がない場合はすべて出力）
+EXPORT_COLUMNS = [
+    'ingredient_name', 'supplier_name', 'capacity', 'unit', 'unit_column',
+    'spec', 'unit_price', 'transaction_date', 'updated_at'
+]
+
+# エクスポートの文字コード（cp932はExcel向け）
+EXPORT_ENCODINGS = {
+    'utf-8': 'utf-8',
+    'utf-8-sig': 'utf-8-sig',
+    'cp932': 'cp932',
+    'shift_jis': 'cp932',
+    'sjis': 'cp932'
+}
+
+# DBから1回に読み込む行数
+EXPORT_CHUNK_SIZE = 1000
+
+
+def fetch_cost_master_export_page(columns: list, after=None) -> list:
+    """エクスポート用に原価マスターを1チャンク（EXPORT_CHUNK_SIZE件まで）DBから取得"""
+    # カーソルに使う列（id, ingredient_name）は常に取得する
+    select_columns = ['id', 'ingredient_name', 'supplier_name'] + [
+        c for c in columns if c not in ('id', 'ingredient_name', 'supplier_name')
+    ]
+    # fetch_cost_master_pageは次ページ判定用にlimit+1件まで返す
+    return fetch_cost_master_page('', None, None, None, None, after=after,
+                                  limit=EXPORT_CHUNK_SIZE - 1, use_index=False,
+                                  columns=', '.join(select_columns))
+
+
+def iter_cost_master_export_rows(columns: list, first_page: list):
+    """
+    原価マスターを (ingredient_name, id) 順にチャンク単位で読み込み、出力列の値を返す
+    
+    Supabaseの最大取得件数でチャンクが短くなることがあるため、空のチャンクが返るまで読み込む。
+    次のチャンクはDBの並び順（照合順序C）で前チャンク末尾より後ろの行を読むため、チャンクの境目で
+    行が抜けることはない。
+    """
+    page = first_page
+    while page:
+        for row in page:
+            # supplier_name列が空の場合は取引先テーブルの名前を使う
+            if not row.get('supplier_name'):
+                row['supplier_name'] = (row.get('suppliers') or {}).get('name')
+            yield [row.get(column) for column in columns]
+        # カーソルはfetch_keyset_pageの読み飛ばしと同じ形（材料名, 文字列のid）にする
+        page = fetch_cost_master_export_page(columns, after=cost_master_manager.search_index.sort_key(page[-1]))
+
+
+def stream_csv(columns: list, rows, encoding: str):
+    """CSVを1チャンクずつエンコードしながら生成"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(columns)
+    pending = 0
+    for row in rows:
+        writer.writerow(['' if value is None else value for value in row])
+        pending += 1
+        if pending >= EXPORT_CHUNK_SIZE:
+            yield buffer.getvalue().encode(encoding, errors='replace')
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+            # BOMは先頭のみ
+            encoding = 'utf-8' if encoding == 'utf-8-sig' else encoding
+    yield buffer.getvalue().encode(encoding, errors='replace')
+
+
+def stream_xlsx(columns: list, rows):
+    """
+    write_onlyモードのXLSXを一時ファイルに書き出し、ブロック単位で返す
+    
+    write_onlyでは行がシートの一時ファイルへ逐次書き出されるため、
+    メモリ使用量は行数に依存しない（XLSXはZIP形式のため完成後に送信する）。
+    """
+    from openpyxl import Workbook
+    
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('cost_master')
+    sheet.append(columns)
+    for row in rows:
+        sheet.append(row)
+    
+    temp = tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False)
+    temp.close()
+    try:
+        workbook.save(temp.name)
+        with open(temp.name, 'rb') as f:
+            while True:
+                block = f.read(64 * 1024)
+                if not block:
+                    break
+                yield block
+    finally:
+        os.remove(temp.name)
+
+
 @app.route("/admin/export", methods=['GET'])
 def admin_export():
-    """データベース内容のエクスポート"""
+    """
+    データベース内容のエクスポート（DBからチャンク単位で読みながらストリーミング）
+    
+    クエリパラメータ:
+        format: csv（既定）または xlsx
+        encoding: utf-8（既定）/ utf-8-sig / cp932（CSVのみ）
+        columns: 出力する列（カンマ区切り、既定はすべて）
+    """
     try:
-        # 原価マスターの取得
-        result = supabase.table('cost_master').select('*').order('ingredient_name').execute()
-        
-        if not result.data:
+        export_format = request.args.get('format', 'csv').lower()
+        if export_format not in ('csv', 'xlsx'):
+            return jsonify({"error": "formatはcsvまたはxlsxを指定してください"}), 400
+        
+        encoding = EXPORT_ENCODINGS.get(request.args.get('encoding', 'utf-8').lower())
+        if not encoding:
+            return jsonify({"error": f"encodingは{', '.join(EXPORT_ENCODINGS)}のいずれかを指定してください"}), 400
+        
+        columns = [c.strip() for c in request.args.get('columns', '').split(',') if c.strip()] or EXPORT_COLUMNS
+        unknown = [c for c in columns if c not in EXPORT_COLUMNS]
+        if unknown:
+            return jsonify({"error": f"不明な列です: {', '.join(unknown)}"}), 400
+        
+        # 最初のチャンクだけ先に読み込み、データがない場合はエラーを返す
+        first_page = fetch_cost_master_export_page(columns)
+        if not first_page:
             return jsonify({"error": "エクスポートするデータがありません"}), 404
         
-        # CSVファイルの生成
-        output = io.StringIO()
-        fieldnames = ['ingredient_name', 'capacity', 'unit', 'unit_price']
-        writer = csv.DictWriter(output, fieldnames=fieldnames)
-        writer.writeheader()
-        
-        for row in result.data:
-            writer.writerow({
-                'ingredient_name': row.get('ingredient_name', ''),
-                'capacity': row.get('capacity', 1),
-                'unit': row.get('unit', ''),
-                'unit_price': row.get('unit_price', 0)
-            })
-        
-        csv_content = output.getvalue()
-        output.close()
-        
-        # ファイルとして返す
-        return send_file(
-            io.BytesIO(csv_content.encode('utf-8')),
-            mimetype='text/csv',
-            as_attachment=True,
-            download_name=f'cost_master_export_{datetime.now().strftime("%Y%m%d")}.csv'
+        rows = iter_cost_master_export_rows(columns, first_page)
+        filename = f'cost_master_export_{datetime.now().strftime("%Y%m%d")}'
+        if export_format == 'xlsx':
+            body = stream_xlsx(columns, rows)
+            content_type = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+            filename += '.xlsx'
+        else:
+            body = stream_csv(columns, rows, encoding)
+            charset = 'Shift_JIS' if encoding == 'cp932' else 'utf-8'
+            content_type = f'text/csv; charset={charset}'
+            filename += '.csv'
+        
+        return Response(
+            stream_with_context(body),
+            content_type=content_type,
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'}
         )
     
     except Exception as e:
@@ -981,7 +1150,7 @@ def debug_test_ai():
         
         return jsonify({
             "success": True,
-            "ai_provider": ai_provider,
+            "ai_provider": groq_parser.ai_provider,
             "test_ocr_text": test_ocr_text,
             "parsed_recipe": recipe_data,
             "debug_info": {
@@ -1055,9 +1224,8 @@ def debug_switch_ai():
         # DBに設定を保存
         set_ai_provider(new_provider)
         
-        # グローバル変数を更新
-        global groq_parser
-        groq_parser = GroqRecipeParser(ai_provider=new_provider)
+        # AI解析エンジンを作り直す
+        groq_parser.reset(GroqRecipeParser(ai_provider=new_provider))
         
         return jsonify({
             "success": True,
@@ -1251,11 +1419,13 @@ def admin_clear():
             supabase.table('ingredients').delete().neq('ingredient_name', '').execute()
             supabase.table('recipes').delete().neq('recipe_name', '').execute()
             deleted_items.append('保存レシピ')
+            admin_stats_cache.invalidate()
         
         if clear_cost_master:
             # 原価マスターのクリア
             supabase.table('cost_master').delete().neq('ingredient_name', '').execute()
             deleted_items.append('登録材料')
+            refresh_cost_cache()
         
         if not deleted_items:
             return jsonify({"error": "削除するデータが選択されていません"}), 400
@@ -1287,10 +1457,9 @@ def ingredient_form():
             if response.data:
                 ingredient_data = response.data[0]
                 # 取引先情報も取得
-                if ingredient_data.get('supplier_id'):
-                    supplier_response = supabase.table('suppliers').select('name').eq('id', ingredient_data['supplier_id']).execute()
-                    if supplier_response.data:
-                        ingredient_data['suppliers'] = supplier_response.data[0]
+                supplier_name = supplier_cache.get_name(ingredient_data.get('supplier_id'))
+                if supplier_name:
+                    ingredient_data['suppliers'] = {'name': supplier_name}
         
         return render_template('ingredient_form.html', 
                              is_edit=is_edit, 
@@ -1348,24 +1517,13 @@ def submit_ingredient_form():
                                  error_message="容量または単価の値が不正です",
                                  csrf_token=csrf.generate_csrf if csrf else None)
         
-        # 取引先の処理
-        supplier_id = None
-        if supplier_name:
-            # 取引先が存在するかチェック
-            supplier_response = supabase.table('suppliers').select('id').eq('name', supplier_name).execute()
-            if supplier_response.data:
-                supplier_id = supplier_response.data[0]['id']
-            else:
-                # 新規取引先を作成
-                new_supplier = supabase.table('suppliers').insert({
-                    'name': supplier_name,
-                    'created_at': datetime.now().isoformat()
-                }).execute()
-                supplier_id = new_supplier.data[0]['id']
+        # 取引先の処理（キャッシュにない場合のみ登録してIDを取得）
+        supplier_id = supplier_cache.get_id(supplier_name) if supplier_name else None
         
         # データベースに保存
         data = {
             'ingredient_name': ingredient_name,
+            'search_key': normalize_search_key(ingredient_name),
             'capacity': capacity,
             'unit': unit,
             'unit_column': unit_column,
@@ -1385,6 +1543,15 @@ def submit_ingredient_form():
             result = supabase.table('cost_master').insert(data).execute()
             success_message = f"「{ingredient_name}」を追加しました"
         
+        # 単価履歴に記録
+        record_cost_master_history([data], 'form')
+        
+        # 原価表キャッシュと検索インデックスを更新
+        try:
+            refresh_cost_cache()
+        except Exception as e:
+            print(f"原価表キャッシュの更新エラー: {e}")
+        
         return render_template('ingredient_form.html',
                              is_edit=False,
                              ingredient_data=None,
@@ -1413,6 +1580,7 @@ def callback():
     signature = request.headers['X-Line-Signature']
     body = request.get_data(as_text=True)
     
+    from linebot.v3.exceptions import InvalidSignatureError
     try:
         handler.handle(body, signature)
     except InvalidSignatureError:
@@ -1421,7 +1589,6 @@ def callback():
     return 'OK'
 
 
-@handler.add(MessageEvent, message=ImageMessageContent)
 
 
 def handle_image_message(event):
@@ -1711,7 +1878,8 @@ def handle_image_message(event):
             'servings': recipe_data['servings'],
 
 
-            'cost_result': cost_result,
+            # 原価計算結果は保存済みレシピから復元する（load_cost_result）
+            'recipe_id': recipe_id,
 
 
             'timestamp': datetime.now().isoformat()
@@ -1786,7 +1954,6 @@ def handle_image_message(event):
         ))
 
 
-@handler.add(MessageEvent, message=TextMessageContent)
 def handle_text_message(event):
     """テキストメッセージの処理"""
     text = event.message.text.strip()
@@ -1880,77 +2047,16 @@ def handle_text_message(event):
 
 
 def create_add_ingredient_flex_message(search_term):
-    """新規材料追加用のFlex Messageを作成"""
+    """新規材料追加用のFlex Messageを作成（事前検証済みテンプレートに差し込み）"""
     try:
-        # コンテンツを構築
-        contents = []
-        
-        # タイトル
-        contents.append({
-            "type": "text",
-            "text": "➕ 新規材料追加",
-            "weight": "bold",
-            "size": "lg",
-            "color": "#FF6B6B"
-        })
-        
-        # 材料名
-        contents.append({
-            "type": "text",
-            "text": f"材料名: {search_term}",
-            "size": "md",
-            "color": "#333333",
-            "margin": "md"
-        })
-        
-        # 説明
-        contents.append({
-            "type": "text",
-            "text": "この材料は原価表に登録されていません。\nボタンをタップしてフォームで追加してください。",
-            "size": "sm",
-            "color": "#666666",
-            "margin": "md",
-            "wrap": True
-        })
-        
-        # フッター（入力フォーム用ボタン）
-        add_form_url = "https://recipe-management-nd00.onrender.com/ingredient/form"
-        footer_contents = [{
-            "type": "button",
-            "style": "primary",
-            "height": "sm",
-            "action": {
-                "type": "uri",
-                "label": "📝 材料を追加",
-                "uri": add_form_url
-            }
-        }]
-        
-        # Flex Messageを構築
-        flex_container = {
-            "type": "bubble",
-            "body": {
-                "type": "box",
-                "layout": "vertical",
-                "contents": contents,
-                "paddingAll": "16px"
-            },
-            "footer": {
-                "type": "box",
-                "layout": "vertical",
-                "contents": footer_contents,
-                "paddingAll": "8px"
-            }
-        }
-        
-        return flex_container
+        return ADD_INGREDIENT_BUBBLE.render(search_term=search_term)
         
     except Exception as e:
         print(f"新規追加Flex Message作成エラー: {e}")
         return None
 
 def create_ingredient_flex_message(cost, is_single=True):
-    """材料情報のFlex Messageを作成"""
+    """材料情報のFlex Messageを作成（事前検証済みテンプレートに差し込み）"""
     try:
         # データを取得
         ingredient_name = cost['ingredient_name']
@@ -1976,18 +2082,6 @@ def create_ingredient_flex_message(cost, is_single=True):
         # 単価表示
         unit_price = int(unit_price) if unit_price == int(unit_price) else unit_price
         
-        # コンテンツを構築
-        contents = []
-        
-        # 材料名
-        contents.append({
-            "type": "text",
-            "text": ingredient_name,
-            "weight": "bold",
-            "size": "lg",
-            "color": "#1DB446"
-        })
-        
         # 詳細情報
         details = []
         if capacity_str:
@@ -2001,57 +2095,41 @@ def create_ingredient_flex_message(cost, is_single=True):
         if spec:
             details.append(f"規格: {spec}")
         
-        contents.append({
-            "type": "text",
-            "text": "\n".join(details),
-            "size": "sm",
-            "color": "#666666",
-            "wrap": True
-        })
-        
-        # フッター（修正ボタン）
-        form_url = f"https://recipe-management-nd00.onrender.com/ingredient/form?id={cost['id']}"
-        footer_contents = [{
-            "type": "button",
-            "style": "primary",
-            "height": "sm",
-            "action": {
-                "type": "uri",
-                "label": "📝 修正",
-                "uri": form_url
-            }
-        }]
-        
-        # Flex Messageを構築
-        flex_container = {
-            "type": "bubble",
-            "body": {
-                "type": "box",
-                "layout": "vertical",
-                "contents": contents,
-                "paddingAll": "16px"
-            },
-            "footer": {
-                "type": "box",
-                "layout": "vertical",
-                "contents": footer_contents,
-                "paddingAll": "8px"
-            }
-        }
-        
-        return flex_container
+        # 事前検証済みテンプレートに差し込み
+        return INGREDIENT_BUBBLE.render(
+            ingredient_name=ingredient_name,
+            details="\n".join(details),
+            id=cost['id']
+        )
         
     except Exception as e:
         print(f"Flex Message作成エラー: {e}")
         return None
 
-def handle_search_ingredient(event, search_term: str):
+# 検索結果カルーセルのバブル数（LINEの上限は12件。続きがある場合は1枠を「もっと見る」に使う）
+SEARCH_CAROUSEL_MAX_BUBBLES = 12
+SEARCH_RESULTS_PER_PAGE = SEARCH_CAROUSEL_MAX_BUBBLES - 1
+
+
+def create_search_more_bubble(search_term, next_offset):
+    """検索結果の続きを表示するPostbackボタン付きバブルを作成"""
+    return SEARCH_MORE_BUBBLE.render(
+        search_term=search_term,
+        # Postbackデータは300文字以内
+        data=f"search_more:{next_offset}:{search_term}"[:300]
+    )
+
+
+def handle_search_ingredient(event, search_term: str, offset: int = 0):
     """
     材料名検索の処理
     例: 「トマト」と入力すると関連する材料を検索
+    
+    複数件ヒットした場合は1つのカルーセルにまとめて1回のreplyで返信し、
+    続きは「もっと見る」Postbackでページ送りする
     """
     try:
-        print(f"🔍 材料検索開始: '{search_term}'")
+        print(f"🔍 材料検索開始: '{search_term}' (offset={offset})")
         
         # 検索キーワードが短すぎる場合はスキップ
         if len(search_term) < 2:
@@ -2062,12 +2140,19 @@ def handle_search_ingredient(event, search_term: str):
             ))
             return
         
-        # 材料名で検索
+        # 材料名で検索（続きの有無を判定するため1件多く取得）
         print(f"🔍 データベース検索実行: '{search_term}'")
-        results = cost_master_manager.search_costs(search_term, limit=5)
+        results = cost_master_manager.search_costs(search_term, limit=SEARCH_RESULTS_PER_PAGE + 1, offset=offset)
         print(f"📊 検索結果: {len(results) if results else 0}件")
         
         if not results:
+            if offset > 0:
+                line_bot_api.reply_message(ReplyMessageRequest(
+                    reply_token=event.reply_token,
+                    messages=[TextMessage(text=f"「{search_term}」の検索結果はこれ以上ありません。")]
+                ))
+                return
+            
             # 材料が見つからない場合のFlex Messageを作成
             add_flex_container = create_add_ingredient_flex_message(search_term)
             
@@ -2076,7 +2161,7 @@ def handle_search_ingredient(event, search_term: str):
                     reply_token=event.reply_token,
                     messages=[FlexMessage(
                         alt_text=f"「{search_term}」の新規追加",
-                        contents=FlexContainer.from_dict(add_flex_container)
+                        contents=add_flex_container
                     )]
                 ))
             else:
@@ -2098,7 +2183,7 @@ def handle_search_ingredient(event, search_term: str):
             return
         
         # 結果をFlex Messageで送信
-        if len(results) == 1:
+        if len(results) == 1 and offset == 0:
             # 完全一致または1件のみの場合
             cost = results[0]
             
@@ -2110,7 +2195,7 @@ def handle_search_ingredient(event, search_term: str):
                     reply_token=event.reply_token,
                     messages=[FlexMessage(
                         alt_text=f"「{search_term}」の検索結果",
-                        contents=FlexContainer.from_dict(flex_container)
+                        contents=flex_container
                     )]
                 ))
             else:
@@ -2120,32 +2205,28 @@ def handle_search_ingredient(event, search_term: str):
                     messages=[TextMessage(text=f"「{search_term}」の検索結果を取得しましたが、表示に失敗しました。")]
                 ))
         else:
-            # 複数候補がある場合もFlex Messageで統一表示
-            # 検索結果の件数を最初に送信
-            line_bot_api.reply_message(ReplyMessageRequest(
-                reply_token=event.reply_token,
-                messages=[TextMessage(text=f"🔍 「{search_term}」の検索結果（{len(results)}件）")]
-            ))
+            # 複数候補がある場合は1つのカルーセルにまとめてreplyで送信（pushは使わない）
+            has_more = len(results) > SEARCH_RESULTS_PER_PAGE
+            page_results = results[:SEARCH_RESULTS_PER_PAGE]
             
-            # 各材料をFlex Messageで送信（最大5件まで）
-            for i, cost in enumerate(results[:5], 1):
+            bubbles = []
+            for cost in page_results:
                 flex_container = create_ingredient_flex_message(cost, is_single=False)
-                
                 if flex_container:
-                    line_bot_api.push_message(PushMessageRequest(
-                        to=event.source.user_id,
-                        messages=[FlexMessage(
-                            alt_text=f"「{search_term}」の検索結果 {i}",
-                            contents=FlexContainer.from_dict(flex_container)
-                        )]
-                    ))
+                    bubbles.append(flex_container)
             
-            # 6件以上ある場合は追加情報を送信
-            if len(results) > 5:
-                line_bot_api.push_message(PushMessageRequest(
-                    to=event.source.user_id,
-                    messages=[TextMessage(text=f"... 他{len(results) - 5}件あります。より具体的な材料名で検索してください。")]
-                ))
+            if has_more:
+                bubbles.append(create_search_more_bubble(search_term, offset + SEARCH_RESULTS_PER_PAGE))
+            
+            first = offset + 1
+            last = offset + len(page_results)
+            line_bot_api.reply_message(ReplyMessageRequest(
+                reply_token=event.reply_token,
+                messages=[FlexMessage(
+                    alt_text=f"🔍 「{search_term}」の検索結果（{first}〜{last}件目）",
+                    contents=FlexCarousel(contents=bubbles)
+                )]
+            ))
         
     except Exception as e:
         print(f"❌ 材料検索エラー: {e}")
@@ -2207,13 +2288,14 @@ def handle_add_cost_command(event, text: str):
             cost_data['capacity'],
             cost_data['unit'],
             cost_data['unit_price'],
-            ""  # unit_columnは空文字列（LINEからの追加では使用しない）
+            "",  # unit_columnは空文字列（LINEからの追加では使用しない）
+            on_written=lambda items: record_cost_master_history(items, 'line')
         )
         
         if success:
             # 原価計算機のキャッシュも更新
             try:
-                cost_calculator.load_cost_master()
+                refresh_cost_cache()
             except:
                 pass
             
@@ -2314,18 +2396,19 @@ def handle_delete_cost_command(event, text: str):
             return
         
         # 削除実行
-        success = cost_master_manager.delete_cost(ingredient_name)
+        # 検索キーで一致した行の正式な材料名で削除する
+        success = cost_master_manager.delete_cost(cost_info['ingredient_name'])
         
         if success:
             # 原価計算機のキャッシュも更新
             try:
-                cost_calculator.load_cost_master()
+                refresh_cost_cache()
             except:
                 pass
             
             line_bot_api.reply_message(ReplyMessageRequest(
                 reply_token=event.reply_token,
-                messages=[TextMessage(text=f"✅ 「{ingredient_name}」を原価表から削除しました。")]
+                messages=[TextMessage(text=f"✅ 「{cost_info['ingredient_name']}」を原価表から削除しました。")]
             ))
         else:
             line_bot_api.reply_message(ReplyMessageRequest(
@@ -2399,10 +2482,21 @@ def handle_list_cost_command(event):
         ))
 
 
+# PostgRESTの「関数が見つからない」エラー（スキーマキャッシュにない・DBに存在しない）
+MISSING_FUNCTION_ERROR_CODES = ('PGRST202', '42883')
+
+
+def is_missing_function_error(error: Exception) -> bool:
+    """RPCの関数が未作成（マイグレーション未適用）によるエラーかどうか"""
+    return getattr(error, 'code', None) in MISSING_FUNCTION_ERROR_CODES
+
+
 def save_recipe_to_supabase(recipe_name: str, servings: int, total_cost: float, ingredients: list, recipe_id: Optional[str] = None) -> str:
     """
     レシピをSupabaseに保存または更新
     
+    レシピ本体と材料はRPC（save_recipe_with_ingredients）で1往復・1トランザクションで保存する。
+    
     Args:
         recipe_name: 料理名
         servings: 何人前
@@ -2413,6 +2507,34 @@ def save_recipe_to_supabase(recipe_name: str, servings: int, total_cost: float,
     Returns:
         保存または更新されたレシピのID
     """
+    ingredient_rows = [{
+        'ingredient_name': ingredient['name'],
+        'quantity': ingredient['quantity'],
+        'unit': ingredient['unit'],
+        'cost': ingredient.get('cost'), # costはcalculate_recipe_costで設定される
+        'capacity': ingredient.get('capacity', 1),
+        'capacity_unit': ingredient.get('capacity_unit', '個'),
+        'cost_master_id': ingredient.get('cost_master_id')
+    } for ingredient in ingredients]
+    
+    try:
+        result = supabase.rpc('save_recipe_with_ingredients', {
+            'p_recipe_id': recipe_id,
+            'p_recipe_name': recipe_name,
+            'p_servings': servings,
+            'p_total_cost': total_cost,
+            'p_ingredients': ingredient_rows
+        }).execute()
+        saved_id = result.data
+        print(f"レシピを保存しました: {saved_id}（材料{len(ingredient_rows)}件）")
+        return saved_id
+    except Exception as e:
+        # 保存済みの可能性があるエラー（タイムアウトなど）や制約違反で二重保存しないよう、
+        # マイグレーション未適用でRPCが存在しない場合のみ一括insertで保存する
+        if not is_missing_function_error(e):
+            raise
+        print(f"⚠️ レシピ保存RPCが未作成のため、一括insertで保存します: {e}")
+    
     recipe_data_to_save = {
         'recipe_name': recipe_name,
         'servings': servings,
@@ -2431,18 +2553,13 @@ def save_recipe_to_supabase(recipe_name: str, servings: int, total_cost: float,
         recipe_id = recipe_response.data[0]['id']
         print(f"レシピを保存しました: {recipe_id}")
     
-    # 材料テーブルに保存
-    for ingredient in ingredients:
-        ingredient_data = {
-            'recipe_id': recipe_id,
-            'ingredient_name': ingredient['name'],
-            'quantity': ingredient['quantity'],
-            'unit': ingredient['unit'],
-            'cost': ingredient.get('cost'), # costはcalculate_recipe_costで設定される
-            'capacity': ingredient.get('capacity', 1),
-            'capacity_unit': ingredient.get('capacity_unit', '個')
-        }
-        supabase.table('ingredients').insert(ingredient_data).execute()
+    # 材料テーブルに一括で保存
+    if ingredient_rows:
+        # cost_master_id列がない古いスキーマでも保存できるよう除く（次の再計算で照合し直す）
+        supabase.table('ingredients').insert([
+            dict({k: v for k, v in row.items() if k != 'cost_master_id'}, recipe_id=recipe_id)
+            for row in ingredient_rows
+        ]).execute()
     
     return recipe_id
 
@@ -2458,107 +2575,13 @@ def create_recipe_review_flex_message(recipe_data, user_id):
             unit = ingredient.get('unit', '')
             ingredients_text += f"{i}. {name} {quantity}{unit}\n"
         
-        # FlexMessageのコンテナを作成
-        flex_container = {
-            "type": "bubble",
-            "body": {
-                "type": "box",
-                "layout": "vertical",
-                "contents": [
-                    {
-                        "type": "text",
-                        "text": "📋 レシピ解析結果",
-                        "weight": "bold",
-                        "size": "lg",
-                        "color": "#1DB446"
-                    },
-                    {
-                        "type": "separator",
-                        "margin": "md"
-                    },
-                    {
-                        "type": "box",
-                        "layout": "vertical",
-                        "margin": "md",
-                        "contents": [
-                            {
-                                "type": "text",
-                                "text": f"料理名: {recipe_data.get('recipe_name', 'カスタムレシピ')}",
-                                "weight": "bold",
-                                "size": "md"
-                            },
-                            {
-                                "type": "text",
-                                "text": f"人数: {recipe_data.get('servings', 2)}人前",
-                                "size": "sm",
-                                "color": "#666666"
-                            }
-                        ]
-                    },
-                    {
-                        "type": "separator",
-                        "margin": "md"
-                    },
-                    {
-                        "type": "box",
-                        "layout": "vertical",
-                        "margin": "md",
-                        "contents": [
-                            {
-                                "type": "text",
-                                "text": "材料リスト:",
-                                "weight": "bold",
-                                "size": "sm"
-                            },
-                            {
-                                "type": "text",
-                                "text": ingredients_text.strip(),
-                                "size": "sm",
-                                "wrap": True,
-                                "margin": "sm"
-                            }
-                        ]
-                    }
-                ]
-            },
-            "footer": {
-                "type": "box",
-                "layout": "vertical",
-                "spacing": "sm",
-                "contents": [
-                    {
-                        "type": "button",
-                        "style": "primary",
-                        "height": "sm",
-                        "action": {
-                            "type": "postback",
-                            "label": "💰 原価計算する",
-                            "data": f"calculate_cost:{user_id}"
-                        }
-                    },
-                    {
-                        "type": "button",
-                        "style": "secondary",
-                        "height": "sm",
-                        "action": {
-                            "type": "postback",
-                            "label": "✏️ 材料を修正",
-                            "data": f"edit_recipe:{user_id}"
-                        }
-                    },
-                    {
-                        "type": "button",
-                        "style": "secondary",
-                        "height": "sm",
-                        "action": {
-                            "type": "postback",
-                            "label": "💾 そのまま登録",
-                            "data": f"save_recipe:{user_id}"
-                        }
-                    }
-                ]
-            }
-        }
+        # 事前検証済みテンプレートに差し込み
+        flex_container = RECIPE_REVIEW_BUBBLE.render(
+            recipe_name=recipe_data.get('recipe_name', 'カスタムレシピ'),
+            servings=recipe_data.get('servings', 2),
+            ingredients_text=ingredients_text.strip(),
+            user_id=user_id
+        )
         
         # レシピデータを一時保存
         set_user_state(user_id, {
@@ -2572,7 +2595,7 @@ def create_recipe_review_flex_message(recipe_data, user_id):
             to=user_id,
             messages=[FlexMessage(
                 alt_text="レシピ解析結果の確認",
-                contents=FlexContainer.from_dict(flex_container)
+                contents=flex_container
             )]
         ))
         
@@ -2759,7 +2782,11 @@ def interpret_follow_up(user_text, recipe_name):
 def answer_follow_up(intent, state):
     """解釈された意図に基づいて回答を生成する"""
     recipe_name = state.get('recipe_name', 'そのレシピ')
-    cost_result = state.get('cost_result', {})
+    cost_result = state.get('cost_result')
+    if cost_result is None and state.get('recipe_id'):
+        # コンパクト形式ではcost_resultをrecipe_id経由で保存済みレシピから復元する
+        cost_result = load_cost_result(supabase, state['recipe_id'])
+    cost_result = cost_result or {}
     servings = state.get('servings', 1)
     servings = servings if servings > 0 else 1
 
@@ -2829,7 +2856,6 @@ def send_confirmation(event, ingredient_name, price):
         messages=[TextMessage(text=reply_text)]
     ))
 
-@handler.add(PostbackEvent)
 def handle_postback_event(event):
     """Postbackイベントの処理（レシピ確認・修正用）"""
     try:
@@ -2847,6 +2873,10 @@ def handle_postback_event(event):
         elif data.startswith("save_recipe:"):
             # レシピをそのまま保存
             handle_save_recipe_postback(event, user_id)
+        elif data.startswith("search_more:"):
+            # 材料検索結果の続きを表示
+            _, next_offset, search_term = data.split(":", 2)
+            handle_search_ingredient(event, search_term, offset=int(next_offset))
         else:
             line_bot_api.reply_message(ReplyMessageRequest(
                 reply_token=event.reply_token,
@@ -2896,8 +2926,7 @@ def handle_calculate_cost_postback(event, user_id):
         new_state = {
             'last_action': 'cost_calculated',
             'recipe_data': recipe_data, # recipe_dataは更新されたもの
-            'cost_result': cost_result,
-            'recipe_id': recipe_id, # recipe_idを保存
+            'recipe_id': recipe_id, # 原価計算結果はrecipe_idから復元する（load_cost_result）
             'timestamp': datetime.now().isoformat()
         }
         set_user_state(user_id, new_state)
@@ -3061,7 +3090,8 @@ def save_edited_ingredients():
                         capacity=capacity,
                         unit=unit,
                         unit_price=unit_price,
-                        unit_column="" # フォームからの追加では使用しない
+                        unit_column="", # フォームからの追加では使用しない
+                        on_written=lambda items: record_cost_master_history(items, 'recipe_edit')
                     )
             i += 1
 
@@ -3098,25 +3128,67 @@ def save_edited_ingredients():
         return redirect(url_for('edit_recipe_ingredients', user_id=user_id, error_message=f"材料の保存中にエラーが発生しました: {str(e)}"))
 
 
+# レシピ一覧の1ページあたりの件数
+RECIPES_PER_PAGE = 20
+
+# 一覧表示用の列（サマリーモードでは材料を読み込まない）
+RECIPE_SUMMARY_COLUMNS = 'id, recipe_name, servings, total_cost, created_at'
+
+
+def fetch_recipe_page(columns: str, after, limit: int) -> list:
+    """
+    レシピを (created_at, id) 降順で1ページ分（limit+1件まで）取得
+    
+    created_atが同じレシピがページの境目にあっても読み落とさないよう、idも含めたキーセットで送る。
+    """
+    def query():
+        query = supabase.table('recipes').select(columns)
+        if after:
+            query = query.lte('created_at', after[0])
+        return order_by(query, 'created_at', 'id', desc=True)
+    return fetch_keyset_page(query, lambda row: (row['created_at'], str(row['id'])), after, limit, desc=True)
+
+
 @app.route("/recipes", methods=['GET'])
 def view_recipes():
+    """
+    レシピ一覧（(created_at, id) 降順のキーセットページネーション）
+    
+    クエリパラメータ:
+        before: 前ページ末尾の (created_at, id) のカーソル
+        summary: 1の場合は材料を読み込まない
+        limit: 1ページの件数（最大100）
+    """
+    after = _decode_cursor(request.args.get('before'))
+    if not (isinstance(after, list) and len(after) == 2):
+        after = None
+    summary = request.args.get('summary') == '1'
     try:
-        # Supabaseからすべてのレシピを取得
-        recipes_response = supabase.table('recipes').select('*').order('created_at', desc=True).execute()
-        recipes_data = recipes_response.data
-
-        # 各レシピの材料を取得
-        for recipe in recipes_data:
-            ingredients_response = supabase.table('ingredients').select('*').eq('recipe_id', recipe['id']).execute()
-            recipe['ingredients'] = ingredients_response.data
-
-        return render_template('view_recipes.html', recipes=recipes_data)
+        limit = max(1, min(int(request.args.get('limit', RECIPES_PER_PAGE)), 100))
+    except ValueError:
+        limit = RECIPES_PER_PAGE
+    
+    try:
+        # レシピと材料を1回の埋め込みselectで取得
+        columns = RECIPE_SUMMARY_COLUMNS if summary else f'{RECIPE_SUMMARY_COLUMNS}, ingredients(*)'
+        recipes_data = fetch_recipe_page(columns, after, limit)
+        
+        # 1件多く取得して次ページの有無を判定
+        next_cursor = None
+        if len(recipes_data) > limit:
+            recipes_data = recipes_data[:limit]
+            last = recipes_data[-1]
+            next_cursor = _encode_cursor([last['created_at'], str(last['id'])])
+        
+        return render_template('view_recipes.html', recipes=recipes_data, summary=summary,
+                               next_cursor=next_cursor, limit=limit)
 
     except Exception as e:
         print(f"❌ レシピ一覧表示エラー: {e}")
         import traceback
         traceback.print_exc()
-        return render_template('view_recipes.html', recipes=[], error_message=f"レシピの取得中にエラーが発生しました: {str(e)}")
+        return render_template('view_recipes.html', recipes=[], summary=summary,
+                               error_message=f"レシピの取得中にエラーが発生しました: {str(e)}")
 
 
 @app.route("/recipe/<recipe_id>", methods=['GET'])
@@ -3144,11 +3216,143 @@ def view_recipe_detail(recipe_id):
         return "レシピの取得に失敗しました", 500
 
 
+@app.route("/api/recipe-cost/<recipe_id>", methods=['GET'])
+def recipe_cost_as_of(recipe_id):
+    """保存済みレシピの原価を指定日（as_of=YYYY-MM-DD、省略時は今日）時点の単価で計算"""
+    try:
+        as_of_param = request.args.get('as_of')
+        try:
+            as_of = date.fromisoformat(as_of_param) if as_of_param else date.today()
+        except ValueError:
+            return jsonify({"success": False, "error": "as_ofはYYYY-MM-DD形式で指定してください"}), 400
+
+        recipe_response = supabase.table('recipes').select('id, recipe_name, servings, total_cost').eq('id', recipe_id).execute()
+        if not recipe_response.data:
+            return jsonify({"success": False, "error": "レシピが見つかりません"}), 404
+        recipe = recipe_response.data[0]
+
+        ingredients_response = supabase.table('ingredients').select('ingredient_name, quantity, unit').eq('recipe_id', recipe_id).order('ingredient_name').execute()
+        ingredients = [
+            {'name': row['ingredient_name'], 'quantity': row['quantity'], 'unit': row['unit']}
+            for row in ingredients_response.data or []
+        ]
+
+        result = cost_calculator.calculate_recipe_cost(ingredients, as_of=as_of)
+        return jsonify({
+            "success": True,
+            "recipe_id": recipe['id'],
+            "recipe_name": recipe['recipe_name'],
+            "servings": recipe['servings'],
+            "as_of": as_of.isoformat(),
+            "total_cost": result['total_cost'],
+            "saved_total_cost": recipe.get('total_cost'),
+            "ingredients": result['ingredients_with_cost'],
+            "missing_ingredients": result['missing_ingredients']
+        })
+
+    except Exception as e:
+        print(f"❌ レシピ原価（日付指定）の計算エラー: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+# /api/cost/batch で1回に指定できるレシピ数
+MAX_BATCH_RECIPES = 200
+
+
+@app.route("/api/cost/batch", methods=['POST'])
+def cost_recipe_batch_api():
+    """
+    複数の保存レシピ（献立・製造計画）の原価と、原価表の行ごとの仕入れ量をまとめて計算
+
+    JSON: {"recipes": [{"recipe_id": "...", "multiplier": 3}, ...]}（multiplier省略時は1、同じレシピは合算）
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        entries = data.get('recipes')
+        if not isinstance(entries, list) or not entries:
+            return jsonify({"success": False, "error": "recipesにレシピを1件以上指定してください"}), 400
+        multipliers = {}
+        try:
+            for entry in entries:
+                recipe_id = entry.get('recipe_id') if isinstance(entry, dict) else entry
+                multiplier = Decimal(str(float(entry.get('multiplier', 1)))) if isinstance(entry, dict) else Decimal('1')
+                if not recipe_id or not isinstance(recipe_id, str) or not multiplier.is_finite() or multiplier <= 0:
+                    raise ValueError
+                # UUIDでない値はDBの型エラー（22P02）になるため、ここで400にする
+                recipe_id = str(uuid.UUID(recipe_id))
+                multipliers[recipe_id] = multipliers.get(recipe_id, Decimal('0')) + multiplier
+        except (TypeError, ValueError):
+            return jsonify({"success": False, "error": "recipe_id（UUID）と正の倍数（multiplier）を指定してください"}), 400
+        if len(multipliers) > MAX_BATCH_RECIPES:
+            return jsonify({"success": False, "error": f"レシピ数が多すぎます（最大{MAX_BATCH_RECIPES}件）"}), 400
+
+        recipes = load_recipes_by_id(supabase, multipliers)
+        terms = build_cost_terms(cost_calculator, load_recipe_ingredients(supabase, multipliers))
+        result = cost_recipe_batch(recipes, terms, cost_calculator.cost_master, multipliers,
+                                   supplier_names=supplier_cache.names_by_id())
+        found = {recipe['id'] for recipe in recipes}
+        return jsonify(dict(result, success=True, not_found=[recipe_id for recipe_id in multipliers if recipe_id not in found]))
+
+    except Exception as e:
+        print(f"❌ 複数レシピの原価計算エラー: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
+@app.route("/api/cost/simulate", methods=['POST'])
+def simulate_cost_changes():
+    """
+    単価を変えた場合の保存レシピの原価をメモリ上で計算（DBには書き込まない）
+
+    JSON: {"overrides": [{"ingredient_name": "バター", "percent": 15},
+                         {"cost_master_id": "...", "unit_price": 480}],
+           "selling_prices": {"レシピID": 売価}, "threshold_percent": 30, "limit": 100}
+    """
+    try:
+        started = time.perf_counter()
+        data = request.get_json(silent=True) or {}
+        overrides = data.get('overrides')
+        if not isinstance(overrides, list) or not overrides:
+            return jsonify({"success": False, "error": "overridesに単価の変更を1件以上指定してください"}), 400
+        try:
+            selling_prices = {recipe_id: float(price) for recipe_id, price in (data.get('selling_prices') or {}).items()}
+            threshold_percent = float(data['threshold_percent']) if data.get('threshold_percent') is not None else None
+            limit = int(data.get('limit', 100))
+        except (AttributeError, TypeError, ValueError):
+            return jsonify({"success": False, "error": "selling_prices・threshold_percent・limitの形式が正しくありません"}), 400
+
+        model = recipe_cost_model_cache.get_or_compute(
+            'model', lambda: RecipeCostModel.load(supabase, cost_calculator))
+        try:
+            new_prices, unmatched = model.resolve_overrides(overrides)
+        except ValueError as e:
+            return jsonify({"success": False, "error": str(e)}), 400
+
+        report = model.delta_report(new_prices, selling_prices, threshold_percent)
+        return jsonify({
+            "success": True,
+            "recipes": report[:limit] if limit > 0 else report,
+            "summary": {
+                "recipes": len(model),
+                "affected": len(report),
+                "cost_master_rows_changed": len(new_prices),
+                "total_delta": round(sum(entry['delta'] for entry in report), 2),
+                "crossed_up": sum(1 for entry in report if entry.get('crosses_threshold') == 'up'),
+                "crossed_down": sum(1 for entry in report if entry.get('crosses_threshold') == 'down')
+            },
+            "unmatched_overrides": unmatched,
+            "elapsed_ms": round((time.perf_counter() - started) * 1000, 1)
+        })
+
+    except Exception as e:
+        print(f"❌ 単価シミュレーションエラー: {e}")
+        return jsonify({"success": False, "error": str(e)}), 500
+
+
 @app.route("/api/get-cost-master/<ingredient_name>", methods=['GET'])
 def get_cost_master(ingredient_name):
     """材料名からcost_masterの情報を取得"""
     try:
-        result = supabase.table('cost_master').select('*').eq('ingredient_name', ingredient_name).execute()
+        result = supabase.table('cost_master').select('*').eq('search_key', normalize_search_key(ingredient_name)).execute()
         
         if result.data:
             return jsonify({
@@ -3168,6 +3372,78 @@ def get_cost_master(ingredient_name):
             "error": str(e)
         }), 500
 
+def record_ingredient_cost_history(cost_master_id, ingredient_name: str, capacity, capacity_unit: str, unit_price):
+    """原価更新RPCが選んだcost_masterの行（取引先IDはその行の値）の単価を単価履歴に記録"""
+    supplier_id = None
+    if cost_master_id:
+        try:
+            response = supabase.table('cost_master').select('supplier_id').eq('id', cost_master_id).execute()
+            if response.data:
+                supplier_id = response.data[0].get('supplier_id')
+        except Exception as e:
+            print(f"⚠️ 単価履歴の取引先の取得エラー: {e}")
+    record_cost_master_history([{
+        'ingredient_name': ingredient_name,
+        'supplier_id': supplier_id,
+        'capacity': capacity,
+        'unit': capacity_unit,
+        'unit_price': unit_price
+    }], 'ingredient_cost')
+
+
+def update_ingredient_cost_without_rpc(ingredient_id, ingredient_name, new_ingredient_name, cost,
+                                       quantity_value, quantity_unit, capacity, capacity_unit, unit_price):
+    """材料の原価の更新（update_ingredient_cost RPCが使えない場合の個別の更新）"""
+    # 材料の原価、分量、単位、材料名を更新（ユーザー入力の値をそのまま使用）
+    update_data = {
+        'cost': cost,
+        'quantity': quantity_value,  # 計算用の数値
+        'unit': quantity_unit        # 抽出した単位
+    }
+    
+    # 材料名が変更されている場合は更新
+    if new_ingredient_name and new_ingredient_name != ingredient_name:
+        update_data['ingredient_name'] = new_ingredient_name
+        ingredient_name = new_ingredient_name
+    
+    supabase.table('ingredients').update(update_data).eq('id', ingredient_id).execute()
+    
+    # cost_masterに材料情報を追加/更新（ユーザー入力の値をそのまま使用）
+    try:
+        cost_master_manager.add_or_update_cost(
+            ingredient_name=ingredient_name,
+            capacity=capacity,              # ユーザー入力の容量（1000）
+            unit=capacity_unit,             # ユーザー入力の容量単位（g）
+            unit_price=unit_price,          # ユーザー入力の単価（350）
+            unit_column=capacity_unit,      # ユーザー入力の容量単位（g）
+            on_written=lambda items: record_cost_master_history(items, 'ingredient_cost')
+        )
+        print(f"✅ cost_masterに材料を追加/更新: {ingredient_name} (容量:{capacity}{capacity_unit}, 単価:{unit_price}円)")
+    except Exception as e:
+        print(f"⚠️ cost_master更新エラー: {e}")
+        # cost_masterの更新に失敗しても材料の原価更新は続行
+    
+    # レシピの合計原価を再計算
+    try:
+        recipe_response = supabase.table('ingredients').select('recipe_id').eq('id', ingredient_id).execute()
+        if recipe_response.data:
+            recipe_id = recipe_response.data[0]['recipe_id']
+            
+            # レシピの全材料の原価を合計
+            ingredients_response = supabase.table('ingredients').select('cost').eq('recipe_id', recipe_id).execute()
+            total_cost = sum(float(ingredient.get('cost', 0)) if ingredient.get('cost') is not None else 0 for ingredient in ingredients_response.data)
+            
+            # レシピの合計原価を更新
+            supabase.table('recipes').update({
+                'total_cost': total_cost
+            }).eq('id', recipe_id).execute()
+            
+            print(f"✅ レシピの合計原価を更新: ¥{total_cost:.2f}")
+    except Exception as e:
+        print(f"⚠️ 合計原価計算エラー: {e}")
+        # 合計原価計算に失敗しても材料更新は成功とする
+
+
 @app.route("/api/update-ingredient-cost", methods=['POST'])
 def update_ingredient_cost():
     """材料の原価を更新するAPI"""
@@ -3232,53 +3508,38 @@ def update_ingredient_cost():
         # 原価を計算 (単価 × 分量の数値 / 容量)
         cost = unit_price * quantity_value / capacity
         
-        # 材料の原価、分量、単位、材料名を更新（ユーザー入力の値をそのまま使用）
-        update_data = {
-            'cost': cost,
-            'quantity': quantity_value,  # 計算用の数値
-            'unit': quantity_unit        # 抽出した単位
-        }
-        
-        # 材料名が変更されている場合は更新
-        if new_ingredient_name and new_ingredient_name != ingredient_name:
-            update_data['ingredient_name'] = new_ingredient_name
-            ingredient_name = new_ingredient_name
-        
-        supabase.table('ingredients').update(update_data).eq('id', ingredient_id).execute()
-        
-        # cost_masterに材料情報を追加/更新（ユーザー入力の値をそのまま使用）
+        # 原価表の追加・更新、材料の更新、レシピの合計原価の差分更新を1回のRPCで行う
         try:
-            cost_master_manager.add_or_update_cost(
-                ingredient_name=ingredient_name,
-                capacity=capacity,              # ユーザー入力の容量（1000）
-                unit=capacity_unit,             # ユーザー入力の容量単位（g）
-                unit_price=unit_price,          # ユーザー入力の単価（350）
-                unit_column=capacity_unit       # ユーザー入力の容量単位（g）
-            )
-            print(f"✅ cost_masterに材料を追加/更新: {ingredient_name} (容量:{capacity}{capacity_unit}, 単価:{unit_price}円)")
+            result = supabase.rpc('update_ingredient_cost', {
+                'p_ingredient_id': ingredient_id,
+                'p_quantity': quantity_value,       # 計算用の数値
+                'p_unit': quantity_unit,            # 抽出した単位
+                'p_cost': cost,
+                'p_ingredient_name': ingredient_name,
+                'p_search_key': normalize_search_key(ingredient_name),
+                'p_capacity': capacity,             # ユーザー入力の容量（1000）
+                'p_capacity_unit': capacity_unit,   # ユーザー入力の容量単位（g）
+                'p_unit_price': unit_price          # ユーザー入力の単価（350）
+            }).execute()
+            if not result.data:
+                return jsonify({"success": False, "error": "材料が見つかりません"}), 404
+            print(f"✅ 材料の原価を更新: {ingredient_name} (容量:{capacity}{capacity_unit}, 単価:{unit_price}円), "
+                  f"レシピの合計原価: ¥{float(result.data.get('total_cost') or 0):.2f}")
+            record_ingredient_cost_history(result.data.get('cost_master_id'), ingredient_name, capacity,
+                                           capacity_unit, unit_price)
         except Exception as e:
-            print(f"⚠️ cost_master更新エラー: {e}")
-            # cost_masterの更新に失敗しても材料の原価更新は続行
-        
-        # レシピの合計原価を再計算
+            # RPCのエラー（制約違反など）は個別の更新で隠さず、マイグレーション未適用でRPCがない場合のみ個別に更新
+            if not is_missing_function_error(e):
+                raise
+            print(f"⚠️ 原価更新RPCが未作成のため、個別に更新します: {e}")
+            update_ingredient_cost_without_rpc(ingredient_id, ingredient_name, new_ingredient_name, cost,
+                                               quantity_value, quantity_unit, capacity, capacity_unit, unit_price)
+        
+        # 原価表キャッシュと検索インデックスを更新（単価が変わった行を使う他の保存レシピも再計算される）
         try:
-            recipe_response = supabase.table('ingredients').select('recipe_id').eq('id', ingredient_id).execute()
-            if recipe_response.data:
-                recipe_id = recipe_response.data[0]['recipe_id']
-                
-                # レシピの全材料の原価を合計
-                ingredients_response = supabase.table('ingredients').select('cost').eq('recipe_id', recipe_id).execute()
-                total_cost = sum(float(ingredient.get('cost', 0)) if ingredient.get('cost') is not None else 0 for ingredient in ingredients_response.data)
-                
-                # レシピの合計原価を更新
-                supabase.table('recipes').update({
-                    'total_cost': total_cost
-                }).eq('id', recipe_id).execute()
-                
-                print(f"✅ レシピの合計原価を更新: ¥{total_cost:.2f}")
+            refresh_cost_cache()
         except Exception as e:
-            print(f"⚠️ 合計原価計算エラー: {e}")
-            # 合計原価計算に失敗しても材料更新は成功とする
+            print(f"原価表キャッシュの更新エラー: {e}")
         
         return jsonify({
             "success": True,
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+単価シミュレーション（recipe_costing.RecipeCostModel）のベンチマーク
+
+合成した原価表と保存レシピで、原価モデルの作成時間と、単価を変えた場合の
+原価の再計算（差分レポート）の時間を、材料ごとに原価計算をやり直す方式と比較する。
+DBには接続しない。
+
+使い方: python benchmark_cost_simulation.py [レシピ数] [1レシピあたりの材料数] [原価表の行数]
+"""
+import random
+import sys
+import time
+from decimal import Decimal
+from cost_calculator import CostCalculator
+from recipe_costing import RecipeCostModel, build_cost_terms
+from search_index import normalize_search_key
+
+
+def make_data(recipe_count, ingredients_per_recipe, master_count, seed=0):
+    """合成データ（原価表の行・レシピ・材料）を作る"""
+    rng = random.Random(seed)
+    units = [('g', 'g', 1000), ('kg', 'g', 1), ('ml', 'ml', 1000), ('個', '個', 10)]
+    cost_master = []
+    for i in range(master_count):
+        master_unit, recipe_unit, capacity = units[i % len(units)]
+        name = f'材料{i}'
+        cost_master.append({
+            'id': f'm{i}', 'ingredient_name': name, 'search_key': normalize_search_key(name),
+            'unit': master_unit, 'capacity': Decimal(capacity), 'unit_price': Decimal(rng.randint(100, 3000)),
+            'supplier_id': None
+        })
+    recipes = [{'id': f'r{i}', 'recipe_name': f'レシピ{i}', 'servings': 2, 'total_cost': 0}
+               for i in range(recipe_count)]
+    ingredients = []
+    for recipe in recipes:
+        for master in rng.sample(cost_master, ingredients_per_recipe):
+            recipe_unit = next(unit for master_unit, unit, _ in units if master_unit == master['unit'])
+            ingredients.append({
+                'id': f"{recipe['id']}-{master['id']}", 'recipe_id': recipe['id'],
+                'ingredient_name': master['ingredient_name'], 'quantity': rng.randint(1, 300),
+                'unit': recipe_unit, 'cost_master_id': master['id']
+            })
+    return cost_master, recipes, ingredients
+
+
+def main():
+    recipe_count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    ingredients_per_recipe = int(sys.argv[2]) if len(sys.argv) > 2 else 12
+    master_count = int(sys.argv[3]) if len(sys.argv) > 3 else 3000
+    cost_master, recipes, ingredients = make_data(recipe_count, ingredients_per_recipe, master_count)
+    calculator = CostCalculator(None)
+    calculator.cost_master = cost_master
+    print(f"=== レシピ{recipe_count:,}件 × 材料{ingredients_per_recipe}件、原価表{master_count:,}行 ===")
+
+    start = time.perf_counter()
+    model = RecipeCostModel(recipes, build_cost_terms(calculator, ingredients), cost_master)
+    print(f"{'原価モデルの作成（係数の計算）':<36} {(time.perf_counter() - start) * 1000:10.1f} ms")
+
+    overrides = [{'ingredient_name': '材料1', 'percent': 15}, {'ingredient_name': '材料2', 'percent': -5},
+                 {'cost_master_id': 'm3', 'unit_price': 999}]
+    start = time.perf_counter()
+    new_prices, _ = model.resolve_overrides(overrides)
+    report = model.delta_report(new_prices)
+    after = time.perf_counter() - start
+    print(f"{'シミュレーション（変えた行の材料のみ）':<36} {after * 1000:10.1f} ms  影響レシピ{len(report):,}件")
+
+    # 比較: 単価を書き換えたコピーで全材料の原価を計算し直す
+    start = time.perf_counter()
+    changed = {row['id']: dict(row, unit_price=Decimal(str(new_prices[row['id']]))) if row['id'] in new_prices else row
+               for row in cost_master}
+    totals = {}
+    for row in ingredients:
+        master = changed[row['cost_master_id']]
+        cost = calculator.cost_from_master_row(master, row['ingredient_name'], row['quantity'], row['unit'])
+        totals[row['recipe_id']] = totals.get(row['recipe_id'], Decimal('0')) + (cost or 0)
+    before = time.perf_counter() - start
+    print(f"{'全材料の再計算':<36} {before * 1000:10.1f} ms")
+    print(f"{'':<36} {before / after:10.1f} 倍")
+
+    mismatched = [entry for entry in report if abs(float(totals[entry['recipe_id']]) - entry['simulated_cost']) > 0.011]
+    print(f"再計算との不一致: {len(mismatched)}件")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""
+Flex Message 生成コストのマイクロベンチマーク
+
+従来方式（毎回dictを組み立てて FlexContainer.from_dict で検証）と
+事前検証済みテンプレートへの差し込み（flex_templates）を比較する。
+
+使い方: python benchmark_flex_messages.py [回数]
+"""
+import sys
+import time
+from linebot.v3.messaging import FlexContainer
+from flex_templates import APP_BASE_URL, INGREDIENT_BUBBLE, RECIPE_REVIEW_BUBBLE
+
+
+def legacy_ingredient_bubble(name, details, cost_id):
+    """従来の create_ingredient_flex_message と同じ構造のdict"""
+    return {
+        "type": "bubble",
+        "body": {
+            "type": "box",
+            "layout": "vertical",
+            "contents": [
+                {"type": "text", "text": name, "weight": "bold", "size": "lg", "color": "#1DB446"},
+                {"type": "text", "text": details, "size": "sm", "color": "#666666", "wrap": True}
+            ],
+            "paddingAll": "16px"
+        },
+        "footer": {
+            "type": "box",
+            "layout": "vertical",
+            "contents": [{
+                "type": "button",
+                "style": "primary",
+                "height": "sm",
+                "action": {"type": "uri", "label": "📝 修正", "uri": f"{APP_BASE_URL}/ingredient/form?id={cost_id}"}
+            }],
+            "paddingAll": "8px"
+        }
+    }
+
+
+def legacy_recipe_review_bubble(values):
+    """従来の create_recipe_review_flex_message と同じ構造のdict（テンプレートの検証用dictを再利用）"""
+    container = RECIPE_REVIEW_BUBBLE.render(**values)
+    return container.to_dict()
+
+
+def measure(label, func, iterations):
+    func()  # ウォームアップ
+    start = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    elapsed = time.perf_counter() - start
+    per_message = elapsed / iterations * 1_000_000
+    print(f"{label:<40} {per_message:10.1f} µs/件")
+    return per_message
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    details = "容量: 500\n単位: PC\n単価: ¥1200\n取引先: ABC食品\n規格: 500g×12"
+    review_values = {
+        'recipe_name': 'フランボワーズムース',
+        'servings': 4,
+        'ingredients_text': "\n".join(f"{i}. 材料{i} 100g" for i in range(1, 21)),
+        'user_id': 'U0123456789abcdef0123456789abcdef'
+    }
+    review_dict = legacy_recipe_review_bubble(review_values)
+
+    print(f"=== Flex Message 生成コスト（{iterations}回平均）===")
+    before = measure("材料バブル: dict + from_dict", lambda: FlexContainer.from_dict(
+        legacy_ingredient_bubble('ﾎﾞﾝｼﾞｭｰﾙ', details, 'abc-123')), iterations)
+    after = measure("材料バブル: テンプレート差し込み", lambda: INGREDIENT_BUBBLE.render(
+        ingredient_name='ﾎﾞﾝｼﾞｭｰﾙ', details=details, id='abc-123'), iterations)
+    print(f"{'':<40} {before / after:10.1f} 倍")
+
+    before = measure("レシピ確認: dict + from_dict", lambda: FlexContainer.from_dict(review_dict), iterations)
+    after = measure("レシピ確認: テンプレート差し込み", lambda: RECIPE_REVIEW_BUBBLE.render(**review_values), iterations)
+    print(f"{'':<40} {before / after:10.1f} 倍")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+規格からの容量抽出（extract_capacity_from_spec）のベンチマーク
+
+従来方式（単位ごとの正規表現を優先順位順に re.search）と
+事前コンパイルした1つの正規表現で1回だけ走査する方式（spec_parser）を、
+取引データCSV（set20250911.csv 形式）の行で比較する。
+
+使い方: python benchmark_spec_parser.py [CSVファイル] [行数]
+"""
+import csv
+import re
+import sys
+import time
+from encoding_detector import open_text_stream
+from spec_parser import extract_capacity_from_spec, parse_capacity
+
+
+def legacy_extract_capacity_from_spec(spec_text, product_name="", unit_column=""):
+    """従来の extract_capacity_from_spec と同じ処理"""
+    if not spec_text:
+        spec_text = ""
+    spec_cleaned = re.sub(r'×\d+$', '', spec_text.strip())
+    patterns = [
+        (r'(\d+(?:\.\d+)?)\s*kg', lambda m: (float(m.group(1)) * 1000, 'g')),
+        (r'(\d+(?:\.\d+)?)\s*g', lambda m: (float(m.group(1)), 'g')),
+        (r'(\d+(?:\.\d+)?)\s*L', lambda m: (float(m.group(1)) * 1000, 'ml')),
+        (r'(\d+(?:\.\d+)?)\s*ml', lambda m: (float(m.group(1)), 'ml')),
+        (r'(\d+(?:\.\d+)?)\s*pc', lambda m: (float(m.group(1)), 'pc')),
+        (r'(\d+(?:\d+)?)\s*個', lambda m: (float(m.group(1)), '個')),
+        (r'(\d+(?:\.\d+)?)\s*本', lambda m: (float(m.group(1)), '本')),
+        (r'(\d+(?:\.\d+)?)\s*枚', lambda m: (float(m.group(1)), '枚')),
+        (r'(\d+(?:\.\d+)?)\s*p', lambda m: (float(m.group(1)), 'p')),
+    ]
+    for pattern, converter in patterns:
+        match = re.search(pattern, spec_cleaned, re.IGNORECASE)
+        if match:
+            capacity, unit = converter(match)
+            return (capacity, unit, unit_column)
+    if product_name:
+        for pattern, converter in patterns:
+            match = re.search(pattern, product_name, re.IGNORECASE)
+            if match:
+                capacity, unit = converter(match)
+                return (capacity, unit, unit_column)
+    return (1, '個', unit_column)
+
+
+def load_rows(path):
+    """取引データCSVの明細行（D行）から (規格, 商品名, 単位列) を読み込む"""
+    with open(path, 'rb') as f:
+        text, _ = open_text_stream(f)
+        rows = []
+        for row in csv.reader(text):
+            if len(row) > 20 and row[0] == 'D':
+                rows.append((row[15].strip(), row[14].strip(), row[20].strip()))
+    return rows
+
+
+def measure(label, func, rows):
+    func(*rows[0])  # ウォームアップ
+    start = time.perf_counter()
+    for row in rows:
+        func(*row)
+    elapsed = time.perf_counter() - start
+    rows_per_second = len(rows) / elapsed
+    print(f"{label:<40} {rows_per_second:12,.0f} 行/秒")
+    return rows_per_second
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else 'set20250911.csv'
+    sample = load_rows(path)
+    if not sample:
+        print(f"明細行がありません: {path}")
+        return
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 100_000
+    rows = (sample * (count // len(sample) + 1))[:count]
+
+    # 結果が従来と異なる行（全角単位・×入数・桁区切りなどの改善による差分）を表示
+    differences = [(spec, product, legacy_extract_capacity_from_spec(spec, product, unit)[:2],
+                    extract_capacity_from_spec(spec, product, unit)[:2])
+                   for spec, product, unit in sample
+                   if legacy_extract_capacity_from_spec(spec, product, unit) != extract_capacity_from_spec(spec, product, unit)]
+    print(f"=== {path}: 明細{len(sample)}行中、従来と結果が異なる行 {len(differences)}件 ===")
+    for spec, product, before, after in differences[:10]:
+        print(f"  {product} / {spec}: {before} → {after}")
+
+    print(f"=== 容量抽出（{len(rows):,}行）===")
+    before = measure("従来: 単位ごとに re.search", legacy_extract_capacity_from_spec, rows)
+    uncached = parse_capacity.__wrapped__
+    after = measure("1回の走査（キャッシュなし）", lambda spec, product, unit: uncached(spec, product), rows)
+    print(f"{'':<40} {after / before:12.1f} 倍")
+    parse_capacity.cache_clear()
+    after = measure("1回の走査（キャッシュあり）", extract_capacity_from_spec, rows)
+    print(f"{'':<40} {after / before:12.1f} 倍")
+
+
+if __name__ == "__main__":
+    main()
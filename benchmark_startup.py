@@ -0,0 +1,82 @@
+#!/usr/bin/env python3
+"""
+起動時間（app.pyのimport）のベンチマーク
+
+新しいプロセスで app をimportし、importにかかった時間、最初の /health の応答時間、
+import後に読み込まれている重いモジュール（openai, groq, openpyxl, xlrd, linebot）を表示する。
+-X importtime の結果から、時間のかかったモジュールの上位も表示する。
+環境変数（.env）は通常の起動と同じものを使う。
+
+参考（開発環境、ディスクキャッシュ済み）: LINE SDKの遅延読み込み前は約1.5〜1.8秒（うちlinebot.v3が約0.7秒）、
+遅延読み込み後は約0.43秒。残りの大半は起動時に作るSupabaseクライアント（supabase/postgrest/httpx、約0.2秒）と
+Flask・requestsのimportで、各モジュールが型注釈のために supabase.Client をimportしているため削っていない。
+
+使い方: python benchmark_startup.py [回数]
+"""
+import json
+import subprocess
+import sys
+
+HEAVY_MODULES = ('openai', 'groq', 'openpyxl', 'xlrd', 'linebot')
+
+CHILD_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+response = app.app.test_client().get('/health')
+health = time.perf_counter()
+print(json.dumps({
+    'import_ms': (imported - start) * 1000,
+    'health_ms': (health - imported) * 1000,
+    'health_status': response.status_code,
+    'loaded': [name for name in %r if name in sys.modules]
+}))
+""" % (HEAVY_MODULES,)
+
+
+def run_child(extra_args=()):
+    result = subprocess.run([sys.executable, *extra_args, '-c', CHILD_SCRIPT],
+                            capture_output=True, text=True, timeout=300)
+    lines = [line for line in result.stdout.splitlines() if line.startswith('{')]
+    if result.returncode != 0 or not lines:
+        print(result.stderr[-2000:])
+        raise SystemExit("app のimportに失敗しました")
+    return json.loads(lines[-1]), result.stderr
+
+
+def slowest_imports(stderr, top=10):
+    """-X importtime の出力から累積時間の長いトップレベルのモジュールを返す"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or '|' not in line:
+            continue
+        parts = [part.strip() for part in line[len('import time:'):].split('|')]
+        if len(parts) != 3 or not parts[1].isdigit():
+            continue
+        name = parts[2]
+        # トップレベルの読み込みのみ（インデントなし、パッケージ名の先頭）
+        if name == name.lstrip() and '.' not in name:
+            rows.append((int(parts[1]) / 1000, name))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 3
+    results = [run_child()[0] for _ in range(count)]
+    import_ms = sorted(result['import_ms'] for result in results)[len(results) // 2]
+    health_ms = sorted(result['health_ms'] for result in results)[len(results) // 2]
+    print(f"=== app のimport（{count}回の中央値）===")
+    print(f"{'import':<28} {import_ms:10.1f} ms")
+    print(f"{'最初の /health':<28} {health_ms:10.1f} ms  (status={results[-1]['health_status']})")
+    loaded = results[-1]['loaded']
+    print(f"{'import後に読み込み済みの重いモジュール':<28} {', '.join(loaded) if loaded else 'なし'}")
+
+    _, stderr = run_child(('-X', 'importtime'))
+    print("=== 時間のかかったモジュール（-X importtime、累積）===")
+    for elapsed_ms, name in slowest_imports(stderr):
+        print(f"{name:<28} {elapsed_ms:10.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
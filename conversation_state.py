@@ -0,0 +1,248 @@
+"""
+会話状態（conversation_state）のコンパクト化と期限切れ行の掃除を担当するモジュール
+"""
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from supabase import Client
+
+# コンパクト形式のバージョン（形式を変える場合はインクリメントする）
+STATE_VERSION = 1
+
+# 材料1件をタプル化する際のフィールド順
+INGREDIENT_FIELDS = ('name', 'quantity', 'unit', 'capacity', 'capacity_unit', 'unit_price')
+
+# recipe_dataのうち専用キーで保持するもの
+_RECIPE_KEYS = ('recipe_name', 'servings', 'ingredients')
+
+# 状態の最上位キーのうち専用キーで保持するもの
+# cost_resultは保存しない（recipe_id経由でingredientsテーブルから復元する）
+_STATE_KEYS = ('last_action', 'timestamp', 'recipe_data', 'recipe_id', 'cost_result')
+
+
+def _pack_ingredient(ingredient: Dict) -> List:
+    """材料の辞書を末尾のNoneを省いたリストに変換"""
+    packed = [ingredient.get(field) for field in INGREDIENT_FIELDS]
+    while packed and packed[-1] is None:
+        packed.pop()
+    extra = {k: v for k, v in ingredient.items() if k not in INGREDIENT_FIELDS}
+    if extra:
+        # 想定外のキーも失わないよう末尾に辞書で付与する
+        packed.extend([None] * (len(INGREDIENT_FIELDS) - len(packed)))
+        packed.append(extra)
+    return packed
+
+
+def _unpack_ingredient(packed: List) -> Dict:
+    """_pack_ingredientの逆変換"""
+    ingredient = {}
+    for i, field in enumerate(INGREDIENT_FIELDS):
+        if i < len(packed) and packed[i] is not None:
+            ingredient[field] = packed[i]
+    if len(packed) > len(INGREDIENT_FIELDS) and isinstance(packed[-1], dict):
+        ingredient.update(packed[-1])
+    return ingredient
+
+
+def compact_state(state: Dict) -> Dict:
+    """
+    会話状態をDB保存用のコンパクト形式に変換
+
+    材料リストは1回だけ保存し、cost_resultはrecipe_idがある場合は保存しない。
+    recipe_idがない場合は材料ごとの原価だけを並びを揃えて保持する。
+
+    Returns:
+        {"v": 1, "a": last_action, "t": timestamp, "n": 料理名, "s": 人数,
+         "i": [[name, quantity, unit, capacity, capacity_unit, unit_price], ...],
+         "r": recipe_id}
+    """
+    if not state:
+        return {}
+
+    compact = {'v': STATE_VERSION}
+    if state.get('last_action') is not None:
+        compact['a'] = state['last_action']
+    if state.get('timestamp') is not None:
+        compact['t'] = state['timestamp']
+
+    recipe_data = state.get('recipe_data')
+    if recipe_data:
+        compact['n'] = recipe_data.get('recipe_name')
+        compact['s'] = recipe_data.get('servings')
+        compact['i'] = [_pack_ingredient(ing) for ing in recipe_data.get('ingredients', [])]
+        recipe_extra = {k: v for k, v in recipe_data.items() if k not in _RECIPE_KEYS}
+        if recipe_extra:
+            compact['rx'] = recipe_extra
+
+    if state.get('recipe_id'):
+        compact['r'] = state['recipe_id']
+    elif state.get('cost_result'):
+        # レシピ未保存の場合のみ、材料ごとの原価を並び順で保持する
+        cost_result = state['cost_result']
+        cost_rows = cost_result.get('ingredients_with_cost', [])
+        base_names = [ing.get('name') for ing in (recipe_data or {}).get('ingredients', [])]
+        if not recipe_data or [row.get('name') for row in cost_rows] != base_names:
+            # 材料リストと並びが一致しない場合のみ原価側の材料も保持する
+            compact['ci'] = [
+                _pack_ingredient({k: v for k, v in row.items() if k != 'cost'})
+                for row in cost_rows
+            ]
+        compact['c'] = [row.get('cost') for row in cost_rows]
+        compact['ct'] = cost_result.get('total_cost')
+
+    extra = {k: v for k, v in state.items() if k not in _STATE_KEYS}
+    if extra:
+        compact['x'] = extra
+    return compact
+
+
+def expand_state(compact: Optional[Dict]) -> Dict:
+    """
+    compact_stateの逆変換（旧形式の状態はそのまま返す）
+
+    recipe_idを持つ状態のcost_resultは復元しないため、
+    必要な場合はload_cost_resultで取得すること。
+    """
+    if not compact:
+        return {}
+    if compact.get('v') != STATE_VERSION:
+        return compact
+
+    state = dict(compact.get('x', {}))
+    if 'a' in compact:
+        state['last_action'] = compact['a']
+    if 't' in compact:
+        state['timestamp'] = compact['t']
+
+    ingredients = [_unpack_ingredient(packed) for packed in compact.get('i', [])]
+    if 'n' in compact or 's' in compact:
+        recipe_data = dict(compact.get('rx', {}))
+        recipe_data['recipe_name'] = compact.get('n')
+        recipe_data['servings'] = compact.get('s')
+        recipe_data['ingredients'] = ingredients
+        state['recipe_data'] = recipe_data
+
+    if compact.get('r'):
+        state['recipe_id'] = compact['r']
+    elif 'c' in compact:
+        if 'ci' in compact:
+            cost_rows = [_unpack_ingredient(packed) for packed in compact['ci']]
+        else:
+            cost_rows = ingredients
+        state['cost_result'] = _build_cost_result(
+            [dict(ing, cost=cost) for ing, cost in zip(cost_rows, compact['c'])],
+            compact.get('ct')
+        )
+    return state
+
+
+def _build_cost_result(ingredients_with_cost: List[Dict], total_cost: Optional[float] = None) -> Dict:
+    """calculate_recipe_costと同じ形のcost_resultを組み立てる"""
+    rows = []
+    missing = []
+    for ing in ingredients_with_cost:
+        rows.append({
+            'name': ing.get('name'),
+            'quantity': ing.get('quantity'),
+            'unit': ing.get('unit'),
+            'cost': ing.get('cost'),
+            'capacity': ing.get('capacity'),
+            'capacity_unit': ing.get('capacity_unit')
+        })
+        if ing.get('cost') is None:
+            missing.append(ing.get('name'))
+    if total_cost is None:
+        total_cost = sum(float(row['cost']) for row in rows if row['cost'] is not None)
+    return {
+        'ingredients_with_cost': rows,
+        'total_cost': float(total_cost),
+        'missing_ingredients': missing
+    }
+
+
+def load_cost_result(supabase: Client, recipe_id: str) -> Optional[Dict]:
+    """
+    保存済みレシピからcost_resultを復元
+
+    Returns:
+        calculate_recipe_costと同じ形の辞書。レシピが存在しない場合はNone。
+    """
+    try:
+        response = supabase.table('recipes')\
+            .select('total_cost, ingredients(ingredient_name, quantity, unit, cost, capacity, capacity_unit)')\
+            .eq('id', recipe_id)\
+            .execute()
+        if not response.data:
+            return None
+        recipe = response.data[0]
+        ingredients = [
+            dict(row, name=row.get('ingredient_name'))
+            for row in recipe.get('ingredients') or []
+        ]
+        return _build_cost_result(ingredients, recipe.get('total_cost') or 0)
+    except Exception as e:
+        print(f"原価計算結果の復元エラー: {e}")
+        return None
+
+
+class ConversationStateSweeper:
+    """期限切れの会話状態をバッチで削除するバックグラウンドジョブ"""
+
+    def __init__(self, supabase_client: Client, ttl_seconds: Optional[int] = None,
+                 interval_seconds: Optional[int] = None, batch_size: int = 500):
+        self.supabase: Client = supabase_client
+        self.ttl_seconds = ttl_seconds or int(os.getenv('CONVERSATION_STATE_TTL_SECONDS', 24 * 60 * 60))
+        self.interval_seconds = interval_seconds or int(os.getenv('CONVERSATION_STATE_SWEEP_INTERVAL_SECONDS', 15 * 60))
+        self.batch_size = batch_size
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def sweep_once(self) -> int:
+        """
+        updated_atがTTLより古い行を削除
+
+        Returns:
+            削除した行数
+        """
+        cutoff = (datetime.now(timezone.utc) - timedelta(seconds=self.ttl_seconds)).isoformat()
+        deleted = 0
+        try:
+            while True:
+                expired = self.supabase.table('conversation_state')\
+                    .select('user_id')\
+                    .lt('updated_at', cutoff)\
+                    .limit(self.batch_size)\
+                    .execute()
+                user_ids = [row['user_id'] for row in expired.data or []]
+                if not user_ids:
+                    break
+                self.supabase.table('conversation_state').delete().in_('user_id', user_ids).execute()
+                deleted += len(user_ids)
+                if len(user_ids) < self.batch_size:
+                    break
+        except Exception as e:
+            print(f"会話状態の掃除エラー: {e}")
+        if deleted:
+            print(f"🧹 期限切れの会話状態を削除しました: {deleted}件")
+        return deleted
+
+    def start(self):
+        """掃除ジョブをデーモンスレッドで開始（二重起動はしない）"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='conversation-state-sweeper', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """掃除ジョブを停止"""
+        self._stop_event.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            self.sweep_once()
+            elapsed = time.monotonic() - started
+            self._stop_event.wait(max(1.0, self.interval_seconds - elapsed))
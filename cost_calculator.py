@@ -1,36 +1,58 @@
 """Supabaseから原価表を読み込み、材料ごとに原価を計算するモジュール"""
 
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
+from datetime import date
 from decimal import Decimal, InvalidOperation
 from supabase import Client
+from search_index import normalize_search_key
+from price_history import PriceHistoryIndex
+from supabase_paging import fetch_all
 
 class CostCalculator:
     def __init__(self, supabase_client: Client):
         self.supabase: Client = supabase_client
         self.cost_master: Dict[str, Dict] = {}
+        # 単価履歴の索引（過去の日付で原価を計算する時に読み込む）
+        self.price_history: Optional[PriceHistoryIndex] = None
+
+    def get_price_history(self) -> PriceHistoryIndex:
+        """単価履歴の索引を返す（未読み込みの場合はDBから読み込む）"""
+        if self.price_history is None:
+            try:
+                self.price_history = PriceHistoryIndex.load(self.supabase)
+                print(f"単価履歴を読み込みました: {len(self.price_history)}件")
+            except Exception as e:
+                print(f"単価履歴の読み込みエラー: {e}")
+                return PriceHistoryIndex()
+        return self.price_history
 
     def load_cost_master(self):
         """
         Supabaseデータベーステーブルから原価表を読み込み、メモリにキャッシュ
         """
         try:
-            response = self.supabase.table('cost_master').select('*').execute()
+            # PostgRESTの最大取得件数を超えても全件読み込めるようにid順でページ取得する
+            rows = fetch_all(lambda: self.supabase.table('cost_master').select('*').order('id'))
             
-            if not response.data:
+            if not rows:
                 print("原価マスターにデータがありません。")
                 self.cost_master = [] # Change to list
                 return
 
-            self.cost_master = [] # Change to list
-            for row in response.data:
+            # 読み込み中の行をバックグラウンドの再計算から見せないよう、読み込み後に入れ替える
+            cost_master = []
+            for row in rows:
                 # 各行をそのままリストに追加
                 try:
                     # Decimal型に変換しておく
                     row['unit_price'] = Decimal(str(row['unit_price'])) if row.get('unit_price') is not None else Decimal('0')
                     row['capacity'] = Decimal(str(row['capacity'])) if row.get('capacity') is not None else Decimal('1')
-                    self.cost_master.append(row)
+                    # 材料名の照合は正規化済みの検索キーで行う
+                    row['search_key'] = row.get('search_key') or normalize_search_key(row.get('ingredient_name', ''))
+                    cost_master.append(row)
                 except (InvalidOperation, TypeError) as e:
                     print(f"原価マスターの行変換エラー（スキップ）: {e}, Row: {row}")
+            self.cost_master = cost_master
             
             print(f"原価表をDBから読み込みました: {len(self.cost_master)}件")
             
@@ -38,13 +60,21 @@ class CostCalculator:
             print(f"DBからの原価表読み込みエラー: {e}")
             self.cost_master = [] # Change to list
 
-    def calculate_ingredient_cost(self, ingredient_name: str, quantity: float, unit: str) -> Optional[Decimal]:
+    def calculate_ingredient_cost(self, ingredient_name: str, quantity: float, unit: str,
+                                  as_of: Optional[date] = None) -> Optional[Decimal]:
         """
         材料1つの原価を計算（新しい厳密な単位変換ロジック）
+
+        as_ofを指定した場合は、照合した原価表の行のその日時点の単価（単価履歴）で計算する。
         """
+        return self.calculate_ingredient_cost_with_master(ingredient_name, quantity, unit, as_of=as_of)[0]
+
+    def match_cost_master(self, ingredient_name: str, quantity: float, unit: str) -> Optional[Dict]:
+        """材料名・単位・容量から原価表の行を照合（見つからない場合はNone）"""
         # レシピの単位を正規化
         normalized_recipe_unit = self._normalize_unit(unit)
         decimal_quantity = Decimal(str(quantity)) # レシピの数量をDecimalに変換
+        name_key = normalize_search_key(ingredient_name)
 
         best_master_data = None
         
@@ -66,7 +96,7 @@ class CostCalculator:
             elif master_data.get('capacity') == decimal_quantity:
                 capacity_match = True
 
-            if (master_data.get('ingredient_name') == ingredient_name and
+            if (master_data.get('search_key') == name_key and
                 unit_match and
                 capacity_match):
                 best_master_data = master_data
@@ -83,7 +113,7 @@ class CostCalculator:
                 elif normalized_recipe_unit == normalized_master_unit:
                     unit_match = True
 
-                if (master_data.get('ingredient_name') == ingredient_name and
+                if (master_data.get('search_key') == name_key and
                     unit_match):
                     best_master_data = master_data
                     break
@@ -91,24 +121,56 @@ class CostCalculator:
         # 3. 材料名のみで部分一致（最も緩いマッチング）
         if not best_master_data:
             for master_data in self.cost_master:
-                master_name = master_data.get('ingredient_name', '')
-                if master_name in ingredient_name or ingredient_name in master_name:
+                master_key = master_data.get('search_key', '')
+                if master_key and name_key and (master_key in name_key or name_key in master_key):
                     best_master_data = master_data
                     break
         
+        return best_master_data
+
+    def calculate_ingredient_cost_with_master(self, ingredient_name: str, quantity: float, unit: str,
+                                              as_of: Optional[date] = None) -> Tuple[Optional[Decimal], Optional[Dict]]:
+        """
+        材料1つの原価と照合した原価表の行を返す
+
+        原価を計算できない場合の原価はNone（照合した行があれば行は返す）。
+        """
+        best_master_data = self.match_cost_master(ingredient_name, quantity, unit)
         if not best_master_data:
             print(f"警告: '{ingredient_name}' は原価表に存在しません。")
-            return None
+            return None, None
+        return self.cost_from_master_row(best_master_data, ingredient_name, quantity, unit, as_of), best_master_data
 
+    def cost_from_master_row(self, best_master_data: Dict, ingredient_name: str, quantity: float, unit: str,
+                          as_of: Optional[date] = None) -> Optional[Decimal]:
+        """照合した原価表の行の単価から材料の原価を計算"""
         master_price = best_master_data['unit_price']
+        if as_of is not None:
+            historical_price = self.get_price_history().price_as_of(best_master_data, as_of)
+            if historical_price is None:
+                print(f"警告: '{ingredient_name}' の{as_of.isoformat()}時点の単価履歴がありません。")
+                return None
+            master_price = Decimal(str(historical_price))
+
+        coefficient = self.price_coefficient(best_master_data, ingredient_name, quantity, unit)
+        if coefficient is None:
+            return None
+        cost = coefficient * master_price
+        return cost.quantize(Decimal('0.01'))
+
+    def price_coefficient(self, best_master_data: Dict, ingredient_name: str, quantity: float,
+                          unit: str) -> Optional[Decimal]:
+        """
+        材料の原価が原価表の単価の何倍か（使用量 ÷ 原価表の容量。計算できない場合はNone）
+
+        原価は単価に比例するため、この係数を掛ければ単価を変えた場合の原価も求められる。
+        """
+        normalized_recipe_unit = self._normalize_unit(unit)
+        decimal_quantity = Decimal(str(quantity))
         master_capacity = best_master_data['capacity']
         master_unit = best_master_data['unit']
-        
-        # 数量をDecimalに変換
-        # decimal_quantity = Decimal(str(quantity)) # Already done above
 
         # 単位を正規化
-        # unit_r = self._normalize_unit(unit) # Already done above
         unit_m = self._normalize_unit(master_unit) # 原価マスターの単位
 
         # カテゴリを取得
@@ -118,8 +180,7 @@ class CostCalculator:
         # 1. 単位が完全に一致する場合
         if normalized_recipe_unit == unit_m:
             if master_capacity == 0: return None
-            cost = (decimal_quantity / master_capacity) * master_price
-            return cost.quantize(Decimal('0.01'))
+            return decimal_quantity / master_capacity
 
         # 2. 単位のカテゴリが一致しない場合は計算不可
         if category_r != category_m or category_r == 'count': # 個数系同士の変換は行わない
@@ -134,9 +195,7 @@ class CostCalculator:
             print(f"警告: '{ingredient_name}' の単位変換に失敗しました。")
             return None
 
-        price_per_base_unit = master_price / converted_master_capacity
-        cost = converted_quantity * price_per_base_unit
-        return cost.quantize(Decimal('0.01'))
+        return converted_quantity / converted_master_capacity
 
     def _normalize_unit(self, unit: str) -> str:
         """単位を正規化する"""
@@ -188,9 +247,9 @@ class CostCalculator:
 
         return None
 
-    def calculate_recipe_cost(self, ingredients: List[Dict]) -> Dict:
+    def calculate_recipe_cost(self, ingredients: List[Dict], as_of: Optional[date] = None) -> Dict:
         """
-        レシピ全体の原価を計算
+        レシピ全体の原価を計算（as_ofを指定した場合はその日時点の単価で計算）
         """
         ingredients_with_cost = []
         total_cost = Decimal('0.00')
@@ -208,7 +267,7 @@ class CostCalculator:
             if quantity != 0 and not unit:
                 continue
             
-            cost = self.calculate_ingredient_cost(name, quantity, unit)
+            cost, master_data = self.calculate_ingredient_cost_with_master(name, quantity, unit, as_of=as_of)
             
             ingredient_data = {
                 'name': name,
@@ -216,7 +275,9 @@ class CostCalculator:
                 'unit': unit,
                 'cost': float(cost) if cost is not None else None,
                 'capacity': ingredient.get('capacity'),
-                'capacity_unit': ingredient.get('capacity_unit')
+                'capacity_unit': ingredient.get('capacity_unit'),
+                # 単価の変更時に再計算する材料を引くため、照合した原価表の行を保存する
+                'cost_master_id': master_data.get('id') if master_data else None
             }
             
             if cost is not None:
@@ -2,35 +2,51 @@
 原価表の管理モジュール（追加・更新・削除）
 """
 import os
-from typing import Dict, Optional
+from typing import Callable, Dict, List, Optional
 from decimal import Decimal
 from supabase import create_client, Client
-from groq import Groq
 import json
 from dotenv import load_dotenv
+from search_index import IngredientSearchIndex, normalize_search_key
 
 load_dotenv()
 
 
 class CostMasterManager:
-    def __init__(self):
-        supabase_url = os.getenv("SUPABASE_URL")
-        # サービスキーを優先的に使用し、なければanonキーにフォールバック
-        supabase_key = os.getenv("SUPABASE_SERVICE_KEY")
-        if not supabase_key:
-            print("警告: CostMasterManagerがサービスキーではなくanonキーを使用しています。")
-            supabase_key = os.getenv("SUPABASE_KEY")
+    def __init__(self, supabase_client: Optional[Client] = None):
+        """
+        Args:
+            supabase_client: 共有するSupabaseクライアント（省略時は環境変数から作成）
+        """
+        if supabase_client is None:
+            supabase_url = os.getenv("SUPABASE_URL")
+            # サービスキーを優先的に使用し、なければanonキーにフォールバック
+            supabase_key = os.getenv("SUPABASE_SERVICE_KEY")
+            if not supabase_key:
+                print("警告: CostMasterManagerがサービスキーではなくanonキーを使用しています。")
+                supabase_key = os.getenv("SUPABASE_KEY")
 
-        groq_api_key = os.getenv("GROQ_API_KEY")
-        
-        if not supabase_url or not supabase_key:
-            raise ValueError("Supabaseの設定が不足しています。")
-        
-        if not groq_api_key:
-            raise ValueError("GROQ_API_KEYが設定されていません。")
-        
-        self.supabase: Client = create_client(supabase_url, supabase_key)
-        self.groq_client = Groq(api_key=groq_api_key)
+            if not supabase_url or not supabase_key:
+                raise ValueError("Supabaseの設定が不足しています。")
+            supabase_client = create_client(supabase_url, supabase_key)
+
+        self.supabase: Client = supabase_client
+        # Groqクライアントは最初に使う時に作る（SDKの読み込みに時間がかかるため）
+        self._groq_client = None
+        self.search_index = IngredientSearchIndex()
+        # 取引先ID → 取引先名はapp側の取引先キャッシュから引く（未設定の場合はDBから取得）
+        self.supplier_cache = None
+
+    @property
+    def groq_client(self):
+        """Groqクライアント（未作成の場合は作成する）"""
+        if self._groq_client is None:
+            groq_api_key = os.getenv("GROQ_API_KEY")
+            if not groq_api_key:
+                raise ValueError("GROQ_API_KEYが設定されていません。")
+            from groq import Groq
+            self._groq_client = Groq(api_key=groq_api_key)
+        return self._groq_client
     
     def parse_cost_text(self, text: str) -> Optional[Dict]:
         """
@@ -156,9 +172,13 @@ class CostMasterManager:
         return True
     
     def add_or_update_cost(self, ingredient_name: str, capacity: float, 
-                           unit: str, unit_price: float, unit_column: str = "") -> bool:
+                           unit: str, unit_price: float, unit_column: str = "",
+                           on_written: Optional[Callable[[List[Dict]], None]] = None) -> bool:
         """
         原価表に材料を追加または更新
+
+        Args:
+            on_written: 書き込んだ行（取引先IDつき）を受け取る関数（単価履歴の記録用）
         """
         try:
             from datetime import datetime
@@ -173,6 +193,7 @@ class CostMasterManager:
             
             data = {
                 'ingredient_name': ingredient_name,
+                'search_key': normalize_search_key(ingredient_name),
                 'capacity': capacity,
                 'unit': unit,
                 'unit_column': unit_column,
@@ -189,11 +210,15 @@ class CostMasterManager:
                     .eq('unit', unit)\
                     .execute()
                 print(f"原価表を更新しました: {ingredient_name}")
+                written = [dict(data, supplier_id=row.get('supplier_id')) for row in existing.data]
             else:
                 # 新規レコードの場合は挿入
                 self.supabase.table('cost_master').insert(data).execute()
                 print(f"原価表に追加しました: {ingredient_name}")
+                written = [dict(data, supplier_id=None)]
             
+            if on_written:
+                on_written(written)
             return True
                 
         except Exception as e:
@@ -202,12 +227,12 @@ class CostMasterManager:
     
     def get_cost_info(self, ingredient_name: str) -> Optional[Dict]:
         """
-        指定した材料の原価情報を取得
+        指定した材料の原価情報を取得（検索キーで表記ゆれを吸収して照合）
         """
         try:
             response = self.supabase.table('cost_master')\
                 .select('*, suppliers(name)')\
-                .eq('ingredient_name', ingredient_name)\
+                .eq('search_key', normalize_search_key(ingredient_name))\
                 .execute()
             
             if response.data and len(response.data) > 0:
@@ -254,16 +279,53 @@ class CostMasterManager:
             print(f"原価表の取得エラー: {e}")
             return []
     
-    def search_costs(self, search_term: str, limit: int = 10) -> list:
+    def _load_supplier_names(self) -> Dict[str, str]:
+        """取引先ID → 取引先名のマップを取得"""
+        if self.supplier_cache is not None:
+            return self.supplier_cache.names_by_id()
+        try:
+            response = self.supabase.table('suppliers').select('id, name').execute()
+            return {s['id']: s['name'] for s in response.data or []}
+        except Exception as e:
+            print(f"取引先の取得エラー: {e}")
+            return {}
+    
+    def build_search_index(self, cost_master_rows: list) -> bool:
+        """
+        キャッシュ済みの原価マスター行から検索インデックスを構築
+        
+        Args:
+            cost_master_rows: CostCalculator.cost_master などの原価マスター行
+        """
+        if not cost_master_rows:
+            # 読み込み失敗時も空のまま「構築済み」にしないよう、コールド状態（DB検索）に戻す
+            self.search_index.clear()
+            return False
+        try:
+            self.search_index.build(cost_master_rows, self._load_supplier_names())
+            print(f"検索インデックスを構築しました: {len(self.search_index)}件")
+            return True
+        except Exception as e:
+            print(f"検索インデックスの構築エラー: {e}")
+            self.search_index.clear()
+            return False
+    
+    def search_costs(self, search_term: str, limit: int = 10, offset: int = 0) -> list:
         """
         材料名で原価表を検索（部分一致）
+        
+        インデックスが構築済みならメモリ上で検索し、未構築の場合のみDBに問い合わせる
         """
+        if self.search_index.is_ready:
+            return self.search_index.search(search_term, limit=limit, offset=offset)
+        
         try:
             response = self.supabase.table('cost_master')\
                 .select('*, suppliers(name)')\
-                .ilike('ingredient_name', f'%{search_term}%')\
+                .ilike('search_key', f'%{normalize_search_key(search_term)}%')\
                 .order('ingredient_name')\
                 .limit(limit)\
+                .offset(offset)\
                 .execute()
             
             return response.data
@@ -0,0 +1,162 @@
+"""
+アップロードされたCSVの文字コード判定（先頭部分のサンプルのみで判定する）
+"""
+import codecs
+import io
+import unicodedata
+from typing import NamedTuple
+
+# 判定に使うサンプルのサイズ
+SAMPLE_SIZE = 64 * 1024
+
+# 判定に使う最大の読み込みサイズ（先頭がASCIIのみの場合は非ASCII部分が現れるまで読み進める）
+MAX_SCAN_SIZE = 8 * 1024 * 1024
+
+# BOMと対応するエンコーディング（長いものから判定する）
+_BOMS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32'),
+    (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# 厳密デコードを試す日本語エンコーディング
+_CANDIDATES = ('utf-8', 'cp932', 'euc-jp')
+
+
+class EncodingGuess(NamedTuple):
+    """判定結果（confidenceは0〜1）"""
+    encoding: str
+    confidence: float
+    reason: str
+
+
+def _decodes_strictly(sample: bytes, encoding: str, final: bool) -> bool:
+    """サンプルをエラーなしでデコードできるか（finalでなければ末尾で途切れた文字は許容）"""
+    decoder = codecs.getincrementaldecoder(encoding)(errors='strict')
+    try:
+        decoder.decode(sample, final=final)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+
+def _is_common_kanji(ch: str) -> bool:
+    """JIS第1水準の漢字か（誤った文字コードで読むと第2水準の漢字が多く現れる）"""
+    try:
+        return 0xB0 <= ch.encode('euc-jp')[0] <= 0xCF
+    except UnicodeEncodeError:
+        return False
+
+
+def _plausibility(sample: bytes, encoding: str) -> float:
+    """
+    デコード結果のうち、日本語の表として自然な文字の割合
+
+    ひらがな・カタカナ（半角を含む）・第1水準の漢字・全角記号を自然な文字とする。
+    SJISとEUC-JPを取り違えると第2水準の漢字や外字・制御文字、
+    半角の「｡」「､」（EUC-JPの記号・ひらがなの先頭バイト）が多く現れるため低くなる。
+    """
+    text = codecs.getincrementaldecoder(encoding)(errors='replace').decode(sample, final=False)
+    non_ascii = [ch for ch in text if ord(ch) >= 0x80]
+    if not non_ascii:
+        return 1.0
+    natural = 0
+    for ch in non_ascii:
+        code = ord(ch)
+        if (0x3040 <= code <= 0x30FF          # ひらがな・カタカナ
+                or 0xFF65 <= code <= 0xFF9F   # 半角カナ（｡｢｣､を除く）
+                or 0x3000 <= code <= 0x303F   # 全角の句読点・括弧
+                or 0xFF01 <= code <= 0xFF5E   # 全角英数・記号
+                or 0x2460 <= code <= 0x24FF   # 丸数字など
+                or code in (0x00D7, 0x2212)): # ×、−
+            natural += 1
+        elif 0x4E00 <= code <= 0x9FFF and _is_common_kanji(ch):
+            natural += 1
+        elif unicodedata.category(ch) in ('Co', 'Cc', 'Cn'):
+            natural -= 1
+    return max(0.0, natural / len(non_ascii))
+
+
+def detect_encoding(sample: bytes, final: bool = False) -> EncodingGuess:
+    """
+    バイト列のサンプルから文字コードを1つ選ぶ
+
+    BOM → ISO-2022-JPのエスケープシーケンス → 厳密デコードの可否 →
+    デコード結果の自然さ、の順に判定する。
+
+    Args:
+        final: サンプルがファイル全体の場合True（末尾の途切れた文字を不正とみなす）
+    """
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return EncodingGuess(encoding, 1.0, 'BOM')
+
+    if sample.isascii():
+        if b'\x1b$B' in sample or b'\x1b$@' in sample:
+            return EncodingGuess('iso-2022-jp', 0.95, 'ISO-2022-JPのエスケープシーケンス')
+        return EncodingGuess('utf-8', 0.5, 'ASCIIのみ')
+
+    valid = [encoding for encoding in _CANDIDATES if _decodes_strictly(sample, encoding, final)]
+
+    # 日本語を含むUTF-8以外のバイト列が偶然UTF-8として正しいことはほぼない
+    if 'utf-8' in valid:
+        return EncodingGuess('utf-8', 0.99, 'UTF-8として厳密にデコード可能')
+
+    if len(valid) == 1:
+        return EncodingGuess(valid[0], 0.9, f'{valid[0]}のみ厳密にデコード可能')
+
+    if valid:
+        scores = {encoding: _plausibility(sample, encoding) for encoding in valid}
+        best = max(valid, key=lambda encoding: scores[encoding])
+        others = [score for encoding, score in scores.items() if encoding != best]
+        margin = scores[best] - max(others)
+        return EncodingGuess(best, round(min(0.9, 0.5 + margin / 2), 2),
+                             'デコード結果の文字種から判定: ' +
+                             ', '.join(f'{e}={s:.2f}' for e, s in scores.items()))
+
+    # どれも厳密にはデコードできない場合は、最も自然に読めるものを低い確度で選ぶ
+    scores = {encoding: _plausibility(sample, encoding) for encoding in _CANDIDATES}
+    best = max(_CANDIDATES, key=lambda encoding: scores[encoding])
+    return EncodingGuess(best, round(min(0.3, scores[best] * 0.3), 2), '厳密にデコードできるエンコーディングなし')
+
+
+def detect_stream_encoding(stream, sample_size: int = SAMPLE_SIZE) -> EncodingGuess:
+    """
+    シーク可能なバイナリストリームの文字コードを判定（読み取り位置は先頭に戻す）
+
+    先頭がASCIIのみの場合は、最初に非ASCII文字が現れる位置までを読み飛ばして判定する。
+    """
+    stream.seek(0)
+    head = stream.read(sample_size)
+    sample = head
+    scanned = len(head)
+    final = len(head) < sample_size
+    if head.isascii():
+        while not final and scanned < MAX_SCAN_SIZE:
+            block = stream.read(sample_size)
+            final = len(block) < sample_size
+            scanned += len(block)
+            if not block.isascii():
+                # 直前の行の途中から始まらないよう前のブロックの末尾を少し含める
+                sample = sample[-256:] + block
+                break
+    stream.seek(0)
+    return detect_encoding(sample, final=final)
+
+
+def open_text_stream(stream, sample_size: int = SAMPLE_SIZE):
+    """
+    文字コードを判定し、1回だけストリーミングでデコードするテキストストリームを返す
+
+    判定を誤った場合でも途中で失敗しないよう、不正なバイトは置換文字にする。
+
+    Returns:
+        (テキストストリーム, EncodingGuess)
+    """
+    if not isinstance(stream, io.BufferedIOBase) and not hasattr(stream, 'read1'):
+        stream = io.BytesIO(stream.read())
+    guess = detect_stream_encoding(stream, sample_size)
+    text = io.TextIOWrapper(stream, encoding=guess.encoding, errors='replace', newline='')
+    return text, guess
@@ -0,0 +1,332 @@
+"""
+LINE Flex Message のテンプレート（最初の送信時に1回だけ検証し、以降は差し込みのみ行う）
+
+LINE SDKのモデル（linebot.v3.messaging）はimportに時間がかかるため、起動時には読み込まない。
+"""
+import re
+import threading
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple, Union
+
+if TYPE_CHECKING:
+    from linebot.v3.messaging import FlexContainer
+
+APP_BASE_URL = "https://recipe-management-nd00.onrender.com"
+
+
+class Slot:
+    """テンプレート内の差し込み位置（str.format形式の文字列）"""
+
+    def __init__(self, template: str):
+        self.template = template
+
+
+def _to_attribute(key: str) -> str:
+    """JSONのキー（camelCase）をモデルの属性名（snake_case）に変換"""
+    return re.sub(r'([A-Z])', r'_\1', key).lower()
+
+
+def _clone(node):
+    """モデルの浅いコピー（pydantic v1/v2 両対応）"""
+    if hasattr(node, 'model_copy'):
+        return node.model_copy()
+    return node.copy()
+
+
+def _assign(node, attribute: str, value):
+    """
+    検証を通さずにフィールドへ値を設定
+
+    SDKのモデルは validate_assignment が有効なため、通常の代入では
+    ツリー全体が再検証・再コピーされてしまう。
+    """
+    node.__dict__[attribute] = value
+
+
+class FlexTemplate:
+    """
+    事前検証済みの FlexContainer に値を差し込むテンプレート
+
+    最初の render（またはcontainerの参照）で FlexContainer.from_dict により1回だけ検証し、
+    render では差し込み位置までの経路のノードだけを浅くコピーして値を設定する。
+    """
+
+    def __init__(self, container: Dict):
+        self._slots: List[Tuple[Tuple[Union[str, int], ...], str]] = []
+        self._concrete = self._extract_slots(container, ())
+        self._container: Optional['FlexContainer'] = None
+        self._lock = threading.Lock()
+
+    @property
+    def container(self) -> 'FlexContainer':
+        """検証済みの FlexContainer（未検証の場合はここで検証する）"""
+        container = self._container
+        if container is None:
+            with self._lock:
+                if self._container is None:
+                    from linebot.v3.messaging import FlexContainer
+                    self._container = FlexContainer.from_dict(self._concrete)
+                container = self._container
+        return container
+
+    def _extract_slots(self, value, path):
+        if isinstance(value, Slot):
+            self._slots.append((path, value.template))
+            # 検証用の仮の値としてテンプレート文字列をそのまま使う
+            return value.template
+        if isinstance(value, dict):
+            return {key: self._extract_slots(child, path + (_to_attribute(key),))
+                    for key, child in value.items()}
+        if isinstance(value, list):
+            return [self._extract_slots(child, path + (i,)) for i, child in enumerate(value)]
+        return value
+
+    def render(self, **values) -> 'FlexContainer':
+        """差し込み値を設定した FlexContainer を返す（テンプレート自体は変更しない）"""
+        root = _clone(self.container)
+        cloned = {(): root}
+        for path, template in self._slots:
+            node = root
+            for depth, key in enumerate(path[:-1]):
+                child_path = path[:depth + 1]
+                if child_path in cloned:
+                    node = cloned[child_path]
+                    continue
+                if isinstance(key, int):
+                    child = _clone(node[key])
+                    node[key] = child
+                else:
+                    child = getattr(node, key)
+                    child = list(child) if isinstance(child, list) else _clone(child)
+                    _assign(node, key, child)
+                cloned[child_path] = child
+                node = child
+            _assign(node, path[-1], template.format_map(values))
+        return root
+
+
+# 材料情報（検索結果）
+INGREDIENT_BUBBLE = FlexTemplate({
+    "type": "bubble",
+    "body": {
+        "type": "box",
+        "layout": "vertical",
+        "contents": [
+            {
+                "type": "text",
+                "text": Slot("{ingredient_name}"),
+                "weight": "bold",
+                "size": "lg",
+                "color": "#1DB446"
+            },
+            {
+                "type": "text",
+                "text": Slot("{details}"),
+                "size": "sm",
+                "color": "#666666",
+                "wrap": True
+            }
+        ],
+        "paddingAll": "16px"
+    },
+    "footer": {
+        "type": "box",
+        "layout": "vertical",
+        "contents": [{
+            "type": "button",
+            "style": "primary",
+            "height": "sm",
+            "action": {
+                "type": "uri",
+                "label": "📝 修正",
+                "uri": Slot(APP_BASE_URL + "/ingredient/form?id={id}")
+            }
+        }],
+        "paddingAll": "8px"
+    }
+})
+
+# 新規材料追加の案内
+ADD_INGREDIENT_BUBBLE = FlexTemplate({
+    "type": "bubble",
+    "body": {
+        "type": "box",
+        "layout": "vertical",
+        "contents": [
+            {
+                "type": "text",
+                "text": "➕ 新規材料追加",
+                "weight": "bold",
+                "size": "lg",
+                "color": "#FF6B6B"
+            },
+            {
+                "type": "text",
+                "text": Slot("材料名: {search_term}"),
+                "size": "md",
+                "color": "#333333",
+                "margin": "md"
+            },
+            {
+                "type": "text",
+                "text": "この材料は原価表に登録されていません。\nボタンをタップしてフォームで追加してください。",
+                "size": "sm",
+                "color": "#666666",
+                "margin": "md",
+                "wrap": True
+            }
+        ],
+        "paddingAll": "16px"
+    },
+    "footer": {
+        "type": "box",
+        "layout": "vertical",
+        "contents": [{
+            "type": "button",
+            "style": "primary",
+            "height": "sm",
+            "action": {
+                "type": "uri",
+                "label": "📝 材料を追加",
+                "uri": APP_BASE_URL + "/ingredient/form"
+            }
+        }],
+        "paddingAll": "8px"
+    }
+})
+
+# 検索結果の続き（カルーセル末尾）
+SEARCH_MORE_BUBBLE = FlexTemplate({
+    "type": "bubble",
+    "body": {
+        "type": "box",
+        "layout": "vertical",
+        "justifyContent": "center",
+        "contents": [{
+            "type": "text",
+            "text": "さらに検索結果があります",
+            "size": "md",
+            "color": "#666666",
+            "wrap": True,
+            "align": "center"
+        }],
+        "paddingAll": "16px"
+    },
+    "footer": {
+        "type": "box",
+        "layout": "vertical",
+        "contents": [{
+            "type": "button",
+            "style": "secondary",
+            "height": "sm",
+            "action": {
+                "type": "postback",
+                "label": "▶ もっと見る",
+                "displayText": Slot("「{search_term}」の続き"),
+                "data": Slot("{data}")
+            }
+        }],
+        "paddingAll": "8px"
+    }
+})
+
+# レシピ解析結果の確認
+RECIPE_REVIEW_BUBBLE = FlexTemplate({
+    "type": "bubble",
+    "body": {
+        "type": "box",
+        "layout": "vertical",
+        "contents": [
+            {
+                "type": "text",
+                "text": "📋 レシピ解析結果",
+                "weight": "bold",
+                "size": "lg",
+                "color": "#1DB446"
+            },
+            {
+                "type": "separator",
+                "margin": "md"
+            },
+            {
+                "type": "box",
+                "layout": "vertical",
+                "margin": "md",
+                "contents": [
+                    {
+                        "type": "text",
+                        "text": Slot("料理名: {recipe_name}"),
+                        "weight": "bold",
+                        "size": "md"
+                    },
+                    {
+                        "type": "text",
+                        "text": Slot("人数: {servings}人前"),
+                        "size": "sm",
+                        "color": "#666666"
+                    }
+                ]
+            },
+            {
+                "type": "separator",
+                "margin": "md"
+            },
+            {
+                "type": "box",
+                "layout": "vertical",
+                "margin": "md",
+                "contents": [
+                    {
+                        "type": "text",
+                        "text": "材料リスト:",
+                        "weight": "bold",
+                        "size": "sm"
+                    },
+                    {
+                        "type": "text",
+                        "text": Slot("{ingredients_text}"),
+                        "size": "sm",
+                        "wrap": True,
+                        "margin": "sm"
+                    }
+                ]
+            }
+        ]
+    },
+    "footer": {
+        "type": "box",
+        "layout": "vertical",
+        "spacing": "sm",
+        "contents": [
+            {
+                "type": "button",
+                "style": "primary",
+                "height": "sm",
+                "action": {
+                    "type": "postback",
+                    "label": "💰 原価計算する",
+                    "data": Slot("calculate_cost:{user_id}")
+                }
+            },
+            {
+                "type": "button",
+                "style": "secondary",
+                "height": "sm",
+                "action": {
+                    "type": "postback",
+                    "label": "✏️ 材料を修正",
+                    "data": Slot("edit_recipe:{user_id}")
+                }
+            },
+            {
+                "type": "button",
+                "style": "secondary",
+                "height": "sm",
+                "action": {
+                    "type": "postback",
+                    "label": "💾 そのまま登録",
+                    "data": Slot("save_recipe:{user_id}")
+                }
+            }
+        ]
+    }
+})
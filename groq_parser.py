@@ -5,8 +5,6 @@ AI解析エンジン（Groq + GPT対応）
 import os
 import json
 from typing import Optional, Dict
-from openai import OpenAI
-from groq import Groq
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -26,6 +24,8 @@ class GroqRecipeParser:
             if not api_key:
                 raise ValueError("GROQ_API_KEYが設定されていません。")
             
+            # SDKの読み込みは時間がかかるため、使うプロバイダーのものだけを読み込む
+            from groq import Groq
             self.client = Groq(api_key=api_key)
             self.model = "llama-3.1-8b-instant"  # Groqの最新モデル
             print(f"🤖 Groq AI エンジンを初期化しました（モデル: {self.model}）")
@@ -35,6 +35,7 @@ class GroqRecipeParser:
             if not api_key:
                 raise ValueError("OPENAI_API_KEYが設定されていません。")
             
+            from openai import OpenAI
             self.client = OpenAI(api_key=api_key)
             self.model = "gpt-4o-mini"  # GPT-4o-mini（コスト効率が良い）
             print(f"🤖 GPT AI エンジンを初期化しました（モデル: {self.model}）")
@@ -0,0 +1,86 @@
+"""
+外部サービスのクライアントやSDKのクラスを最初に使う時に作る・importする（起動時間の短縮）
+
+LINE・Azure Vision・Groq/OpenAIのクライアントはimport時に作らず、最初に属性を参照した
+スレッドだけが作成し、同時に参照した他のスレッドはその完了を待って同じオブジェクトを使う。
+"""
+import importlib
+import threading
+from typing import Any, Callable, Optional
+
+
+class LazyService:
+    """
+    factoryで作るオブジェクトの代理（属性の参照を作成済みのオブジェクトに転送する）
+
+    作成に失敗した場合は保存せずに例外を送出し、次の参照で作り直す。
+    """
+
+    def __init__(self, name: str, factory: Callable[[], Any]):
+        self._name = name
+        self._factory = factory
+        self._instance: Optional[Any] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Any:
+        """オブジェクトを返す（未作成の場合は作成する）"""
+        instance = self._instance
+        if instance is not None:
+            return instance
+        with self._lock:
+            if self._instance is None:
+                self._instance = self._factory()
+                print(f"🔌 {self._name}を初期化しました")
+            return self._instance
+
+    @property
+    def initialized(self) -> bool:
+        return self._instance is not None
+
+    def reset(self, instance: Optional[Any] = None):
+        """作成済みのオブジェクトを差し替える（Noneの場合は次の参照で作り直す）"""
+        with self._lock:
+            self._instance = instance
+
+    def __getattr__(self, name: str) -> Any:
+        # 自身の属性（_instanceなど）は通常の参照で見つかるため、ここに来るのは未初期化時のみ
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.get(), name)
+
+    def __repr__(self) -> str:
+        state = '初期化済み' if self.initialized else '未初期化'
+        return f"<LazyService {self._name} ({state})>"
+
+
+class LazyImport:
+    """
+    モジュールの属性（主にSDKのクラス）の代理（最初の呼び出し・属性参照でimportする）
+
+    呼び出し（インスタンスの作成）と属性の参照（クラスメソッドなど）だけを転送するため、
+    isinstanceの判定や型注釈には使えない。importはPythonのimportロックで排他される。
+    """
+
+    def __init__(self, module: str, name: str):
+        self._module = module
+        self._name = name
+        self._target: Optional[Any] = None
+
+    def resolve(self) -> Any:
+        """importした属性を返す"""
+        target = self._target
+        if target is None:
+            target = getattr(importlib.import_module(self._module), self._name)
+            self._target = target
+        return target
+
+    def __call__(self, *args, **kwargs) -> Any:
+        return self.resolve()(*args, **kwargs)
+
+    def __getattr__(self, name: str) -> Any:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(self.resolve(), name)
+
+    def __repr__(self) -> str:
+        return f"<LazyImport {self._module}.{self._name}>"
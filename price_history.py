@@ -0,0 +1,129 @@
+"""
+単価の履歴（追記のみ）と、指定日時点の単価を二分探索で引く索引
+"""
+from array import array
+from bisect import bisect_right
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+from supabase import Client
+from price_reducers import normalize_transaction_date
+from supabase_paging import PAGE_SIZE, iter_pages, order_by
+from upload_pipeline import cost_master_conflict_key, iter_chunks
+
+PRICE_HISTORY_TABLE = 'cost_price_history'
+
+# 同じ観測を重複して記録しないためのユニークインデックスの列
+PRICE_HISTORY_CONFLICT_COLUMNS = ('ingredient_name', 'supplier_id', 'capacity', 'unit', 'price_date', 'unit_price')
+
+# 1回のupsertで送る行数
+PRICE_HISTORY_CHUNK_SIZE = 500
+
+
+def price_history_row(ingredient_name: str, supplier_id, capacity, unit: str, unit_price,
+                      price_date: Optional[str], source: str) -> Dict:
+    """
+    履歴の1行を作る
+
+    Args:
+        price_date: 単価が観測された日（伝票日付など。解釈できない場合は今日）
+        source: 記録元（cost_master_upload, transaction_upload, form, line, ingredient_cost など）
+    """
+    return {
+        'ingredient_name': ingredient_name,
+        'supplier_id': supplier_id,
+        'capacity': capacity,
+        'unit': unit,
+        'unit_price': round(float(unit_price), 2),
+        'price_date': normalize_transaction_date(price_date or '') or date.today().isoformat(),
+        'source': source
+    }
+
+
+def record_price_history(supabase: Client, rows: Iterable[Dict]) -> int:
+    """
+    履歴を追記（同じ日・同じ単価の観測は重複させない）
+
+    履歴の記録に失敗しても原価表の更新は成功として扱うため、エラーは出力のみ。
+    Returns:
+        送信した行数
+    """
+    recorded = 0
+    for chunk in iter_chunks(rows, PRICE_HISTORY_CHUNK_SIZE):
+        # 同じupsert文の中で同じキーが2回あるとエラーになるためチャンク内で重複を除く
+        unique = {tuple(row.get(column) for column in PRICE_HISTORY_CONFLICT_COLUMNS): row for row in chunk}
+        try:
+            supabase.table(PRICE_HISTORY_TABLE).upsert(
+                list(unique.values()),
+                on_conflict=','.join(PRICE_HISTORY_CONFLICT_COLUMNS),
+                ignore_duplicates=True
+            ).execute()
+            recorded += len(unique)
+        except Exception as e:
+            print(f"⚠️ 単価履歴の記録エラー: {e}")
+    return recorded
+
+
+class PriceHistoryIndex:
+    """
+    原価表のキー（材料名, 取引先, 容量, 単位）ごとに、日付順の単価を配列で保持する
+
+    日付は日数（date.toordinal）、単価はfloatの配列として持つため、dictの行より小さい。
+    指定日時点の単価は、その日以前の最後の観測を二分探索で求める。
+    """
+
+    def __init__(self):
+        self._dates: Dict[tuple, array] = {}
+        self._prices: Dict[tuple, array] = {}
+
+    def __len__(self) -> int:
+        return sum(len(dates) for dates in self._dates.values())
+
+    @classmethod
+    def load(cls, supabase: Client, page_size: int = PAGE_SIZE) -> 'PriceHistoryIndex':
+        """履歴テーブルを日付順にページ取得して索引を作る"""
+        index = cls()
+
+        def query():
+            query = supabase.table(PRICE_HISTORY_TABLE)\
+                .select('ingredient_name, supplier_id, capacity, unit, unit_price, price_date')
+            return order_by(query, 'price_date', 'id')
+
+        for rows in iter_pages(query, page_size):
+            for row in rows:
+                index.add(row, row['price_date'], row['unit_price'])
+        return index
+
+    def add(self, row: Dict, price_date: str, unit_price):
+        """観測を1件追加（日付順に読み込む場合は末尾に追加するだけ）"""
+        key = cost_master_conflict_key(row)
+        day = date.fromisoformat(str(price_date)[:10]).toordinal()
+        dates = self._dates.get(key)
+        if dates is None:
+            self._dates[key] = array('l', [day])
+            self._prices[key] = array('d', [float(unit_price)])
+            return
+        if not dates or dates[-1] <= day:
+            dates.append(day)
+            self._prices[key].append(float(unit_price))
+            return
+        # 過去の日付の観測は同じ日の観測の後ろに挿入する
+        position = bisect_right(dates, day)
+        dates.insert(position, day)
+        self._prices[key].insert(position, float(unit_price))
+
+    def price_as_of(self, row: Dict, as_of: date) -> Optional[float]:
+        """as_of以前で最後に観測された単価（観測がない場合はNone）"""
+        key = cost_master_conflict_key(row)
+        dates = self._dates.get(key)
+        if not dates:
+            return None
+        position = bisect_right(dates, as_of.toordinal())
+        if position == 0:
+            return None
+        return self._prices[key][position - 1]
+
+    def series(self, row: Dict) -> List[Tuple[str, float]]:
+        """キーの (日付, 単価) の一覧（日付順）"""
+        key = cost_master_conflict_key(row)
+        return [(date.fromordinal(day).isoformat(), price)
+                for day, price in zip(self._dates.get(key, ()), self._prices.get(key, ()))]
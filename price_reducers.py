@@ -0,0 +1,280 @@
+"""
+取引明細の単価を (商品名, 取引先名) ごとに1つの単価へ集約する方法
+
+明細は1回だけ順に読み、品目ごとに小さな状態（最小値・合計など）だけを保持するため、
+メモリ使用量は明細数ではなく品目数に比例する。状態はファイルごとに並列で作って
+後から統合できる（merge）。
+"""
+from datetime import date, timedelta
+from typing import Any, Dict, Hashable, NamedTuple, Optional
+
+# 直近N日平均の既定の日数
+DEFAULT_WINDOW_DAYS = 30
+
+
+class PriceLine(NamedTuple):
+    """集約に使う明細1行"""
+    price: float
+    quantity: float
+    date: str     # YYYY-MM-DD（不明の場合は空文字）
+    order: tuple  # (ファイル番号, 行番号)。同じ日付の明細の前後関係に使う
+
+
+def normalize_transaction_date(value: str) -> str:
+    """伝票日付（2025/08/01 など）をYYYY-MM-DDにそろえる（解釈できない場合は空文字）"""
+    parts = value.strip().replace('-', '/').split('/')
+    if len(parts) != 3:
+        return ''
+    try:
+        return date(int(parts[0]), int(parts[1]), int(parts[2])).isoformat()
+    except ValueError:
+        return ''
+
+
+class PriceReducer:
+    """
+    集約方法の基底クラス
+
+    start/addで品目ごとの状態を作り、mergeで別ファイルの状態と統合し、priceで単価を求める。
+    規格・容量などの代表の明細はpreferで選ぶ（既定は最も新しい明細）。
+    """
+    name = ''
+    label = ''
+
+    def start(self, line: PriceLine) -> Any:
+        raise NotImplementedError
+
+    def add(self, state: Any, line: PriceLine) -> Any:
+        raise NotImplementedError
+
+    def merge(self, state: Any, other: Any) -> Any:
+        """stateに後のファイルの状態otherを統合（otherは変更しない）"""
+        raise NotImplementedError
+
+    def copy(self, state: Any) -> Any:
+        """状態の複製（add/mergeで書き換える可変の状態を持つ場合はオーバーライドする）"""
+        return state
+
+    def price(self, state: Any) -> float:
+        raise NotImplementedError
+
+    def prefer(self, line: PriceLine, current: PriceLine) -> bool:
+        """lineを現在の代表の明細currentと入れ替えるか"""
+        return (line.date, line.order) > (current.date, current.order)
+
+    def describe(self) -> str:
+        return self.label
+
+
+class MinPriceReducer(PriceReducer):
+    """最安値（同じ価格の場合は先の明細）"""
+    name = 'min'
+    label = '最安値'
+
+    def start(self, line):
+        return line.price
+
+    def add(self, state, line):
+        return min(state, line.price)
+
+    def merge(self, state, other):
+        return min(state, other)
+
+    def price(self, state):
+        return state
+
+    def prefer(self, line, current):
+        return line.price < current.price
+
+
+class LastPriceReducer(PriceReducer):
+    """最新の伝票日付の単価（同じ日付の場合は後の明細）"""
+    name = 'last'
+    label = '最新の単価'
+
+    def start(self, line):
+        return (line.date, line.order, line.price)
+
+    def add(self, state, line):
+        return max(state, (line.date, line.order, line.price))
+
+    def merge(self, state, other):
+        return max(state, other)
+
+    def price(self, state):
+        return state[2]
+
+
+class MeanPriceReducer(PriceReducer):
+    """単価の単純平均"""
+    name = 'mean'
+    label = '平均単価'
+
+    def start(self, line):
+        return (line.price, 1)
+
+    def add(self, state, line):
+        return (state[0] + line.price, state[1] + 1)
+
+    def merge(self, state, other):
+        return (state[0] + other[0], state[1] + other[1])
+
+    def price(self, state):
+        return state[0] / state[1]
+
+
+class WeightedMeanPriceReducer(PriceReducer):
+    """
+    数量で重み付けした平均単価（仕入金額の合計 ÷ 数量の合計）
+
+    数量が0以下（返品など）の明細は重みに含めない。重みのある明細がない場合は単純平均。
+    """
+    name = 'weighted_mean'
+    label = '数量加重平均'
+
+    def start(self, line):
+        return self.add((0.0, 0.0, 0.0, 0), line)
+
+    def add(self, state, line):
+        amount, quantity, price_sum, count = state
+        if line.quantity > 0:
+            amount += line.price * line.quantity
+            quantity += line.quantity
+        return (amount, quantity, price_sum + line.price, count + 1)
+
+    def merge(self, state, other):
+        return tuple(a + b for a, b in zip(state, other))
+
+    def price(self, state):
+        amount, quantity, price_sum, count = state
+        return amount / quantity if quantity > 0 else price_sum / count
+
+
+class TrailingMeanPriceReducer(PriceReducer):
+    """
+    品目ごとの最新の伝票日付から直近N日間の平均単価
+
+    日付ごとの (合計, 件数) だけを保持し、期間外になった日付は読み込み中に捨てるため、
+    状態は品目あたり最大N日分になる。日付のない明細は日付のある明細がない場合のみ使う。
+    """
+    name = 'trailing_mean'
+    label = '直近平均'
+
+    def __init__(self, window_days: int = DEFAULT_WINDOW_DAYS):
+        if window_days < 1:
+            raise ValueError('集計期間は1日以上を指定してください')
+        self.window_days = window_days
+
+    def describe(self):
+        return f'直近{self.window_days}日の平均単価'
+
+    def _prune(self, buckets: Dict[str, list]) -> Dict[str, list]:
+        dated = [day for day in buckets if day]
+        if dated:
+            cutoff = (date.fromisoformat(max(dated)) - timedelta(days=self.window_days - 1)).isoformat()
+            for day in list(buckets):
+                if day < cutoff:
+                    del buckets[day]
+        return buckets
+
+    def start(self, line):
+        return {line.date: [line.price, 1]}
+
+    def add(self, state, line):
+        bucket = state.get(line.date)
+        if bucket:
+            bucket[0] += line.price
+            bucket[1] += 1
+            return state
+        state[line.date] = [line.price, 1]
+        return self._prune(state)
+
+    def copy(self, state):
+        return {day: list(bucket) for day, bucket in state.items()}
+
+    def merge(self, state, other):
+        for day, (total, count) in other.items():
+            bucket = state.setdefault(day, [0.0, 0])
+            bucket[0] += total
+            bucket[1] += count
+        return self._prune(state)
+
+    def price(self, state):
+        buckets = [bucket for day, bucket in state.items() if day] or list(state.values())
+        return sum(total for total, _ in buckets) / sum(count for _, count in buckets)
+
+
+# 選択できる集約方法
+PRICE_REDUCERS = {
+    reducer.name: reducer
+    for reducer in (MinPriceReducer, LastPriceReducer, MeanPriceReducer,
+                    WeightedMeanPriceReducer, TrailingMeanPriceReducer)
+}
+
+
+def get_price_reducer(name: Optional[str] = None, window_days: Optional[int] = None) -> PriceReducer:
+    """
+    名前から集約方法を作る（未指定の場合は従来どおり最安値）
+
+    Raises:
+        ValueError: 不明な名前、または不正な集計期間
+    """
+    reducer_class = PRICE_REDUCERS.get(name or MinPriceReducer.name)
+    if reducer_class is None:
+        raise ValueError(f"不明な単価の集約方法です: {name}")
+    if reducer_class is TrailingMeanPriceReducer:
+        return reducer_class(DEFAULT_WINDOW_DAYS if window_days is None else int(window_days))
+    return reducer_class()
+
+
+class PriceAggregator:
+    """
+    品目ごとに集約状態と代表の明細（規格・容量などの情報）を保持する
+
+    ファイルごとに作った集約はmergeで統合でき、プロセス間で受け渡せる（pickle可能）。
+    """
+
+    def __init__(self, reducer: PriceReducer):
+        self.reducer = reducer
+        # キー -> [集約状態, 代表の明細, 代表の明細の品目情報]
+        self.entries: Dict[Hashable, list] = {}
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def add(self, key: Hashable, line: PriceLine, item: Dict):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.entries[key] = [self.reducer.start(line), line, item]
+            return
+        entry[0] = self.reducer.add(entry[0], line)
+        if self.reducer.prefer(line, entry[1]):
+            entry[1] = line
+            entry[2] = item
+
+    def merge(self, other: 'PriceAggregator') -> 'PriceAggregator':
+        """
+        後のファイルの集約otherを統合
+
+        otherの状態は複製してから取り込み、統合後もotherの集約結果（ファイルごとの単価）は変わらない。
+        """
+        for key, (state, line, item) in other.entries.items():
+            entry = self.entries.get(key)
+            if entry is None:
+                self.entries[key] = [self.reducer.copy(state), line, item]
+                continue
+            entry[0] = self.reducer.merge(entry[0], state)
+            if self.reducer.prefer(line, entry[1]):
+                entry[1] = line
+                entry[2] = item
+        return self
+
+    def results(self) -> Dict[Hashable, Dict]:
+        """
+        キーごとに代表の明細の品目情報へ、集約した単価（小数2桁）と
+        代表の明細の日付（price_date、単価履歴の日付に使う）を入れて返す
+        """
+        return {
+            key: dict(item, price=round(self.reducer.price(state), 2), price_date=line.date)
+            for key, (state, line, item) in self.entries.items()
+        }
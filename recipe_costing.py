@@ -0,0 +1,313 @@
+"""
+保存レシピの原価を原価表キャッシュ（メモリ上）で計算する
+
+材料の原価は「原価表の単価 × 係数（使用量 ÷ 容量）」で表せるため、係数を1回だけ求めておけば、
+単価を変えた場合の原価（シミュレーション）は、変えた原価表の行を使う材料の分だけ差し替えて求められる。
+"""
+from decimal import ROUND_CEILING, Decimal
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+from supabase import Client
+from supabase_paging import PAGE_SIZE, fetch_all
+from search_index import normalize_search_key
+from upload_pipeline import DIFF_LOOKUP_BATCH_SIZE, iter_chunks
+
+CENT = Decimal('0.01')
+
+# 保存レシピと材料の取得で1回に読む行数
+RECIPE_PAGE_SIZE = PAGE_SIZE
+
+RECIPE_COLUMNS = 'id, recipe_name, servings, total_cost'
+INGREDIENT_COLUMNS = 'id, recipe_id, ingredient_name, quantity, unit, cost_master_id'
+
+
+class IngredientTerm(NamedTuple):
+    """材料1行の原価の式（原価 = 原価表の行の単価 × coefficient）"""
+    recipe_id: str
+    ingredient_name: str
+    quantity: float
+    unit: str
+    cost_master_id: Optional[str]  # 照合した原価表の行（照合できない場合はNone）
+    coefficient: Optional[Decimal]  # 単位変換できない場合はNone
+
+
+def load_recipes(supabase: Client) -> List[Dict]:
+    """保存レシピをすべて取得（id順にページ取得）"""
+    return fetch_all(lambda: supabase.table('recipes').select(RECIPE_COLUMNS).order('id'), RECIPE_PAGE_SIZE)
+
+
+def load_recipe_ingredients(supabase: Client, recipe_ids: Optional[Iterable[str]] = None) -> List[Dict]:
+    """材料を取得（recipe_ids省略時はすべて。指定時はin句の長さ制限のため分割して取得）"""
+    if recipe_ids is None:
+        return fetch_all(lambda: supabase.table('ingredients').select(INGREDIENT_COLUMNS).order('id'),
+                         RECIPE_PAGE_SIZE)
+    rows = []
+    for batch in iter_chunks(sorted(set(recipe_ids)), DIFF_LOOKUP_BATCH_SIZE):
+        rows.extend(fetch_all(
+            lambda: supabase.table('ingredients').select(INGREDIENT_COLUMNS).in_('recipe_id', batch).order('id'),
+            RECIPE_PAGE_SIZE
+        ))
+    return rows
+
+
+def build_cost_terms(cost_calculator, ingredient_rows: Iterable[Dict]) -> List[IngredientTerm]:
+    """
+    材料ごとに原価表の行と係数を求める
+
+    保存時に照合した原価表の行（cost_master_id）がキャッシュにあればそれを使い、
+    ない場合のみ材料名・単位で照合する（同じ材料名・分量・単位の照合は1回だけ）。
+    """
+    masters = {row['id']: row for row in cost_calculator.cost_master if row.get('id')}
+    matched: Dict[Tuple, Optional[Dict]] = {}
+    terms = []
+    for row in ingredient_rows:
+        name = row.get('ingredient_name') or ''
+        quantity = float(row.get('quantity') or 0)
+        unit = row.get('unit') or ''
+        master = masters.get(row.get('cost_master_id'))
+        if master is None:
+            key = (name, quantity, unit)
+            if key not in matched:
+                matched[key] = cost_calculator.match_cost_master(name, quantity, unit)
+            master = matched[key]
+        coefficient = cost_calculator.price_coefficient(master, name, quantity, unit) if master else None
+        terms.append(IngredientTerm(
+            row['recipe_id'], name, quantity, unit,
+            master.get('id') if master else None,
+            coefficient
+        ))
+    return terms
+
+
+class RecipeCostModel:
+    """
+    保存レシピ全体の原価モデル
+
+    原価表の行 → (レシピ, 係数) の逆引きを持ち、単価を変えた場合の各レシピの原価を
+    変えた行に依存する材料だけで求める（DBには書き込まない）。
+    材料ごとの原価は原価計算（CostCalculator）と同じく小数2桁に丸めてから合計する。
+    """
+
+    def __init__(self, recipes: Iterable[Dict], terms: Iterable[IngredientTerm], cost_master_rows: Iterable[Dict]):
+        self.recipes: Dict[str, Dict] = {recipe['id']: recipe for recipe in recipes}
+        self.prices: Dict[str, Decimal] = {}
+        self.master_names: Dict[str, str] = {}
+        self.master_keys: Dict[str, List[str]] = {}
+        for row in cost_master_rows:
+            if not row.get('id'):
+                continue
+            self.prices[row['id']] = Decimal(str(row.get('unit_price') or 0))
+            self.master_names[row['id']] = row.get('ingredient_name', '')
+            search_key = row.get('search_key') or normalize_search_key(row.get('ingredient_name', ''))
+            self.master_keys.setdefault(search_key, []).append(row['id'])
+
+        self.base_costs: Dict[str, Decimal] = {recipe_id: Decimal('0') for recipe_id in self.recipes}
+        self.missing: Dict[str, int] = {recipe_id: 0 for recipe_id in self.recipes}
+        self.dependents: Dict[str, List[Tuple[str, Decimal]]] = {}
+        for term in terms:
+            if term.recipe_id not in self.recipes:
+                continue
+            if term.coefficient is None or term.cost_master_id not in self.prices:
+                self.missing[term.recipe_id] += 1
+                continue
+            self.base_costs[term.recipe_id] += (term.coefficient * self.prices[term.cost_master_id]).quantize(CENT)
+            self.dependents.setdefault(term.cost_master_id, []).append((term.recipe_id, term.coefficient))
+
+    def __len__(self) -> int:
+        return len(self.recipes)
+
+    @classmethod
+    def load(cls, supabase: Client, cost_calculator) -> 'RecipeCostModel':
+        """保存レシピと材料をDBから読み込み、原価表キャッシュで係数を求める"""
+        recipes = load_recipes(supabase)
+        terms = build_cost_terms(cost_calculator, load_recipe_ingredients(supabase))
+        model = cls(recipes, terms, cost_calculator.cost_master)
+        print(f"🧮 原価モデルを作成しました: レシピ{len(model)}件、原価表の行{len(model.dependents)}件に依存")
+        return model
+
+    def resolve_overrides(self, overrides: Iterable[Dict]) -> Tuple[Dict[str, Decimal], List[Dict]]:
+        """
+        単価の変更（原価表の行IDまたは材料名、変更率または単価）を原価表の行ごとの新しい単価にする
+
+        材料名は検索キーで照合し、同じ材料の取引先違いの行もすべて変更する。
+        変更後の単価は原価表と同じく小数2桁に丸める。
+        Returns:
+            (原価表の行ID → 新しい単価, 照合できなかった変更の一覧)
+        Raises:
+            ValueError: 変更の指定が不正な場合
+        """
+        new_prices: Dict[str, Decimal] = {}
+        unmatched = []
+        for override in overrides:
+            if not isinstance(override, dict):
+                raise ValueError("単価の変更はオブジェクトで指定してください")
+            if override.get('cost_master_id'):
+                master_ids = [override['cost_master_id']] if override['cost_master_id'] in self.prices else []
+            elif override.get('ingredient_name'):
+                master_ids = self.master_keys.get(normalize_search_key(override['ingredient_name']), [])
+            else:
+                raise ValueError("単価の変更にはcost_master_idまたはingredient_nameを指定してください")
+
+            if override.get('unit_price') is None and override.get('percent') is None:
+                raise ValueError("単価の変更にはpercentまたはunit_priceを指定してください")
+            try:
+                if override.get('unit_price') is not None:
+                    unit_price = Decimal(str(float(override['unit_price'])))
+                    change = lambda price: unit_price
+                else:
+                    rate = 1 + Decimal(str(float(override['percent']))) / 100
+                    change = lambda price: price * rate
+            except (TypeError, ValueError) as e:
+                raise ValueError(f"単価の変更の値が不正です: {e}")
+            if not (unit_price if override.get('unit_price') is not None else rate).is_finite():
+                raise ValueError("単価の変更の値が不正です")
+
+            if not master_ids:
+                unmatched.append(override)
+                continue
+            for master_id in master_ids:
+                new_price = change(self.prices[master_id]).quantize(CENT)
+                if new_price < 0:
+                    raise ValueError(f"変更後の単価が負になります: {self.master_names[master_id]}")
+                new_prices[master_id] = new_price
+        return new_prices, unmatched
+
+    def simulate(self, new_prices: Dict[str, Decimal]) -> Dict[str, Decimal]:
+        """変更した行に依存するレシピだけについて、変更後の原価を返す"""
+        deltas: Dict[str, Decimal] = {}
+        for master_id, new_price in new_prices.items():
+            old_price = self.prices[master_id]
+            for recipe_id, coefficient in self.dependents.get(master_id, ()):
+                delta = (coefficient * new_price).quantize(CENT) - (coefficient * old_price).quantize(CENT)
+                deltas[recipe_id] = deltas.get(recipe_id, Decimal('0')) + delta
+        return {recipe_id: self.base_costs[recipe_id] + delta for recipe_id, delta in deltas.items()}
+
+    def delta_report(self, new_prices: Dict[str, Decimal], selling_prices: Optional[Dict[str, float]] = None,
+                     threshold_percent: Optional[float] = None) -> List[Dict]:
+        """
+        原価が変わるレシピの一覧（原価率のラインを超えるレシピを先頭に、増加額の大きい順）
+
+        selling_prices（レシピID → 売価）を渡した場合は原価率も求め、threshold_percentを
+        またぐレシピに crosses_threshold（'up' または 'down'）を付ける。
+        """
+        selling_prices = selling_prices or {}
+        report = []
+        for recipe_id, simulated in self.simulate(new_prices).items():
+            base, simulated = float(self.base_costs[recipe_id]), float(simulated)
+            recipe = self.recipes[recipe_id]
+            entry = {
+                'recipe_id': recipe_id,
+                'recipe_name': recipe.get('recipe_name'),
+                'servings': recipe.get('servings'),
+                'base_cost': round(base, 2),
+                'simulated_cost': round(simulated, 2),
+                'delta': round(simulated - base, 2),
+                'delta_percent': round((simulated - base) / base * 100, 2) if base else None,
+                'missing_ingredients': self.missing[recipe_id]
+            }
+            selling_price = selling_prices.get(recipe_id)
+            if selling_price:
+                entry['selling_price'] = selling_price
+                entry['base_cost_ratio'] = round(base / selling_price * 100, 2)
+                entry['simulated_cost_ratio'] = round(simulated / selling_price * 100, 2)
+                if threshold_percent is not None:
+                    if entry['base_cost_ratio'] < threshold_percent <= entry['simulated_cost_ratio']:
+                        entry['crosses_threshold'] = 'up'
+                    elif entry['simulated_cost_ratio'] < threshold_percent <= entry['base_cost_ratio']:
+                        entry['crosses_threshold'] = 'down'
+            report.append(entry)
+        report.sort(key=lambda entry: (entry.get('crosses_threshold') != 'up', -entry['delta']))
+        return report
+
+
+def load_recipes_by_id(supabase: Client, recipe_ids: Iterable[str]) -> List[Dict]:
+    """指定した保存レシピを取得（in句の長さ制限のため分割して取得）"""
+    rows = []
+    for batch in iter_chunks(sorted(set(recipe_ids)), DIFF_LOOKUP_BATCH_SIZE):
+        rows.extend(fetch_all(
+            lambda: supabase.table('recipes').select(RECIPE_COLUMNS).in_('id', batch).order('id'),
+            RECIPE_PAGE_SIZE
+        ))
+    return rows
+
+
+def cost_recipe_batch(recipes: Iterable[Dict], terms: Iterable[IngredientTerm], cost_master_rows: Iterable[Dict],
+                      multipliers: Dict[str, Decimal], supplier_names: Optional[Dict[str, str]] = None) -> Dict:
+    """
+    複数のレシピ（献立・製造計画）の原価と、原価表の行ごとにまとめた仕入れ量を求める
+
+    Args:
+        multipliers: レシピID → 倍数（保存レシピの分量の何倍を作るか）
+        supplier_names: 取引先ID → 取引先名（仕入れ一覧の表示用）
+
+    Returns:
+        recipes（レシピごとの原価）、total_cost（合計）、shopping_list（原価表の行ごとの
+        必要数量・包装数・金額）、unmatched（原価表で照合できない材料の合計分量）の辞書
+    """
+    supplier_names = supplier_names or {}
+    masters = {row['id']: row for row in cost_master_rows if row.get('id')}
+    results = {
+        recipe['id']: {
+            'recipe_id': recipe['id'],
+            'recipe_name': recipe.get('recipe_name'),
+            'servings': recipe.get('servings'),
+            'multiplier': float(multipliers[recipe['id']]),
+            'cost': Decimal('0'),
+            'missing_ingredients': []
+        }
+        for recipe in recipes if recipe['id'] in multipliers
+    }
+    shopping: Dict[str, Dict] = {}
+    unmatched: Dict[Tuple[str, str], Dict] = {}
+
+    for term in terms:
+        result = results.get(term.recipe_id)
+        if result is None:
+            continue
+        multiplier = multipliers[term.recipe_id]
+        master = masters.get(term.cost_master_id)
+        if master is None or term.coefficient is None:
+            result['missing_ingredients'].append(term.ingredient_name)
+            entry = unmatched.setdefault((term.ingredient_name, term.unit), {
+                'ingredient_name': term.ingredient_name, 'unit': term.unit, 'quantity': Decimal('0')
+            })
+            entry['quantity'] += Decimal(str(term.quantity)) * multiplier
+            continue
+        result['cost'] += (term.coefficient * master['unit_price']).quantize(CENT)
+        entry = shopping.setdefault(master['id'], {
+            'cost_master_id': master['id'],
+            'ingredient_name': master.get('ingredient_name'),
+            'supplier_name': supplier_names.get(master.get('supplier_id')),
+            'capacity': float(master['capacity']),
+            'unit': master.get('unit'),
+            'unit_price': float(master['unit_price']),
+            'packages': Decimal('0')
+        })
+        entry['packages'] += term.coefficient * multiplier
+
+    recipe_rows = []
+    total_cost = Decimal('0')
+    for result in results.values():
+        recipe_cost = result['cost']
+        line_total = (recipe_cost * multipliers[result['recipe_id']]).quantize(CENT)
+        total_cost += line_total
+        recipe_rows.append(dict(result, cost=float(recipe_cost), total_cost=float(line_total)))
+
+    shopping_list = []
+    for entry in shopping.values():
+        packages = entry['packages']
+        shopping_list.append(dict(
+            entry,
+            packages=float(packages.quantize(Decimal('0.001'))),
+            # 包装単位で仕入れる場合の数（切り上げ）
+            packages_to_order=int(packages.to_integral_value(rounding=ROUND_CEILING)),
+            quantity=float((packages * Decimal(str(entry['capacity']))).quantize(CENT)),
+            cost=float((packages * Decimal(str(entry['unit_price']))).quantize(CENT))
+        ))
+    shopping_list.sort(key=lambda entry: -entry['cost'])
+
+    return {
+        'recipes': recipe_rows,
+        'total_cost': float(total_cost),
+        'shopping_list': shopping_list,
+        'unmatched': [dict(entry, quantity=float(entry['quantity'])) for entry in unmatched.values()]
+    }
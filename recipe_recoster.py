@@ -0,0 +1,178 @@
+"""
+単価が変わった原価表の行に依存する保存レシピだけを、バックグラウンドで再計算する
+
+材料（ingredients）には原価計算で照合した原価表の行（cost_master_id）を保存しており、
+変更された行のIDから材料を逆引きして原価を計算し直し、材料の原価とレシピの合計原価を
+RPC（apply_ingredient_costs）でまとめて更新する。
+"""
+import os
+import threading
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from supabase import Client
+from supabase_paging import PAGE_SIZE, fetch_all, iter_pages
+from upload_pipeline import DIFF_LOOKUP_BATCH_SIZE, iter_chunks
+
+# 1回のRPCで更新する材料の数
+RECOST_WRITE_BATCH_SIZE = 500
+
+# 材料の取得で1回に読む行数
+INGREDIENT_PAGE_SIZE = PAGE_SIZE
+
+INGREDIENT_COLUMNS = 'id, recipe_id, ingredient_name, quantity, unit, cost, cost_master_id'
+
+
+def cost_master_fingerprints(cost_master_rows: Iterable[Dict]) -> Dict[str, tuple]:
+    """原価表の行ID → 原価計算に使う値（単価・容量・単位・材料名）"""
+    return {
+        row['id']: (row.get('unit_price'), row.get('capacity'), row.get('unit'), row.get('search_key'))
+        for row in cost_master_rows if row.get('id')
+    }
+
+
+def diff_cost_master(before: Dict[str, tuple], after: Dict[str, tuple]) -> Tuple[Set[str], bool]:
+    """
+    再読み込み前後の原価表を比較
+
+    Returns:
+        (値が変わった行のID, 行が追加・削除されたか)
+        行の追加・削除があった場合は、未照合の材料が照合できるようになった可能性がある。
+    """
+    changed = {row_id for row_id, values in after.items() if row_id in before and before[row_id] != values}
+    return changed, before.keys() != after.keys()
+
+
+def load_dependents(supabase: Client, cost_master_ids: Iterable[str]) -> Dict[str, List[Dict]]:
+    """
+    原価表の行ID → その行を照合している材料の逆引き
+
+    in句の長さ制限のため行IDを分割し、多くのレシピで使われる行でも最大取得件数で
+    切り詰められないよう、分割ごとにページ取得する。
+    """
+    dependents: Dict[str, List[Dict]] = {}
+    for batch in iter_chunks(sorted(cost_master_ids), DIFF_LOOKUP_BATCH_SIZE):
+        pages = iter_pages(
+            lambda: supabase.table('ingredients').select(INGREDIENT_COLUMNS).in_('cost_master_id', batch).order('id'),
+            INGREDIENT_PAGE_SIZE
+        )
+        for rows in pages:
+            for row in rows:
+                dependents.setdefault(row['cost_master_id'], []).append(row)
+    return dependents
+
+
+def load_unlinked_ingredients(supabase: Client) -> List[Dict]:
+    """原価表の行と結び付いていない材料（保存時に照合できなかった材料など）"""
+    return fetch_all(
+        lambda: supabase.table('ingredients').select(INGREDIENT_COLUMNS).is_('cost_master_id', 'null').order('id'),
+        INGREDIENT_PAGE_SIZE
+    )
+
+
+def _same_cost(before, after: Optional[Decimal]) -> bool:
+    if before is None or after is None:
+        return before is None and after is None
+    return Decimal(str(before)).quantize(Decimal('0.01')) == after
+
+
+class RecipeRecoster:
+    """
+    原価表の再読み込みで変わった行を受け取り、依存する材料とレシピの原価を再計算する
+
+    enqueueは呼び出し元（原価表キャッシュの再読み込み）をブロックしない。
+    複数回のenqueueは次の処理でまとめて扱う。
+    """
+
+    def __init__(self, supabase: Client, cost_calculator, batch_size: Optional[int] = None):
+        self.supabase = supabase
+        self.cost_calculator = cost_calculator
+        self.batch_size = batch_size or int(os.getenv('RECIPE_RECOST_BATCH_SIZE', RECOST_WRITE_BATCH_SIZE))
+        self._pending: Set[str] = set()
+        self._relink = False
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def enqueue(self, cost_master_ids: Iterable[str], relink: bool = False):
+        """再計算する原価表の行を登録（relink=Trueの場合は未照合の材料も照合し直す）"""
+        with self._lock:
+            self._pending.update(cost_master_ids)
+            self._relink = self._relink or relink
+            if not self._pending and not self._relink:
+                return
+        self.start()
+        self._wakeup.set()
+
+    def start(self):
+        """再計算ジョブをデーモンスレッドで開始（二重起動はしない）"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._run, name='recipe-recoster', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            self._wakeup.wait()
+            self._wakeup.clear()
+            if not self._stop_event.is_set():
+                self.run_once()
+
+    def run_once(self) -> Dict:
+        """
+        登録済みの行に依存する材料を再計算し、原価が変わった材料とそのレシピを更新
+
+        Returns:
+            {'ingredients': 再計算した材料数, 'changed': 原価が変わった材料数, 'recipes': 更新したレシピ数}
+        """
+        with self._lock:
+            cost_master_ids, self._pending = self._pending, set()
+            relink, self._relink = self._relink, False
+        summary = {'ingredients': 0, 'changed': 0, 'recipes': 0}
+        if not cost_master_ids and not relink:
+            return summary
+
+        try:
+            rows = [row for dependents in load_dependents(self.supabase, cost_master_ids).values()
+                    for row in dependents]
+            if relink:
+                rows.extend(load_unlinked_ingredients(self.supabase))
+        except Exception as e:
+            print(f"再計算対象の材料の取得エラー: {e}")
+            return summary
+
+        updates = []
+        for row in rows:
+            name, quantity, unit = row['ingredient_name'], float(row.get('quantity') or 0), row.get('unit') or ''
+            master_data = self.cost_calculator.match_cost_master(name, quantity, unit)
+            if master_data is None and row.get('cost_master_id') is None:
+                # 未照合のまま（原価表にまだない材料）
+                continue
+            cost = self.cost_calculator.cost_from_master_row(master_data, name, quantity, unit) if master_data else None
+            cost_master_id = master_data.get('id') if master_data else None
+            if cost_master_id == row.get('cost_master_id') and _same_cost(row.get('cost'), cost):
+                continue
+            updates.append({
+                'id': row['id'],
+                'cost': float(cost) if cost is not None else None,
+                'cost_master_id': cost_master_id
+            })
+        summary['ingredients'] = len(rows)
+        summary['changed'] = len(updates)
+
+        for batch in iter_chunks(updates, self.batch_size):
+            try:
+                result = self.supabase.rpc('apply_ingredient_costs', {'p_costs': batch}).execute()
+                summary['recipes'] += result.data or 0
+            except Exception as e:
+                print(f"材料の原価の一括更新エラー: {e}")
+
+        if rows:
+            print(f"🔁 保存レシピの原価を再計算しました: 材料{summary['ingredients']}件中"
+                  f"{summary['changed']}件を更新、レシピ{summary['recipes']}件")
+        return summary
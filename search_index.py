@@ -0,0 +1,184 @@
+"""
+原価マスターの材料名検索用インメモリ n-gram 転置インデックス
+"""
+import re
+from bisect import bisect_right
+import unicodedata
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+# ひらがな → カタカナ（ぁ〜ゖ、ゝゞ）
+_HIRAGANA_TO_KATAKANA = {code: code + 0x60 for code in list(range(0x3041, 0x3097)) + [0x309D, 0x309E]}
+
+# 長音記号・ハイフン類と中黒、空白は比較時に無視する
+_FOLD_PATTERN = re.compile(r'[ー‐‑–—―\-・·\s]')
+
+
+def normalize_search_key(text: str) -> str:
+    """
+    材料名の検索キーを生成
+
+    NFKC正規化（半角カナ・全角英数の統一）→ ひらがなをカタカナに変換
+    → 長音・中黒・空白を除去 → 小文字化、の順に処理する。
+    supabase/migrations の cost_master_search_key() と同じ規則にすること。
+    """
+    key = unicodedata.normalize('NFKC', text or '')
+    key = key.translate(_HIRAGANA_TO_KATAKANA)
+    key = _FOLD_PATTERN.sub('', key)
+    return key.lower()
+
+
+class _Snapshot(NamedTuple):
+    """構築済みインデックスの一式（差し替えは参照の代入1回で行い、中身は変更しない）"""
+    rows: List[Dict]
+    keys: List[str]
+    order: List[Tuple[str, str]]
+    postings: Dict[str, List[int]]
+    ready: bool
+
+
+_EMPTY_SNAPSHOT = _Snapshot([], [], [], {}, False)
+
+
+class IngredientSearchIndex:
+    """
+    材料名の部分一致検索を行うバイグラム転置インデックス
+
+    材料名と検索語はどちらも正規化した検索キーで比較する。
+    行は (ingredient_name, id) 順に並べて保持し、ポスティングリストも昇順のため、
+    検索結果は追加のソートなしで ingredient_name 順になる。
+    """
+
+    def __init__(self, key_func: Callable[[str], str] = normalize_search_key):
+        self.key_func = key_func
+        self._snapshot: _Snapshot = _EMPTY_SNAPSHOT
+
+    @property
+    def is_ready(self) -> bool:
+        """インデックスが構築済みかどうか"""
+        return self._snapshot.ready
+
+    def __len__(self) -> int:
+        return len(self._snapshot.rows)
+
+    @staticmethod
+    def _ngrams(key: str, n: int = 2) -> set:
+        if len(key) < n:
+            return {key} if key else set()
+        return {key[i:i + n] for i in range(len(key) - n + 1)}
+
+    @staticmethod
+    def sort_key(row: Dict) -> Tuple[str, str]:
+        """行の並び順（キーセットページネーションのカーソルにも使う）"""
+        return (row['ingredient_name'], str(row.get('id') or ''))
+
+    def build(self, rows: Iterable[Dict], supplier_names: Optional[Dict[str, str]] = None):
+        """
+        原価マスターの行からインデックスを構築
+
+        Args:
+            rows: cost_masterの行（辞書）
+            supplier_names: supplier_id → 取引先名のマップ（検索結果に suppliers(name) として付与）
+        """
+        supplier_names = supplier_names or {}
+        prepared = []
+        for row in rows:
+            name = row.get('ingredient_name')
+            if not name:
+                continue
+            result_row = dict(row)
+            supplier_id = row.get('supplier_id')
+            if supplier_id and supplier_id in supplier_names:
+                result_row['suppliers'] = {'name': supplier_names[supplier_id]}
+            elif 'suppliers' not in result_row:
+                result_row['suppliers'] = None
+            prepared.append(result_row)
+        prepared.sort(key=self.sort_key)
+        order = [self.sort_key(r) for r in prepared]
+
+        keys = [r.get('search_key') or self.key_func(r['ingredient_name']) for r in prepared]
+        postings: Dict[str, List[int]] = {}
+        for position, key in enumerate(keys):
+            for gram in self._ngrams(key):
+                postings.setdefault(gram, []).append(position)
+
+        # 一式を1回の代入で公開し、検索中のスレッドには旧インデックスを一貫して見せる
+        self._snapshot = _Snapshot(prepared, keys, order, postings, True)
+
+    def clear(self):
+        """インデックスを破棄してコールド状態に戻す"""
+        self._snapshot = _EMPTY_SNAPSHOT
+
+    def scan(self, search_term: Optional[str] = None,
+             after: Optional[Tuple[str, str]] = None) -> Iterator[Dict]:
+        """
+        行を (ingredient_name, id) 順に列挙
+
+        Args:
+            search_term: 指定した場合は材料名の部分一致で絞り込む
+            after: このsort_keyより後ろの行から列挙する（キーセットページネーション用）
+        """
+        rows, keys, order, postings, _ = self._snapshot
+        start = bisect_right(order, tuple(after)) if after else 0
+
+        term = self.key_func(search_term.strip()) if search_term else ''
+        if not term:
+            for position in range(start, len(rows)):
+                yield rows[position]
+            return
+
+        if len(term) < 2:
+            candidates: Iterable[int] = range(start, len(keys))
+        else:
+            posting_lists = []
+            for gram in self._ngrams(term):
+                posting = postings.get(gram)
+                if not posting:
+                    return
+                posting_lists.append(posting)
+            shortest = min(posting_lists, key=len)
+            candidates = shortest[bisect_right(shortest, start - 1):]
+
+        for position in candidates:
+            if term in keys[position]:
+                yield rows[position]
+
+    def search(self, search_term: str, limit: int = 10, offset: int = 0) -> List[Dict]:
+        """
+        材料名の部分一致検索
+
+        Args:
+            offset: 先頭から読み飛ばす件数（ページ送り用）
+
+        Returns:
+            ingredient_name順に並んだ行のリスト（最大limit件）
+        """
+        rows, keys, _, postings, _ = self._snapshot
+        term = self.key_func(search_term.strip())
+        if not term:
+            return []
+
+        grams = self._ngrams(term)
+        if len(term) < 2:
+            # 1文字の場合は全件走査（バイグラムでは絞り込めない）
+            candidates: Iterable[int] = range(len(keys))
+        else:
+            posting_lists = []
+            for gram in grams:
+                posting = postings.get(gram)
+                if not posting:
+                    return []
+                posting_lists.append(posting)
+            # 最も短いポスティングリストを基準に部分一致を検証する
+            candidates = min(posting_lists, key=len)
+
+        results = []
+        skipped = 0
+        for position in candidates:
+            if term in keys[position]:
+                if skipped < offset:
+                    skipped += 1
+                    continue
+                results.append(rows[position])
+                if len(results) >= limit:
+                    break
+        return results
@@ -0,0 +1,101 @@
+"""
+規格・商品名からの容量抽出
+
+単位ごとの正規表現を順に試す代わりに、事前コンパイルした1つの正規表現で
+文字列を1回だけ走査し、最も優先順位の高い単位の一致を選ぶ。
+"""
+import re
+import unicodedata
+from functools import lru_cache
+from typing import Optional, Tuple
+
+# 単位ごとの (優先順位, 換算係数, 変換後の単位)。優先順位が小さいほど優先
+_UNITS = {
+    # 重量系
+    'kg': (0, 1000, 'g'),
+    'g': (1, 1, 'g'),
+    # 容量系
+    'l': (2, 1000, 'ml'),
+    'ml': (3, 1, 'ml'),
+    # 個数系
+    'pc': (4, 1, 'pc'),
+    '個': (5, 1, '個'),
+    '本': (6, 1, '本'),
+    '枚': (7, 1, '枚'),
+    # パック系
+    'p': (8, 1, 'p'),
+}
+
+# 数値（桁区切りのカンマを含む）＋単位。同じ位置で複数の単位が一致する場合に備え、長い単位から並べる
+_CAPACITY_RE = re.compile(
+    r'(\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)\s*(' +
+    '|'.join(re.escape(unit) for unit in sorted(_UNITS, key=len, reverse=True)) +
+    r')',
+    re.IGNORECASE
+)
+
+# 末尾の「×入数」（750ml×12、500g×10袋、5枚×12個 など）
+_PACK_COUNT_RE = re.compile(
+    r'\s*[×*]\s*\d+\s*(?:個入り?|本入り?|入り?|袋|パック|ケース|cs|個|本|p)?\s*$',
+    re.IGNORECASE
+)
+
+# 同じ規格・商品名は取引データに何度も現れるため、結果をキャッシュする
+_CACHE_SIZE = 8192
+
+
+def _find_capacity(text: str) -> Optional[Tuple[float, str]]:
+    """文字列を1回走査し、最も優先順位の高い単位の (容量, 単位) を返す（同順位なら先に現れたもの）"""
+    best = None
+    best_priority = len(_UNITS)
+    for match in _CAPACITY_RE.finditer(text):
+        priority, factor, unit = _UNITS[match.group(2).lower()]
+        if priority < best_priority:
+            best_priority = priority
+            best = (float(match.group(1).replace(',', '')) * factor, unit)
+            if priority == 0:
+                break
+    return best
+
+
+@lru_cache(maxsize=_CACHE_SIZE)
+def parse_capacity(spec_text: str, product_name: str = "") -> Optional[Tuple[float, str]]:
+    """
+    規格（見つからなければ商品名）から (容量, 単位) を抽出する
+
+    全角の数字・単位（５００ｇ、㎏ など）はNFKC正規化で半角にそろえ、
+    規格の末尾の「×入数」は容量と取り違えないよう除去する。
+    """
+    spec = _PACK_COUNT_RE.sub('', unicodedata.normalize('NFKC', spec_text.strip()))
+    found = _find_capacity(spec)
+    if found is None and product_name:
+        found = _find_capacity(unicodedata.normalize('NFKC', product_name))
+    return found
+
+
+def extract_capacity_from_spec(spec_text, product_name="", unit_column=""):
+    """
+    規格や商品名、単位列から容量を抽出する関数
+
+    Args:
+        spec_text: 規格テキスト
+        product_name: 商品名
+        unit_column: CSVの単位列の内容（そのまま保持、変換しない）
+
+    Returns:
+        tuple: (capacity, unit, unit_column)
+            - capacity: 容量の数値（kg→g, L→mlに変換済み）
+            - unit: 容量の単位（g, ml, 個など、変換済み）
+            - unit_column: CSVの単位列をそのまま保持（PC, kg, Lなど、変換しない）
+    """
+    found = parse_capacity(spec_text or "", product_name or "")
+    if found:
+        capacity, unit = found
+        # unit_columnは絶対に変換せず、そのまま返す
+        return (capacity, unit, unit_column)
+
+    # デフォルト値
+    # 規格や商品名から容量が抽出できない場合
+    # - unit: 容量の単位として'個'を使用
+    # - unit_column: CSVの単位列を絶対にそのまま保持（変換しない）
+    return (1, '個', unit_column)
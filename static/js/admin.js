@@ -58,6 +58,31 @@ document.addEventListener('DOMContentLoaded', function() {
     
     let selectedFile = null;
 
+    // 取引データの単価の決め方（取引データ選択時のみ表示）
+    const pricePolicyGroup = document.getElementById('pricePolicyGroup');
+    const pricePolicy = document.getElementById('pricePolicy');
+    const windowDaysGroup = document.getElementById('windowDaysGroup');
+    const windowDays = document.getElementById('windowDays');
+
+    function updatePricePolicyVisibility() {
+        if (!pricePolicyGroup) return;
+        const checked = document.querySelector('input[name="uploadType"]:checked');
+        pricePolicyGroup.style.display = checked && checked.value === 'transaction' ? '' : 'none';
+        if (windowDaysGroup && pricePolicy) {
+            windowDaysGroup.style.display = pricePolicy.value === 'trailing_mean' ? '' : 'none';
+        }
+    }
+
+    document.querySelectorAll('input[name="uploadType"]').forEach(radio => {
+        radio.addEventListener('change', updatePricePolicyVisibility);
+    });
+    if (pricePolicy) {
+        pricePolicy.addEventListener('change', updatePricePolicyVisibility);
+    }
+    updatePricePolicyVisibility();
+    // 取引データの一括アップロード用（複数CSVまたはzip）
+    let selectedFiles = [];
+
     // ファイルアップロード関連のイベント（要素が存在する場合のみ）
     if (uploadArea && fileInput) {
         uploadArea.addEventListener('click', () => fileInput.click());
@@ -139,22 +164,68 @@ document.addEventListener('DOMContentLoaded', function() {
         uploadArea.classList.remove('dragover');
         
         const files = e.dataTransfer.files;
-        if (files.length > 0) {
+        if (files.length > 1) {
+            handleFiles(files);
+        } else if (files.length > 0) {
             handleFile(files[0]);
         }
     }
 
     function handleFileSelect(e) {
         const files = e.target.files;
-        if (files.length > 0) {
+        if (files.length > 1) {
+            handleFiles(files);
+        } else if (files.length > 0) {
             handleFile(files[0]);
         }
     }
 
+    // 取引データCSVの複数選択（月ごとのファイルをまとめて登録）
+    function handleFiles(fileList) {
+        const files = Array.from(fileList);
+        if (!files.every(file => file.name.toLowerCase().match(/\.(csv|zip)$/))) {
+            showStatus('error', '複数ファイルの場合は取引データのCSV/zipファイルのみアップロード可能です。');
+            return;
+        }
+
+        const totalSize = files.reduce((sum, file) => sum + file.size, 0);
+        if (totalSize > 100 * 1024 * 1024) {
+            showStatus('error', 'ファイルサイズの合計は100MB以下にしてください。');
+            return;
+        }
+
+        // 複数ファイルは取引データとして扱う
+        const transactionRadio = document.getElementById('transactionUpload');
+        if (transactionRadio) {
+            transactionRadio.checked = true;
+            updatePricePolicyVisibility();
+        }
+
+        selectedFiles = files;
+        selectedFile = files[0];
+        uploadBtn.disabled = false;
+
+        uploadArea.innerHTML = `
+            <i class="fas fa-copy fa-3x text-success mb-3"></i>
+            <h5 class="text-success">${files.length}件のファイル</h5>
+            <p class="text-muted">${files.map(file => escapeHtml(file.name)).join('<br>')}</p>
+            <p class="text-muted">合計サイズ: ${formatFileSize(totalSize)}</p>
+            <small class="text-info">クリックしてファイルを変更</small>
+        `;
+
+        showStatus('info', 'ファイルが選択されました。アップロードボタンをクリックしてください。');
+    }
+
     function handleFile(file) {
-        // CSVファイルかチェック
-        if (!file.name.toLowerCase().match(/\.(csv|xlsx|xls)$/)) {
-            showStatus('error', 'CSV/Excelファイルのみアップロード可能です。');
+        // CSV/Excelファイル（取引データはzipも可）かチェック
+        if (!file.name.toLowerCase().match(/\.(csv|xlsx|xls|zip)$/)) {
+            showStatus('error', 'CSV/Excel/zipファイルのみアップロード可能です。');
+            return;
+        }
+
+        // zipは取引データの一括アップロードとして扱う
+        if (file.name.toLowerCase().endsWith('.zip')) {
+            handleFiles([file]);
             return;
         }
 
@@ -165,6 +236,7 @@ document.addEventListener('DOMContentLoaded', function() {
         }
 
         selectedFile = file;
+        selectedFiles = [];
         uploadBtn.disabled = false;
         
         // ファイルアイコンの選択
@@ -215,8 +287,24 @@ document.addEventListener('DOMContentLoaded', function() {
             endpoint: endpoint
         });
 
+        // 複数ファイル・zipは取引データの一括アップロード（並列に集約して1回だけ保存）
         const formData = new FormData();
-        formData.append('file', selectedFile);
+        if (selectedFiles.length > 0) {
+            if (uploadType !== 'transaction') {
+                showStatus('error', '複数ファイル・zipのアップロードは取引データのみ対応しています。');
+                return;
+            }
+            endpoint = '/admin/upload-transactions';
+            selectedFiles.forEach(file => formData.append('files', file));
+        } else {
+            formData.append('file', selectedFile);
+        }
+        if (uploadType === 'transaction' && pricePolicy) {
+            formData.append('price_policy', pricePolicy.value);
+            if (pricePolicy.value === 'trailing_mean' && windowDays) {
+                formData.append('window_days', windowDays.value);
+            }
+        }
 
         try {
             uploadBtn.disabled = true;
@@ -241,20 +329,40 @@ document.addEventListener('DOMContentLoaded', function() {
                 statusText: response.statusText
             });
 
-            const result = await response.json();
-            console.log('📊 Response data:', result);
+            const accepted = await response.json();
+            console.log('📊 Response data:', accepted);
 
-            if (response.ok) {
+            if (!response.ok) {
+                console.error('❌ Upload failed:', accepted);
+                showStatus('error', accepted.error || 'アップロードに失敗しました。');
+                return;
+            }
+
+            // バックグラウンドジョブの完了まで進捗を表示
+            const job = await waitForUploadJob(accepted.status_url || `/admin/jobs/${accepted.job_id}`);
+            const result = job.result || {};
+
+            if (job.status === 'succeeded') {
+                const breakdown = `新規: ${result.inserted || 0}件 / 更新: ${result.updated || 0}件 / 変更なし: ${result.unchanged || 0}件`;
                 if (uploadType === 'transaction') {
-                    showStatus('success', `取引データ処理完了！\n処理: ${result.processed}件\n抽出: ${result.extracted}件\n保存: ${result.saved}件`);
+                    const fileCount = result.files ? `ファイル: ${result.files.length}件\n` : '';
+                    const policy = result.price_policy ? `単価: ${result.price_policy}\n` : '';
+                    showStatus('success', `取引データ処理完了！\n${fileCount}${policy}処理: ${result.processed}件\n抽出: ${result.extracted}件\n${breakdown}`);
+                } else if (result.error_count) {
+                    // 一部の行がエラーの場合は行番号つきで表示（先頭の数件のみ）
+                    const details = (result.errors || []).slice(0, 5)
+                        .map(e => `${e.row}行目: ${e.error}`).join('\n');
+                    const more = result.error_count > 5 ? `\n…ほか${result.error_count - 5}件` : '';
+                    console.warn('⚠️ Upload row errors:', result.errors);
+                    showStatus('info', `アップロード完了（一部エラー）\n${breakdown}\nエラー: ${result.error_count}件\n${details}${more}`);
                 } else {
-                    showStatus('success', `アップロード完了！${result.count}件のデータが登録されました。`);
+                    showStatus('success', `アップロード完了！\n${breakdown}`);
                 }
                 resetUploadArea();
                 refreshDatabaseStats();
             } else {
-                console.error('❌ Upload failed:', result);
-                showStatus('error', result.error || 'アップロードに失敗しました。');
+                console.error('❌ Upload job failed:', job);
+                showStatus('error', `アップロードに失敗しました: ${job.error || '不明なエラー'}`);
             }
         } catch (error) {
             showStatus('error', 'アップロード中にエラーが発生しました。');
@@ -262,6 +370,40 @@ document.addEventListener('DOMContentLoaded', function() {
         } finally {
             uploadBtn.disabled = false;
             uploadProgress.style.display = 'none';
+            setUploadProgress(0);
+        }
+    }
+
+    // 進捗バーの更新（0〜1）
+    function setUploadProgress(fraction) {
+        const bar = uploadProgress.querySelector('.progress-bar-custom');
+        if (bar) {
+            bar.style.width = `${Math.round(Math.min(1, Math.max(0, fraction)) * 100)}%`;
+        }
+    }
+
+    // アップロードジョブの進捗をポーリングし、完了または失敗したジョブを返す
+    async function waitForUploadJob(statusUrl, intervalMs = 1000) {
+        while (true) {
+            const response = await fetch(statusUrl);
+            const job = await response.json();
+            if (!response.ok) {
+                throw new Error(job.error || `HTTP ${response.status}`);
+            }
+
+            if (job.status === 'succeeded' || job.status === 'failed') {
+                setUploadProgress(1);
+                return job;
+            }
+
+            if (job.status === 'queued') {
+                showStatus('info', '処理待ちです...');
+            } else {
+                setUploadProgress(job.progress || 0);
+                const throughput = job.rows_per_second ? `（${job.rows_per_second}行/秒）` : '';
+                showStatus('info', `処理中... 解析: ${job.rows_parsed}行 / 登録: ${job.rows_upserted}件 / 失敗: ${job.rows_failed}件${throughput}`);
+            }
+            await new Promise(resolve => setTimeout(resolve, intervalMs));
         }
     }
 
@@ -320,47 +462,26 @@ document.addEventListener('DOMContentLoaded', function() {
     }
 
     // データベース内容の確認
-    async function viewDatabaseData() {
-        try {
-            const response = await fetch('/admin/data');
-            const data = await response.json();
-
-            if (response.ok) {
-                // モーダルでデータを表示
-                showDataModal(data);
-            } else {
-                showStatus('error', 'データの取得に失敗しました。');
-            }
-        } catch (error) {
-            showStatus('error', 'データの取得中にエラーが発生しました。');
-            console.error('Data fetch error:', error);
-        }
+    function viewDatabaseData() {
+        // モーダルを開き、各表は最初のページから読み込む
+        showDataModal();
     }
 
     // データのエクスポート
-    async function exportDatabaseData() {
-        try {
-            const response = await fetch('/admin/export');
-            const blob = await response.blob();
-            
-            if (response.ok) {
-                const url = window.URL.createObjectURL(blob);
-                const a = document.createElement('a');
-                a.href = url;
-                a.download = `cost_master_export_${new Date().toISOString().split('T')[0]}.csv`;
-                document.body.appendChild(a);
-                a.click();
-                window.URL.revokeObjectURL(url);
-                document.body.removeChild(a);
-                
-                showStatus('success', 'データをエクスポートしました。');
-            } else {
-                showStatus('error', 'データのエクスポートに失敗しました。');
-            }
-        } catch (error) {
-            showStatus('error', 'データのエクスポート中にエラーが発生しました。');
-            console.error('Export error:', error);
-        }
+    function exportDatabaseData() {
+        // サーバーからのストリーミングをそのままダウンロードさせる（ブラウザのメモリに溜めない）
+        const formatSelect = document.getElementById('exportFormat');
+        const [format, encoding] = (formatSelect ? formatSelect.value : 'csv:utf-8').split(':');
+        const params = new URLSearchParams({ format });
+        if (encoding) params.set('encoding', encoding);
+
+        const a = document.createElement('a');
+        a.href = `/admin/export?${params.toString()}`;
+        document.body.appendChild(a);
+        a.click();
+        document.body.removeChild(a);
+
+        showStatus('success', 'データのエクスポートを開始しました。');
     }
 
     // データのクリア
@@ -486,6 +607,7 @@ document.addEventListener('DOMContentLoaded', function() {
     // アップロードエリアのリセット
     function resetUploadArea() {
         selectedFile = null;
+        selectedFiles = [];
         uploadBtn.disabled = true;
         fileInput.value = '';
         
@@ -505,8 +627,178 @@ document.addEventListener('DOMContentLoaded', function() {
         return parseFloat((bytes / Math.pow(k, i)).toFixed(2)) + ' ' + sizes[i];
     }
 
+    // データ一覧のページング設定
+    const DATA_PAGE_SIZE = 100;
+    const DATA_ROW_HEIGHT = 33;     // 仮想スクロールの1行の高さ（px）
+    const DATA_ROW_BUFFER = 10;     // 表示範囲の前後に余分に描画する行数
+    const DATA_PREFETCH_ROWS = 30;  // 残りがこの行数になったら次のページを読み込む
+
+    // HTMLエスケープ
+    function escapeHtml(value) {
+        return String(value ?? '').replace(/[&<>"']/g, ch => ({
+            '&': '&amp;', '<': '&lt;', '>': '&gt;', '"': '&quot;', "'": '&#39;'
+        }[ch]));
+    }
+
+    // /admin/data のページ読み込み状態
+    function createDataPager(table, filters = {}) {
+        return { table, filters, rows: [], cursor: null, done: false, loading: false, generation: 0 };
+    }
+
+    // 次のページを読み込む（JSON配列 + X-Next-Cursor ヘッダー）
+    async function fetchDataPage(pager) {
+        if (pager.loading || pager.done) return false;
+        pager.loading = true;
+        const generation = pager.generation;
+        try {
+            const params = new URLSearchParams({ table: pager.table, limit: DATA_PAGE_SIZE });
+            if (pager.cursor) params.set('cursor', pager.cursor);
+            Object.entries(pager.filters).forEach(([key, value]) => {
+                if (value !== '' && value !== null && value !== undefined) params.set(key, value);
+            });
+
+            const response = await fetch(`/admin/data?${params.toString()}`);
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            const rows = await response.json();
+            // 読み込み中にフィルターが変わった場合は結果を捨てる
+            if (generation !== pager.generation) return false;
+
+            pager.rows.push(...rows);
+            pager.cursor = response.headers.get('X-Next-Cursor');
+            pager.done = !pager.cursor;
+            return true;
+        } catch (error) {
+            showStatus('error', 'データの取得中にエラーが発生しました。');
+            console.error('Data fetch error:', error);
+            pager.done = true;
+            return false;
+        } finally {
+            if (generation === pager.generation) pager.loading = false;
+        }
+    }
+
+    // フィルター変更時に最初のページから読み直す
+    function resetDataPager(pager, filters) {
+        pager.filters = filters;
+        pager.rows = [];
+        pager.cursor = null;
+        pager.done = false;
+        pager.loading = false;
+        pager.generation += 1;
+    }
+
+    // 原価マスターの1行
+    function renderCostMasterRow(item) {
+        // 容量の表示（小数点以下を削除）
+        const capacity = item.capacity || 0;
+        const capacityDisplay = capacity === parseInt(capacity) ? 
+            parseInt(capacity).toString() : 
+            capacity.toString();
+        
+        // 単位情報の表示（unit_columnを優先）
+        // unit_columnがnullでない場合は、空文字列でもそれを尊重する
+        let unitDisplay;
+        if (item.unit_column !== null && item.unit_column !== undefined) {
+            // unit_columnが存在する場合は、それを表示（空文字列の場合は容量のみ）
+            unitDisplay = item.unit_column || capacityDisplay;
+        } else {
+            // unit_columnが存在しない場合は、unitを表示
+            unitDisplay = item.unit || '-';
+        }
+        
+        // 単価の表示（小数点以下を削除）
+        const unitPrice = item.unit_price || 0;
+        const unitPriceDisplay = unitPrice === parseInt(unitPrice) ? 
+            parseInt(unitPrice) : 
+            unitPrice;
+        
+        return `
+        <tr style="height: ${DATA_ROW_HEIGHT}px;">
+            <td>${escapeHtml(item.ingredient_name || '-')}</td>
+            <td>${escapeHtml(item.suppliers?.name || '-')}</td>
+            <td>${escapeHtml(capacityDisplay)}</td>
+            <td>${escapeHtml(unitDisplay)}</td>
+            <td>${escapeHtml(item.spec || '-')}</td>
+            <td>¥${escapeHtml(unitPriceDisplay)}</td>
+        </tr>
+        `;
+    }
+
+    // レシピの1行
+    function renderRecipeRow(item) {
+        return `
+            <tr>
+                <td>
+                    <a href="/recipe/${encodeURIComponent(item.id)}" target="_blank" style="color: #81c784; text-decoration: none; font-size: 0.9rem;">
+                        ${escapeHtml(item.recipe_name || '-')}
+                    </a>
+                </td>
+                <td style="font-size: 0.85rem;">${item.servings || 0}人前</td>
+                <td style="font-size: 0.85rem; color: #6c757d;">${new Date(item.created_at).toLocaleDateString('ja-JP')}</td>
+            </tr>
+        `;
+    }
+
+    // 原価マスターの仮想スクロール表（見えている行だけを描画する）
+    function setupVirtualCostMasterTable(container, tbody, countLabel, pager) {
+        function render() {
+            const rows = pager.rows;
+            const first = Math.max(0, Math.floor(container.scrollTop / DATA_ROW_HEIGHT) - DATA_ROW_BUFFER);
+            const visibleCount = Math.ceil(container.clientHeight / DATA_ROW_HEIGHT) + DATA_ROW_BUFFER * 2;
+            const last = Math.min(rows.length, first + visibleCount);
+
+            if (rows.length === 0) {
+                tbody.innerHTML = pager.done
+                    ? '<tr><td colspan="6" class="text-center">データなし</td></tr>'
+                    : '<tr><td colspan="6" class="text-center">読み込み中...</td></tr>';
+            } else {
+                const topSpacer = first * DATA_ROW_HEIGHT;
+                const bottomSpacer = (rows.length - last) * DATA_ROW_HEIGHT;
+                tbody.innerHTML =
+                    (topSpacer ? `<tr style="height: ${topSpacer}px;"><td colspan="6" style="padding: 0; border: 0;"></td></tr>` : '') +
+                    rows.slice(first, last).map(renderCostMasterRow).join('') +
+                    (bottomSpacer ? `<tr style="height: ${bottomSpacer}px;"><td colspan="6" style="padding: 0; border: 0;"></td></tr>` : '');
+            }
+            countLabel.textContent = `${rows.length}${pager.done ? '' : '+'}`;
+
+            // 末尾が近づいたら次のページを読み込む
+            if (!pager.done && !pager.loading && last >= rows.length - DATA_PREFETCH_ROWS) {
+                fetchDataPage(pager).then(loaded => { if (loaded || pager.done) render(); });
+            }
+        }
+
+        let scheduled = false;
+        container.addEventListener('scroll', () => {
+            if (scheduled) return;
+            scheduled = true;
+            requestAnimationFrame(() => {
+                scheduled = false;
+                render();
+            });
+        });
+        return render;
+    }
+
+    // レシピ一覧（スクロールで続きを読み込む）
+    function setupRecipeList(container, tbody, countLabel, pager) {
+        async function loadMore() {
+            if (!(await fetchDataPage(pager)) && !pager.done) return;
+            tbody.innerHTML = pager.rows.map(renderRecipeRow).join('') ||
+                '<tr><td colspan="3" class="text-center" style="font-size: 0.85rem; color: #6c757d;">データなし</td></tr>';
+            countLabel.textContent = `${pager.rows.length}${pager.done ? '' : '+'}`;
+        }
+        container.addEventListener('scroll', () => {
+            if (container.scrollTop + container.clientHeight >= container.scrollHeight - DATA_ROW_HEIGHT * 5) {
+                loadMore();
+            }
+        });
+        return loadMore;
+    }
+
     // データモーダルの表示
-    function showDataModal(data) {
+    function showDataModal() {
         // モーダルのHTMLを作成
         const modalHTML = `
             <div class="modal fade" id="dataModal" tabindex="-1">
@@ -519,62 +811,33 @@ document.addEventListener('DOMContentLoaded', function() {
                         <div class="modal-body">
                             <div class="row">
                                 <div class="col-md-6">
-                                    <h6 style="color: #81c784;">原価マスター (${data.cost_master?.length || 0}件)</h6>
-                                    <div class="table-responsive" style="max-height: 400px;">
-                                        <table class="table table-sm table-dark">
-                                            <thead style="background-color: rgba(100, 181, 246, 0.2);">
+                                    <h6 style="color: #81c784;">原価マスター (<span id="costMasterCount">0</span>件)</h6>
+                                    <div class="row g-1 mb-2">
+                                        <div class="col-12"><input type="search" class="form-control form-control-sm" id="costMasterSearch" placeholder="材料名で検索"></div>
+                                        <div class="col-4"><input type="text" class="form-control form-control-sm" id="costMasterSupplier" placeholder="取引先"></div>
+                                        <div class="col-2"><input type="text" class="form-control form-control-sm" id="costMasterUnit" placeholder="単位"></div>
+                                        <div class="col-3"><input type="number" class="form-control form-control-sm" id="costMasterMinPrice" placeholder="単価 下限" min="0"></div>
+                                        <div class="col-3"><input type="number" class="form-control form-control-sm" id="costMasterMaxPrice" placeholder="単価 上限" min="0"></div>
+                                    </div>
+                                    <div class="table-responsive" id="costMasterScroll" style="height: 400px; overflow-y: auto;">
+                                        <table class="table table-sm table-dark" style="table-layout: fixed; white-space: nowrap;">
+                                            <thead style="background-color: rgba(100, 181, 246, 0.2); position: sticky; top: 0;">
                                                 <tr>
-                                                    <th>材料名</th>
-                                                    <th>取引先</th>
-                                                    <th>容量</th>
-                                                    <th>単位</th>
-                                                    <th>規格</th>
-                                                    <th>単価</th>
+                                                    <th style="width: 30%;">材料名</th>
+                                                    <th style="width: 20%;">取引先</th>
+                                                    <th style="width: 10%;">容量</th>
+                                                    <th style="width: 10%;">単位</th>
+                                                    <th style="width: 15%;">規格</th>
+                                                    <th style="width: 15%;">単価</th>
                                                 </tr>
                                             </thead>
-                                            <tbody>
-                                                ${data.cost_master?.map(item => {
-                                                    // 容量の表示（小数点以下を削除）
-                                                    const capacity = item.capacity || 0;
-                                                    const capacityDisplay = capacity === parseInt(capacity) ? 
-                                                        parseInt(capacity).toString() : 
-                                                        capacity.toString();
-                                                    
-                                                    // 単位情報の表示（unit_columnを優先）
-                                                    // unit_columnがnullでない場合は、空文字列でもそれを尊重する
-                                                    let unitDisplay;
-                                                    if (item.unit_column !== null && item.unit_column !== undefined) {
-                                                        // unit_columnが存在する場合は、それを表示（空文字列の場合は容量のみ）
-                                                        unitDisplay = item.unit_column || capacityDisplay;
-                                                    } else {
-                                                        // unit_columnが存在しない場合は、unitを表示
-                                                        unitDisplay = item.unit || '-';
-                                                    }
-                                                    
-                                                    // 単価の表示（小数点以下を削除）
-                                                    const unitPrice = item.unit_price || 0;
-                                                    const unitPriceDisplay = unitPrice === parseInt(unitPrice) ? 
-                                                        parseInt(unitPrice) : 
-                                                        unitPrice;
-                                                    
-                                                    return `
-                                                    <tr>
-                                                        <td>${item.ingredient_name || '-'}</td>
-                                                        <td>${item.suppliers?.name || '-'}</td>
-                                                        <td>${capacityDisplay}</td>
-                                                        <td>${unitDisplay}</td>
-                                                        <td>${item.spec || '-'}</td>
-                                                        <td>¥${unitPriceDisplay}</td>
-                                                    </tr>
-                                                    `;
-                                                }).join('') || '<tr><td colspan="6" class="text-center">データなし</td></tr>'}
-                                            </tbody>
+                                            <tbody id="costMasterBody" style="overflow: hidden;"></tbody>
                                         </table>
                                     </div>
                                 </div>
                                 <div class="col-md-6">
-                                    <h6 style="color: #81c784;">レシピ (${data.recipes?.length || 0}件)</h6>
-                                    <div class="table-responsive" style="max-height: 400px;">
+                                    <h6 style="color: #81c784;">レシピ (<span id="recipeCount">0</span>件)</h6>
+                                    <div class="table-responsive" id="recipeScroll" style="max-height: 400px; overflow-y: auto;">
                                         <table class="table table-sm table-dark">
                                             <thead style="background-color: rgba(100, 181, 246, 0.2);">
                                                 <tr>
@@ -583,19 +846,7 @@ document.addEventListener('DOMContentLoaded', function() {
                                                     <th>作成日</th>
                                                 </tr>
                                             </thead>
-                                            <tbody>
-                                                ${data.recipes?.map(item => `
-                                                    <tr>
-                                                        <td>
-                                                            <a href="/recipe/${item.id}" target="_blank" style="color: #81c784; text-decoration: none; font-size: 0.9rem;">
-                                                                ${item.recipe_name || '-'}
-                                                            </a>
-                                                        </td>
-                                                        <td style="font-size: 0.85rem;">${item.servings || 0}人前</td>
-                                                        <td style="font-size: 0.85rem; color: #6c757d;">${new Date(item.created_at).toLocaleDateString('ja-JP')}</td>
-                                                    </tr>
-                                                `).join('') || '<tr><td colspan="3" class="text-center" style="font-size: 0.85rem; color: #6c757d;">データなし</td></tr>'}
-                                            </tbody>
+                                            <tbody id="recipeBody"></tbody>
                                         </table>
                                     </div>
                                 </div>
@@ -617,9 +868,55 @@ document.addEventListener('DOMContentLoaded', function() {
 
         // 新しいモーダルを追加
         document.body.insertAdjacentHTML('beforeend', modalHTML);
+
+        // 原価マスター（仮想スクロール + フィルター）
+        const costMasterScroll = document.getElementById('costMasterScroll');
+        const costMasterPager = createDataPager('cost_master');
+        const renderCostMaster = setupVirtualCostMasterTable(
+            costMasterScroll,
+            document.getElementById('costMasterBody'),
+            document.getElementById('costMasterCount'),
+            costMasterPager
+        );
+
+        const filterInputs = {
+            q: document.getElementById('costMasterSearch'),
+            supplier: document.getElementById('costMasterSupplier'),
+            unit: document.getElementById('costMasterUnit'),
+            min_price: document.getElementById('costMasterMinPrice'),
+            max_price: document.getElementById('costMasterMaxPrice')
+        };
+        let filterTimer = null;
+        Object.values(filterInputs).forEach(input => {
+            input.addEventListener('input', () => {
+                // 入力が落ち着いてから検索する
+                clearTimeout(filterTimer);
+                filterTimer = setTimeout(() => {
+                    const filters = {};
+                    Object.entries(filterInputs).forEach(([key, el]) => { filters[key] = el.value.trim(); });
+                    resetDataPager(costMasterPager, filters);
+                    costMasterScroll.scrollTop = 0;
+                    renderCostMaster();
+                }, 300);
+            });
+        });
+
+        // レシピ（スクロールで続きを読み込む）
+        const loadRecipes = setupRecipeList(
+            document.getElementById('recipeScroll'),
+            document.getElementById('recipeBody'),
+            document.getElementById('recipeCount'),
+            createDataPager('recipes')
+        );
         
         // モーダルを表示
-        const modal = new bootstrap.Modal(document.getElementById('dataModal'));
+        const modalElement = document.getElementById('dataModal');
+        const modal = new bootstrap.Modal(modalElement);
+        // 表示後でないと表の高さが決まらないため、shown後に描画する
+        modalElement.addEventListener('shown.bs.modal', () => {
+            renderCostMaster();
+            loadRecipes();
+        }, { once: true });
         modal.show();
     }
 });
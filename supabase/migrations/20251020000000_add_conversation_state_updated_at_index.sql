@@ -0,0 +1,5 @@
+-- 期限切れの会話状態を掃除ジョブがバッチ削除するためのインデックス
+CREATE INDEX IF NOT EXISTS idx_conversation_state_updated_at ON public.conversation_state(updated_at);
+
+-- コメントを追加
+COMMENT ON COLUMN public.conversation_state.state IS '会話状態（コンパクト形式: 材料リストは1回のみ保持し、原価計算結果はrecipe_idで参照）';
@@ -0,0 +1,32 @@
+-- 材料名の検索キー（表記ゆれを吸収した正規化済みの名前）を追加
+ALTER TABLE public.cost_master
+ADD COLUMN IF NOT EXISTS search_key TEXT;
+
+-- 検索キーの生成関数（search_index.normalize_search_key と同じ規則）
+-- NFKC正規化 → ひらがなをカタカナに変換 → 長音・ハイフン類・中黒・空白を除去 → 小文字化
+CREATE OR REPLACE FUNCTION public.cost_master_search_key(name TEXT)
+RETURNS TEXT AS $$
+    SELECT lower(
+        regexp_replace(
+            translate(
+                normalize(coalesce(name, ''), NFKC),
+                'ぁあぃいぅうぇえぉおかがきぎくぐけげこごさざしじすずせぜそぞただちぢっつづてでとどなにぬねのはばぱひびぴふぶぷへべぺほぼぽまみむめもゃやゅゆょよらりるれろゎわゐゑをんゔゕゖゝゞ',
+                'ァアィイゥウェエォオカガキギクグケゲコゴサザシジスズセゼソゾタダチヂッツヅテデトドナニヌネノハバパヒビピフブプヘベペホボポマミムメモャヤュユョヨラリルレロヮワヰヱヲンヴヵヶヽヾ'
+            ),
+            '[ー‐‑–—―\-・·[:space:]]', '', 'g'
+        )
+    );
+$$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+
+-- 既存データを一括で埋める
+UPDATE public.cost_master
+SET search_key = public.cost_master_search_key(ingredient_name)
+WHERE search_key IS NULL OR search_key <> public.cost_master_search_key(ingredient_name);
+
+-- 完全一致用と部分一致（ilike）用のインデックス
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_cost_master_search_key ON public.cost_master(search_key);
+CREATE INDEX IF NOT EXISTS idx_cost_master_search_key_trgm ON public.cost_master USING gin (search_key gin_trgm_ops);
+
+-- コメントを追加
+COMMENT ON COLUMN public.cost_master.search_key IS '材料名の検索キー（半角/全角・ひらがな/カタカナ・長音・中黒・大文字小文字の違いを吸収）';
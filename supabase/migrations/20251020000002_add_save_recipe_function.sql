@@ -0,0 +1,49 @@
+-- レシピ本体の保存と材料の置き換えを1トランザクションで行う関数
+-- p_recipe_id がNULLの場合は新規作成、指定された場合は更新して材料を入れ替える
+CREATE OR REPLACE FUNCTION public.save_recipe_with_ingredients(
+    p_recipe_id UUID,
+    p_recipe_name TEXT,
+    p_servings INTEGER,
+    p_total_cost DECIMAL(10, 2),
+    p_ingredients JSONB
+)
+RETURNS UUID AS $$
+DECLARE
+    v_recipe_id UUID := p_recipe_id;
+BEGIN
+    IF v_recipe_id IS NULL THEN
+        INSERT INTO public.recipes (recipe_name, servings, total_cost)
+        VALUES (p_recipe_name, p_servings, p_total_cost)
+        RETURNING id INTO v_recipe_id;
+    ELSE
+        UPDATE public.recipes
+        SET recipe_name = p_recipe_name,
+            servings = p_servings,
+            total_cost = p_total_cost,
+            updated_at = now()
+        WHERE id = v_recipe_id;
+
+        IF NOT FOUND THEN
+            INSERT INTO public.recipes (id, recipe_name, servings, total_cost)
+            VALUES (v_recipe_id, p_recipe_name, p_servings, p_total_cost);
+        END IF;
+
+        DELETE FROM public.ingredients WHERE recipe_id = v_recipe_id;
+    END IF;
+
+    INSERT INTO public.ingredients (recipe_id, ingredient_name, quantity, unit, cost, capacity, capacity_unit)
+    SELECT v_recipe_id, x.ingredient_name, x.quantity, x.unit, x.cost, x.capacity, x.capacity_unit
+    FROM jsonb_to_recordset(COALESCE(p_ingredients, '[]'::jsonb)) AS x(
+        ingredient_name TEXT,
+        quantity DECIMAL(10, 2),
+        unit TEXT,
+        cost DECIMAL(10, 2),
+        capacity DECIMAL(10, 2),
+        capacity_unit TEXT
+    );
+
+    RETURN v_recipe_id;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON FUNCTION public.save_recipe_with_ingredients IS 'レシピと材料を1回の呼び出し・1トランザクションで保存（材料は全件置き換え）';
@@ -0,0 +1,2 @@
+-- レシピ一覧のキーセットページネーション（created_at降順）用インデックス
+CREATE INDEX IF NOT EXISTS idx_recipes_created_at ON recipes(created_at DESC);
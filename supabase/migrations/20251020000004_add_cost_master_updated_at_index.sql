@@ -0,0 +1,2 @@
+-- 管理画面の最終更新日時（ORDER BY updated_at DESC LIMIT 1）用インデックス
+CREATE INDEX IF NOT EXISTS idx_cost_master_updated_at ON cost_master(updated_at DESC);
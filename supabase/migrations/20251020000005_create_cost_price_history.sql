@@ -0,0 +1,49 @@
+-- 単価の履歴（追記のみ）
+-- cost_masterは現在の単価だけを持つため、過去の日付時点の原価計算や単価の推移に使う
+CREATE TABLE IF NOT EXISTS public.cost_price_history (
+    id BIGSERIAL PRIMARY KEY,
+    ingredient_name TEXT NOT NULL,
+    supplier_id UUID REFERENCES public.suppliers(id) ON DELETE SET NULL,
+    capacity DECIMAL(10, 2),
+    unit TEXT,
+    unit_price DECIMAL(10, 2) NOT NULL,
+    price_date DATE NOT NULL,
+    source TEXT,
+    recorded_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- 同じ観測（同じ品目・日付・単価）を重複して記録しない（取引先なしの行も同一とみなす）
+CREATE UNIQUE INDEX IF NOT EXISTS idx_cost_price_history_observation
+    ON public.cost_price_history (ingredient_name, supplier_id, capacity, unit, price_date, unit_price)
+    NULLS NOT DISTINCT;
+
+-- 日付順の読み込み用
+CREATE INDEX IF NOT EXISTS idx_cost_price_history_price_date
+    ON public.cost_price_history (price_date, id);
+
+-- 追記のみ（更新を禁止）
+CREATE OR REPLACE FUNCTION public.reject_cost_price_history_update()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    RAISE EXCEPTION 'cost_price_history is append-only';
+END;
+$$;
+
+DROP TRIGGER IF EXISTS cost_price_history_append_only ON public.cost_price_history;
+CREATE TRIGGER cost_price_history_append_only
+    BEFORE UPDATE ON public.cost_price_history
+    FOR EACH ROW EXECUTE FUNCTION public.reject_cost_price_history_update();
+
+ALTER TABLE public.cost_price_history ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Enable read access for cost_price_history" ON public.cost_price_history FOR SELECT USING (true);
+CREATE POLICY "Enable insert access for cost_price_history" ON public.cost_price_history FOR INSERT WITH CHECK (true);
+
+-- 現在の単価を最初の観測として登録
+INSERT INTO public.cost_price_history (ingredient_name, supplier_id, capacity, unit, unit_price, price_date, source)
+SELECT ingredient_name, supplier_id, capacity, unit, unit_price,
+       COALESCE(updated_at::date, CURRENT_DATE), 'initial'
+FROM public.cost_master
+WHERE unit_price IS NOT NULL
+ON CONFLICT DO NOTHING;
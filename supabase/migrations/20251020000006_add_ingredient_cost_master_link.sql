@@ -0,0 +1,94 @@
+-- 保存レシピの材料と、原価計算で照合した原価表の行を結び付ける
+-- 単価が変わった原価表の行から、再計算が必要な材料とレシピだけを引くために使う
+ALTER TABLE public.ingredients
+    ADD COLUMN IF NOT EXISTS cost_master_id UUID REFERENCES public.cost_master(id) ON DELETE SET NULL;
+
+-- 原価表の行 → 材料 の逆引き用
+CREATE INDEX IF NOT EXISTS idx_ingredients_cost_master_id ON public.ingredients (cost_master_id);
+
+COMMENT ON COLUMN public.ingredients.cost_master_id IS '原価計算で照合した原価表の行（単価変更時の再計算対象の特定に使用）';
+
+-- レシピ保存関数: 材料と一緒に照合した原価表の行も保存する
+CREATE OR REPLACE FUNCTION public.save_recipe_with_ingredients(
+    p_recipe_id UUID,
+    p_recipe_name TEXT,
+    p_servings INTEGER,
+    p_total_cost DECIMAL(10, 2),
+    p_ingredients JSONB
+)
+RETURNS UUID AS $$
+DECLARE
+    v_recipe_id UUID := p_recipe_id;
+BEGIN
+    IF v_recipe_id IS NULL THEN
+        INSERT INTO public.recipes (recipe_name, servings, total_cost)
+        VALUES (p_recipe_name, p_servings, p_total_cost)
+        RETURNING id INTO v_recipe_id;
+    ELSE
+        UPDATE public.recipes
+        SET recipe_name = p_recipe_name,
+            servings = p_servings,
+            total_cost = p_total_cost,
+            updated_at = now()
+        WHERE id = v_recipe_id;
+
+        IF NOT FOUND THEN
+            INSERT INTO public.recipes (id, recipe_name, servings, total_cost)
+            VALUES (v_recipe_id, p_recipe_name, p_servings, p_total_cost);
+        END IF;
+
+        DELETE FROM public.ingredients WHERE recipe_id = v_recipe_id;
+    END IF;
+
+    -- 照合した行がその後削除された場合は結び付けない
+    INSERT INTO public.ingredients (recipe_id, ingredient_name, quantity, unit, cost, capacity, capacity_unit, cost_master_id)
+    SELECT v_recipe_id, x.ingredient_name, x.quantity, x.unit, x.cost, x.capacity, x.capacity_unit, cm.id
+    FROM jsonb_to_recordset(COALESCE(p_ingredients, '[]'::jsonb)) AS x(
+        ingredient_name TEXT,
+        quantity DECIMAL(10, 2),
+        unit TEXT,
+        cost DECIMAL(10, 2),
+        capacity DECIMAL(10, 2),
+        capacity_unit TEXT,
+        cost_master_id UUID
+    )
+    LEFT JOIN public.cost_master AS cm ON cm.id = x.cost_master_id;
+
+    RETURN v_recipe_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- 材料の原価の一括更新と、対象レシピの合計原価の再集計を1回の呼び出しで行う関数
+-- p_costs: [{"id": 材料ID, "cost": 原価, "cost_master_id": 原価表の行ID}, ...]
+CREATE OR REPLACE FUNCTION public.apply_ingredient_costs(p_costs JSONB)
+RETURNS INTEGER AS $$
+DECLARE
+    v_recipe_ids UUID[];
+    v_updated INTEGER;
+BEGIN
+    WITH updated AS (
+        UPDATE public.ingredients AS i
+        SET cost = x.cost,
+            cost_master_id = x.cost_master_id
+        FROM jsonb_to_recordset(COALESCE(p_costs, '[]'::jsonb)) AS x(
+            id UUID,
+            cost DECIMAL(10, 2),
+            cost_master_id UUID
+        )
+        WHERE i.id = x.id
+        RETURNING i.recipe_id
+    )
+    SELECT array_agg(DISTINCT recipe_id) INTO v_recipe_ids FROM updated;
+
+    -- 材料の更新後の値で合計する（同じ文のCTEからは更新前の値しか見えないため文を分ける）
+    UPDATE public.recipes AS r
+    SET total_cost = COALESCE((SELECT SUM(i.cost) FROM public.ingredients AS i WHERE i.recipe_id = r.id), 0),
+        updated_at = now()
+    WHERE r.id = ANY(COALESCE(v_recipe_ids, '{}'));
+
+    GET DIAGNOSTICS v_updated = ROW_COUNT;
+    RETURN v_updated;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON FUNCTION public.apply_ingredient_costs IS '材料の原価を一括更新し、対象レシピの合計原価を再集計（更新したレシピ数を返す）';
@@ -0,0 +1,8 @@
+-- ON DELETE SET NULLでは取引先の削除時に単価履歴へのUPDATEが発生し、追記のみのトリガーで必ず失敗するため、
+-- 単価履歴から参照されている取引先の削除は外部キーで明示的に禁止する（ON DELETE RESTRICT）
+ALTER TABLE public.cost_price_history
+    DROP CONSTRAINT IF EXISTS cost_price_history_supplier_id_fkey;
+
+ALTER TABLE public.cost_price_history
+    ADD CONSTRAINT cost_price_history_supplier_id_fkey
+    FOREIGN KEY (supplier_id) REFERENCES public.suppliers(id) ON DELETE RESTRICT;
@@ -0,0 +1,79 @@
+-- 材料の原価の編集関数: 更新する原価表の行を1行に絞る
+-- 原価表は (材料名, 取引先, 容量, 単位) で一意のため、材料名・容量・単位だけで UPDATE ... RETURNING すると
+-- 複数の取引先が扱う材料では複数行が返り「query returned more than one row」で失敗していた。
+-- 材料が照合済みの行（ingredients.cost_master_id）を優先し、なければ取引先なしの行を更新する。
+CREATE OR REPLACE FUNCTION public.update_ingredient_cost(
+    p_ingredient_id UUID,
+    p_quantity DECIMAL(10, 2),
+    p_unit TEXT,
+    p_cost DECIMAL(10, 2),
+    p_ingredient_name TEXT,
+    p_search_key TEXT,
+    p_capacity DECIMAL(10, 2),
+    p_capacity_unit TEXT,
+    p_unit_price DECIMAL(10, 2)
+)
+RETURNS JSONB AS $$
+DECLARE
+    v_recipe_id UUID;
+    v_old_cost DECIMAL(10, 2);
+    v_linked_id UUID;
+    v_cost_master_id UUID;
+    v_total_cost DECIMAL(10, 2);
+BEGIN
+    -- 同じ材料の同時編集で合計原価の差分がずれないよう行をロックする
+    SELECT recipe_id, cost, cost_master_id INTO v_recipe_id, v_old_cost, v_linked_id
+    FROM public.ingredients
+    WHERE id = p_ingredient_id
+    FOR UPDATE;
+
+    IF NOT FOUND THEN
+        RETURN NULL;
+    END IF;
+
+    -- 材料名・容量・単位が同じ行のうち、照合済みの行 → 取引先なしの行 の順に1行を選ぶ
+    SELECT id INTO v_cost_master_id
+    FROM public.cost_master
+    WHERE ingredient_name = p_ingredient_name
+      AND capacity = p_capacity
+      AND unit = p_capacity_unit
+      AND (id = v_linked_id OR supplier_id IS NULL)
+    ORDER BY (id IS NOT DISTINCT FROM v_linked_id) DESC, updated_at DESC NULLS LAST, id
+    LIMIT 1
+    FOR UPDATE;
+
+    IF FOUND THEN
+        UPDATE public.cost_master
+        SET search_key = p_search_key,
+            unit_column = p_capacity_unit,
+            unit_price = p_unit_price,
+            updated_at = now()
+        WHERE id = v_cost_master_id;
+    ELSE
+        INSERT INTO public.cost_master (ingredient_name, search_key, capacity, unit, unit_column, unit_price, updated_at)
+        VALUES (p_ingredient_name, p_search_key, p_capacity, p_capacity_unit, p_capacity_unit, p_unit_price, now())
+        RETURNING id INTO v_cost_master_id;
+    END IF;
+
+    UPDATE public.ingredients
+    SET cost = p_cost,
+        quantity = p_quantity,
+        unit = p_unit,
+        cost_master_id = v_cost_master_id
+    WHERE id = p_ingredient_id;
+
+    UPDATE public.recipes
+    SET total_cost = COALESCE(total_cost, 0) - COALESCE(v_old_cost, 0) + COALESCE(p_cost, 0),
+        updated_at = now()
+    WHERE id = v_recipe_id
+    RETURNING total_cost INTO v_total_cost;
+
+    RETURN jsonb_build_object(
+        'recipe_id', v_recipe_id,
+        'cost_master_id', v_cost_master_id,
+        'total_cost', v_total_cost
+    );
+END;
+$$ LANGUAGE plpgsql;
+
+COMMENT ON FUNCTION public.update_ingredient_cost IS '材料の原価の編集（原価表の1行の追加・更新、材料の更新、レシピの合計原価の差分更新）を1トランザクションで行う。材料がない場合はNULL';
@@ -0,0 +1,11 @@
+-- 原価表の材料名の照合順序を "C"（文字コード順）にする
+-- 管理画面・エクスポートのキーセットページネーションは (ingredient_name, id) 順で、
+-- メモリ上の検索インデックス（Pythonの文字列比較＝文字コード順）とDB（ORDER BY / 範囲条件）の
+-- 並び順が一致しないと、一方で発行したカーソルをもう一方で使った時に行が抜けたり重複したりする。
+-- 既定の照合順序（en_US等）では大文字・小文字やひらがな・カタカナを区別せずに並べるため、
+-- 列の照合順序を "C" にして両者を揃える（UTF-8のバイト順は文字コード順と一致する）。
+-- 一意制約とインデックスは型の変更に合わせて再構築される。
+ALTER TABLE public.cost_master
+    ALTER COLUMN ingredient_name TYPE TEXT COLLATE "C";
+
+COMMENT ON COLUMN public.cost_master.ingredient_name IS '材料名（照合順序はCのため、ORDER BYは文字コード順）';
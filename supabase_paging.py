@@ -0,0 +1,77 @@
+"""
+Supabase（PostgREST）の行をページ単位で読み込む共通処理
+
+postgrest-py 0.13系の range(start, end) は end を含まない（Range: start-(end-1) を送る）ため、
+件数は limit/offset で指定する。また Supabase は1回の応答を max-rows（既定1000件）で切り詰めるため、
+ページが短いことでは終端と判断せず、空のページが返るまで読み込む。
+"""
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# 1回の問い合わせで読み込む行数（Supabaseの既定の max-rows 以下にする）
+PAGE_SIZE = 1000
+
+
+def order_by(query, *columns: str, desc: bool = False):
+    """
+    複数列の並び順を1つの order パラメータで指定
+
+    .order() を重ねると order パラメータが複数送られ、PostgRESTは2つ目以降を使わないため。
+    """
+    direction = '.desc' if desc else ''
+    query.params = query.params.add('order', ','.join(f'{column}{direction}' for column in columns))
+    return query
+
+
+def iter_pages(query_factory: Callable, page_size: int = PAGE_SIZE) -> Iterator[List[Dict]]:
+    """
+    クエリの結果をページ単位で返す（空のページで終了）
+
+    Args:
+        query_factory: 並び順を指定したクエリを呼び出しごとに新しく作る関数
+                       （ビルダーは limit/offset を追加すると元に戻せないため）
+    """
+    offset = 0
+    while True:
+        rows = query_factory().limit(page_size).offset(offset).execute().data or []
+        if not rows:
+            return
+        yield rows
+        offset += len(rows)
+
+
+def fetch_all(query_factory: Callable, page_size: int = PAGE_SIZE) -> List[Dict]:
+    """クエリの結果を全件読み込む（query_factoryはiter_pagesと同じ）"""
+    rows = []
+    for page in iter_pages(query_factory, page_size):
+        rows.extend(page)
+    return rows
+
+
+def fetch_keyset_page(query_factory: Callable, sort_key: Callable[[Dict], Tuple],
+                      after: Optional[Sequence], limit: int, desc: bool = False) -> List[Dict]:
+    """
+    キーセットページネーションの1ページ（次ページの有無の判定用に limit+1件まで）を取得
+
+    PostgRESTクライアントにor条件がないため、query_factoryはカーソルの先頭列だけで範囲を絞り
+    （昇順はgte、降順はlte）、先頭列がカーソルと等しい行のうちカーソル以前のものはここで読み飛ばす。
+    先頭列の大小はDBの照合順序で判定済みのため、ここでは比較しない（Pythonの文字コード順とは
+    一致しないことがあり、比較するとカーソルより後ろの行を落としてしまう）。
+
+    Args:
+        query_factory: sort_keyの列の順に並べたクエリを作る関数
+        sort_key: 行から並び順のキー（カーソルと同じ形のタプル）を返す関数
+        after: 前ページ末尾のキー（Noneの場合は先頭から）
+        desc: 降順の場合はTrue
+    """
+    after = tuple(after) if after else None
+    page = []
+    for rows in iter_pages(query_factory, page_size=min(limit + 1, PAGE_SIZE)):
+        for row in rows:
+            if after is not None:
+                key = sort_key(row)
+                if key[0] == after[0] and ((key[1:] >= after[1:]) if desc else (key[1:] <= after[1:])):
+                    continue
+            page.append(row)
+            if len(page) > limit:
+                return page
+    return page
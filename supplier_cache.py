@@ -0,0 +1,132 @@
+"""
+取引先名 → 取引先IDのインプロセスキャッシュ
+
+最初に使う時に取引先テーブルを1回だけ読み込み、以降はアップロードやフォームで
+まだ見ていない取引先名だけを1回のupsertで登録してIDを取得する。
+取引先は削除されない前提（/admin/clearでも残す）のため、期限は設けない。
+"""
+import threading
+from typing import Dict, Iterable, Optional
+from supabase import Client
+from supabase_paging import PAGE_SIZE, iter_pages
+
+SUPPLIERS_TABLE = 'suppliers'
+
+# 初回の読み込みで1回に取得する行数
+SUPPLIER_PAGE_SIZE = PAGE_SIZE
+
+# 1回のupsertで送る取引先名の数
+SUPPLIER_UPSERT_CHUNK_SIZE = 500
+
+
+class SupplierCache:
+    """
+    取引先名とIDの対応を保持する（複数スレッドから使える）
+
+    書き込み（upsert）の結果で対応を更新するため、同じプロセスの書き込みは
+    すぐに反映される。別プロセスで登録された取引先は、未登録の名前として
+    upsertした時に既存のIDが返るため、重複して登録されることはない。
+    """
+
+    def __init__(self, supabase: Client):
+        self.supabase = supabase
+        self._ids: Dict[str, str] = {}
+        self._names: Dict[str, str] = {}
+        self._warm = False
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def _remember_rows(self, rows: Iterable[Dict]):
+        for row in rows:
+            if row.get('id') and row.get('name'):
+                self._ids[row['name']] = row['id']
+                self._names[row['id']] = row['name']
+
+    def _warm_locked(self):
+        if self._warm:
+            return
+        pages = iter_pages(lambda: self.supabase.table(SUPPLIERS_TABLE).select('id, name').order('name'),
+                           SUPPLIER_PAGE_SIZE)
+        for rows in pages:
+            self._remember_rows(rows)
+        self._warm = True
+        print(f"🏪 取引先キャッシュを読み込みました: {len(self._ids)}件")
+
+    def warm(self) -> bool:
+        """取引先テーブルを読み込む（読み込み済みの場合は何もしない）"""
+        try:
+            with self._lock:
+                self._warm_locked()
+            return True
+        except Exception as e:
+            print(f"取引先キャッシュの読み込みエラー: {e}")
+            return False
+
+    def resolve(self, names: Iterable[str]) -> Dict[str, str]:
+        """
+        取引先名ごとのIDを返す（未登録の取引先は登録する）
+
+        キャッシュにない名前だけをまとめてupsertし、返された行でキャッシュを更新する。
+        Raises:
+            Exception: 取引先の登録に失敗した場合（呼び出し元のエラー処理に任せる）
+        """
+        wanted = {name.strip() for name in names if name and name.strip()}
+        if not wanted:
+            return {}
+        with self._lock:
+            try:
+                self._warm_locked()
+            except Exception as e:
+                # 読み込めない場合も、未登録扱いのupsertで既存のIDを取得できる
+                print(f"取引先キャッシュの読み込みエラー: {e}")
+            unseen = sorted(wanted - self._ids.keys())
+            for start in range(0, len(unseen), SUPPLIER_UPSERT_CHUNK_SIZE):
+                chunk = unseen[start:start + SUPPLIER_UPSERT_CHUNK_SIZE]
+                response = self.supabase.table(SUPPLIERS_TABLE).upsert(
+                    [{'name': name} for name in chunk], on_conflict='name'
+                ).execute()
+                self._remember_rows(response.data or [])
+            if unseen:
+                print(f"🏪 取引先を登録しました: {len(unseen)}件")
+            return {name: self._ids[name] for name in wanted if name in self._ids}
+
+    def get_id(self, name: str) -> Optional[str]:
+        """取引先名のID（未登録の場合は登録する）"""
+        return self.resolve([name]).get((name or '').strip())
+
+    def names_by_id(self) -> Dict[str, str]:
+        """取引先ID → 取引先名のマップ（検索インデックスの構築用）"""
+        self.warm()
+        with self._lock:
+            return dict(self._names)
+
+    def get_name(self, supplier_id: str) -> Optional[str]:
+        """
+        取引先IDの名前（見つからない場合はNone）
+
+        キャッシュにない場合は、読み込み後に別プロセス（他のワーカーや migrate_suppliers.py）で
+        登録された取引先の可能性があるため、DBから取得してキャッシュに追加する。
+        """
+        if not supplier_id:
+            return None
+        self.warm()
+        name = self._names.get(supplier_id)
+        if name is not None:
+            return name
+        try:
+            response = self.supabase.table(SUPPLIERS_TABLE).select('id, name').eq('id', supplier_id).execute()
+        except Exception as e:
+            print(f"取引先の取得エラー: {e}")
+            return None
+        with self._lock:
+            self._remember_rows(response.data or [])
+            return self._names.get(supplier_id)
+
+    def invalidate(self):
+        """キャッシュを破棄（次に使う時に読み込み直す）"""
+        with self._lock:
+            self._ids.clear()
+            self._names.clear()
+            self._warm = False
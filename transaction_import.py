@@ -0,0 +1,217 @@
+"""
+取引データCSVからの材料抽出
+
+1ファイルごとに (商品名, 取引先名) 単位で単価を集約し（既定は最安値、price_reducers参照）、
+複数ファイル（月ごとの仕入台帳など）はプロセスプールで並列に集約してから統合する。
+"""
+import csv
+import io
+import multiprocessing
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from supabase import Client
+from encoding_detector import open_text_stream
+from price_history import price_history_row, record_price_history
+from price_reducers import PriceAggregator, PriceLine, PriceReducer, MinPriceReducer, normalize_transaction_date
+from search_index import normalize_search_key
+from spec_parser import extract_capacity_from_spec
+from supplier_cache import SupplierCache
+from upload_pipeline import UploadReport, upsert_changed_in_chunks
+
+# 複数ファイルを並列に処理するプロセス数（0または未設定の場合はCPU数）
+TRANSACTION_IMPORT_WORKERS = int(os.getenv('TRANSACTION_IMPORT_WORKERS', 0)) or os.cpu_count() or 1
+
+# 一括アップロードで受け付ける最大ファイル数
+MAX_BULK_FILES = 100
+
+
+def extract_transaction_materials(stream, filename: str = '', progress: Optional[Callable] = None,
+                                  reducer: Optional[PriceReducer] = None, source: int = 0) -> Dict:
+    """
+    取引データCSVの明細行（D行）を (商品名, 取引先名) ごとに集約
+
+    Args:
+        progress: progress(rows_parsed=, rows_failed=) の形で進捗を受け取る関数
+        reducer: 単価の集約方法（未指定の場合は最安値）
+        source: 複数ファイルを統合する場合のファイル番号（同じ日付の明細の前後関係に使う）
+
+    Returns:
+        aggregate（PriceAggregator）、行数、文字コードなどの辞書（プロセス間で受け渡せる値のみ）
+    """
+    # 文字コードを先頭部分から判定し、1回だけストリーミングでデコード
+    csv_text, encoding_guess = open_text_stream(stream)
+    print(f"🔍 CSV encoding: {filename} {encoding_guess.encoding} "
+          f"(confidence={encoding_guess.confidence}, {encoding_guess.reason})")
+
+    aggregate = PriceAggregator(reducer or MinPriceReducer())
+    processed_count = 0
+    failed_count = 0
+    row_number = 0
+
+    for row_number, row in enumerate(csv.reader(csv_text), 1):
+        if progress:
+            progress(rows_parsed=row_number, rows_failed=failed_count)
+        try:
+            if not row or row[0] != 'D': continue
+
+            price_str = row[18].strip()
+            product = row[14].strip()
+            if not product or not price_str: continue
+
+            price = float(price_str.replace(',', ''))
+            if price <= 0: continue
+
+            supplier = row[8].strip()
+            spec = row[15].strip()  # 規格（16列目）
+            unit_column = row[20].strip() if len(row) > 20 else ""  # 単位列（21番目、インデックス20）
+            capacity, unit, unit_column_data = extract_capacity_from_spec(spec, product, unit_column)
+            try:
+                quantity = float(row[19].replace(',', '')) if len(row) > 19 and row[19].strip() else 0.0
+            except ValueError:
+                quantity = 0.0
+            line = PriceLine(price, quantity, normalize_transaction_date(row[1]), (source, row_number))
+
+            # (商品名, 取引先名) のタプルをキーに集約
+            aggregate.add((product, supplier), line, {
+                'product': product,
+                'supplier': supplier,
+                'capacity': capacity,
+                'unit': unit,
+                'unit_column': unit_column_data,
+                'spec': spec  # 規格も保存
+            })
+            processed_count += 1
+        except (IndexError, ValueError) as e:
+            print(f"行処理エラー（スキップ）: {e}")
+            failed_count += 1
+            continue
+
+    return {
+        'filename': filename,
+        'aggregate': aggregate,
+        'rows': row_number,
+        'processed': processed_count,
+        'failed': failed_count,
+        'encoding': encoding_guess.encoding,
+        'encoding_confidence': encoding_guess.confidence
+    }
+
+
+def _extract_transaction_bytes(filename: str, data: bytes, reducer: Optional[PriceReducer] = None,
+                               source: int = 0) -> Dict:
+    """プロセスプールのワーカーで1ファイルを集約（引数と戻り値はpickleされる）"""
+    return extract_transaction_materials(io.BytesIO(data), filename, reducer=reducer, source=source)
+
+
+def merge_transaction_materials(extracts: List[Dict], reducer: Optional[PriceReducer] = None) -> PriceAggregator:
+    """
+    ファイルごとの集約結果を順に統合
+
+    明細にはファイル番号を付けているため、1つのファイルにまとめて処理した場合と同じ結果になる。
+    """
+    merged = PriceAggregator(reducer or MinPriceReducer())
+    for extract in extracts:
+        merged.merge(extract['aggregate'])
+    return merged
+
+
+def iter_transaction_archive(stream) -> Iterator[Tuple[str, bytes]]:
+    """zipに含まれるCSVファイルを (ファイル名, 内容) として名前順に返す"""
+    with zipfile.ZipFile(stream) as archive:
+        names = sorted(
+            info.filename for info in archive.infolist()
+            if not info.is_dir()
+            and info.filename.lower().endswith('.csv')
+            and not os.path.basename(info.filename).startswith('.')
+            and '__MACOSX/' not in info.filename
+        )
+        if len(names) > MAX_BULK_FILES:
+            raise ValueError(f"ファイル数が多すぎます（最大{MAX_BULK_FILES}件）: {len(names)}件")
+        for name in names:
+            yield name, archive.read(name)
+
+
+def extract_transaction_files(files: Iterable[Tuple[str, bytes]], workers: int = TRANSACTION_IMPORT_WORKERS,
+                              on_file: Optional[Callable[[Dict], None]] = None,
+                              reducer: Optional[PriceReducer] = None) -> List[Dict]:
+    """
+    複数の取引データCSVをプロセスプールで並列に集約（結果は入力と同じ順）
+
+    規格の解析と単価の集約はCPU処理のため、スレッドではなくプロセスで並列化する。
+    ファイルが1件の場合やworkersが1の場合はこのプロセスで処理する。
+    """
+    files = list(files)
+    if workers <= 1 or len(files) <= 1:
+        results = []
+        for source, (filename, data) in enumerate(files):
+            results.append(_extract_transaction_bytes(filename, data, reducer, source))
+            if on_file:
+                on_file(results[-1])
+        return results
+
+    # Webワーカーはスレッド（会話状態の掃除・ジョブ実行・原価の再計算など）を動かしているため、
+    # 他のスレッドがロックを持ったままforkしてデッドロックしないようspawnでプロセスを作る
+    with ProcessPoolExecutor(max_workers=min(workers, len(files)),
+                             mp_context=multiprocessing.get_context('spawn')) as executor:
+        futures = [executor.submit(_extract_transaction_bytes, filename, data, reducer, source)
+                   for source, (filename, data) in enumerate(files)]
+        del files
+        results = []
+        for future in futures:
+            results.append(future.result())
+            if on_file:
+                on_file(results[-1])
+        return results
+
+
+def save_transaction_materials(supabase: Client, materials: Dict[Tuple[str, str], Dict],
+                               on_chunk: Optional[Callable[[UploadReport], None]] = None,
+                               observations: Optional[Iterable[Dict]] = None,
+                               suppliers: Optional[SupplierCache] = None) -> UploadReport:
+    """
+    取引先を登録し、集約した材料をcost_masterに保存（新規と変更のあった行のみ）
+
+    取引先IDはsuppliers（プロセス共通のキャッシュ）から引き、未登録の取引先だけを登録する。
+
+    単価履歴には、cost_masterの変更の有無にかかわらず観測した単価を伝票日付で記録する。
+    observationsを渡した場合（一括アップロードのファイルごとの集約結果など）はそれを記録する。
+    """
+    # 取引先名とIDのマップを作成（未登録の取引先のみDBに登録）
+    if suppliers is None:
+        suppliers = SupplierCache(supabase)
+    supplier_name_to_id = suppliers.resolve(item['supplier'] for item in materials.values())
+
+    # cost_masterに登録するためのデータを作成
+    updated_at = datetime.now().isoformat()
+    items_to_upsert = []
+    for item in materials.values():
+        items_to_upsert.append((None, {
+            'ingredient_name': item['product'],
+            'search_key': normalize_search_key(item['product']),
+            'supplier_id': supplier_name_to_id.get(item['supplier']),
+            'capacity': item['capacity'],
+            'unit': item['unit'],
+            'unit_column': item['unit_column'],
+            'spec': item.get('spec', ''),  # 規格を追加
+            'unit_price': item['price'],
+            'updated_at': updated_at
+        }))
+
+    # 既存行と比較し、新規と変更のあった行だけをチャンク単位で保存
+    report = UploadReport()
+    upsert_changed_in_chunks(supabase, items_to_upsert, report=report, on_chunk=on_chunk)
+    print(f"📊 Summary: extracted={len(materials)}, inserted={report.inserted}, "
+          f"updated={report.updated}, unchanged={report.unchanged}")
+
+    # 単価履歴に観測を記録（同じ日・同じ単価は重複しない）
+    history_rows = (
+        price_history_row(item['product'], supplier_name_to_id.get(item['supplier']), item['capacity'],
+                          item['unit'], item['price'], item.get('price_date'), 'transaction_upload')
+        for item in (materials.values() if observations is None else observations)
+    )
+    recorded = record_price_history(supabase, history_rows)
+    print(f"🕒 単価履歴に{recorded}件を記録")
+    return report
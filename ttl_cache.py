@@ -0,0 +1,53 @@
+"""
+短いTTLのインプロセスキャッシュ（同時アクセス時の計算は1回にまとめる）
+"""
+import threading
+import time
+from typing import Any, Callable, Dict, Tuple
+
+
+class TTLCache:
+    """
+    キーごとに値をTTL秒だけ保持するキャッシュ
+
+    期限切れ時は最初のスレッドだけが値を計算し、同じキーを要求した
+    他のスレッドはその計算の完了を待って結果を共有する（スタンピード防止）。
+    計算中に例外が発生した場合はキャッシュせずに呼び出し元へ送出する。
+    """
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._values: Dict[Any, Tuple[float, Any]] = {}
+        self._key_locks: Dict[Any, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _fresh(self, key) -> Tuple[bool, Any]:
+        entry = self._values.get(key)
+        if entry and entry[0] > time.monotonic():
+            return True, entry[1]
+        return False, None
+
+    def get_or_compute(self, key, compute: Callable[[], Any]):
+        """キャッシュ済みの値を返し、期限切れならcomputeで計算して保存する"""
+        hit, value = self._fresh(key)
+        if hit:
+            return value
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            # 待っている間に別スレッドが計算済みならそれを使う
+            hit, value = self._fresh(key)
+            if hit:
+                return value
+            value = compute()
+            self._values[key] = (time.monotonic() + self.ttl_seconds, value)
+            return value
+
+    def invalidate(self, key=None):
+        """指定したキー（省略時は全件）を破棄"""
+        with self._lock:
+            if key is None:
+                self._values.clear()
+            else:
+                self._values.pop(key, None)
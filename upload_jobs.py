@@ -0,0 +1,339 @@
+"""
+アップロード処理のバックグラウンドジョブ（SQLiteのジョブストアとワーカースレッド）
+"""
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+import traceback
+import uuid
+from datetime import datetime, timezone
+from typing import Callable, Dict, Optional
+
+# ジョブストアとアップロードファイルの保存先
+UPLOAD_JOB_DIR = os.getenv('UPLOAD_JOB_DIR', os.path.join(tempfile.gettempdir(), 'recipe_upload_jobs'))
+
+# 進捗をDBに書き込む最小間隔（秒）
+PROGRESS_WRITE_INTERVAL = 0.5
+
+# 実行中のまま更新が止まったジョブを再実行するまでの時間（秒）
+STALE_JOB_SECONDS = 10 * 60
+
+# 実行中のジョブの生存通知（heartbeat_at）を書き込む間隔（秒）
+HEARTBEAT_INTERVAL = 30
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS upload_jobs (
+    id TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    file_path TEXT NOT NULL,
+    status TEXT NOT NULL,
+    total_bytes INTEGER NOT NULL DEFAULT 0,
+    bytes_read INTEGER NOT NULL DEFAULT 0,
+    rows_parsed INTEGER NOT NULL DEFAULT 0,
+    rows_upserted INTEGER NOT NULL DEFAULT 0,
+    rows_failed INTEGER NOT NULL DEFAULT 0,
+    options TEXT,
+    result TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    heartbeat_at REAL,
+    claim_token TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_upload_jobs_status ON upload_jobs(status, created_at);
+"""
+
+
+def _iso(timestamp: Optional[float]) -> Optional[str]:
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
+
+
+class UploadJobStore:
+    """
+    ジョブの状態を保存するSQLiteストア
+
+    gunicornの複数ワーカープロセスから同じファイルを参照するため、
+    接続は操作ごとに開き、ジョブの取得は条件付きUPDATEで排他する。
+    """
+
+    def __init__(self, directory: str = UPLOAD_JOB_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.db_path = os.path.join(directory, 'jobs.sqlite3')
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(_SCHEMA)
+            # options列がない古いジョブストアに列を追加
+            columns = {row['name'] for row in conn.execute('PRAGMA table_info(upload_jobs)')}
+            if 'options' not in columns:
+                conn.execute('ALTER TABLE upload_jobs ADD COLUMN options TEXT')
+            if 'claim_token' not in columns:
+                conn.execute('ALTER TABLE upload_jobs ADD COLUMN claim_token TEXT')
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def create(self, kind: str, filename: str, stream, options: Optional[Dict] = None) -> str:
+        """アップロードファイルを保存してジョブを登録し、ジョブIDを返す（optionsは処理関数に渡す設定）"""
+        job_id = uuid.uuid4().hex
+        file_path = os.path.join(self.directory, f'{job_id}.upload')
+        with open(file_path, 'wb') as f:
+            while True:
+                block = stream.read(1024 * 1024)
+                if not block:
+                    break
+                f.write(block)
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT INTO upload_jobs (id, kind, filename, file_path, status, total_bytes, options, created_at) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (job_id, kind, filename, file_path, 'queued', os.path.getsize(file_path),
+                 json.dumps(options, ensure_ascii=False) if options else None, time.time())
+            )
+        return job_id
+
+    def claim_next(self) -> Optional[sqlite3.Row]:
+        """
+        待機中のジョブを1件取得して実行中にする（他のワーカーと重複しない）
+
+        取得したジョブにはclaim_tokenを割り当てる。以降の進捗・生存通知・完了の書き込みは
+        このトークンが一致する場合のみ行われる。
+        """
+        now = time.time()
+        with self._connect() as conn:
+            # 実行中のまま止まったジョブ（プロセス停止など）は待機中に戻し、元の実行者の所有を外す
+            conn.execute(
+                "UPDATE upload_jobs SET status = 'queued', claim_token = NULL "
+                "WHERE status = 'running' AND heartbeat_at < ?",
+                (now - STALE_JOB_SECONDS,)
+            )
+            rows = conn.execute(
+                "SELECT id FROM upload_jobs WHERE status = 'queued' ORDER BY created_at LIMIT 5"
+            ).fetchall()
+            for row in rows:
+                claimed = conn.execute(
+                    "UPDATE upload_jobs SET status = 'running', started_at = ?, heartbeat_at = ?, claim_token = ? "
+                    "WHERE id = ? AND status = 'queued'",
+                    (now, now, uuid.uuid4().hex, row['id'])
+                ).rowcount
+                if claimed:
+                    return conn.execute('SELECT * FROM upload_jobs WHERE id = ?', (row['id'],)).fetchone()
+        return None
+
+    def update_progress(self, job_id: str, claim_token: str, **counters):
+        """進捗（bytes_read, rows_parsed, rows_upserted, rows_failed）を更新"""
+        columns = [column for column in ('bytes_read', 'rows_parsed', 'rows_upserted', 'rows_failed')
+                   if column in counters]
+        if not columns:
+            return
+        assignments = ', '.join(f'{column} = ?' for column in columns)
+        with self._connect() as conn:
+            conn.execute(
+                f"UPDATE upload_jobs SET {assignments}, heartbeat_at = ? "
+                f"WHERE id = ? AND claim_token = ? AND status = 'running'",
+                [counters[column] for column in columns] + [time.time(), job_id, claim_token]
+            )
+
+    def heartbeat(self, job_id: str, claim_token: str) -> bool:
+        """
+        実行中のジョブの生存を通知
+
+        Returns:
+            まだこの実行者のジョブであればTrue（再実行のため待機中に戻された場合はFalse）
+        """
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE upload_jobs SET heartbeat_at = ? WHERE id = ? AND claim_token = ? AND status = 'running'",
+                (time.time(), job_id, claim_token)
+            ).rowcount > 0
+
+    def finish(self, job_id: str, claim_token: str, result: Optional[Dict] = None,
+               error: Optional[str] = None) -> bool:
+        """
+        ジョブを完了（errorがあれば失敗）にする
+
+        Returns:
+            完了にした場合はTrue（所有が外れていて他の実行者に任せる場合はFalse）
+        """
+        with self._connect() as conn:
+            return conn.execute(
+                "UPDATE upload_jobs SET status = ?, result = ?, error = ?, finished_at = ?, heartbeat_at = ? "
+                "WHERE id = ? AND claim_token = ? AND status = 'running'",
+                ('failed' if error else 'succeeded',
+                 json.dumps(result, ensure_ascii=False, default=str) if result is not None else None,
+                 error, time.time(), time.time(), job_id, claim_token)
+            ).rowcount > 0
+
+    def get(self, job_id: str) -> Optional[Dict]:
+        """ジョブの状態を返す（スループットは経過時間から計算）"""
+        with self._connect() as conn:
+            row = conn.execute('SELECT * FROM upload_jobs WHERE id = ?', (job_id,)).fetchone()
+        if not row:
+            return None
+
+        started_at = row['started_at']
+        end = row['finished_at'] or time.time()
+        elapsed = max(0.0, end - started_at) if started_at else 0.0
+        return {
+            'id': row['id'],
+            'kind': row['kind'],
+            'filename': row['filename'],
+            'status': row['status'],
+            'options': json.loads(row['options']) if row['options'] else {},
+            'rows_parsed': row['rows_parsed'],
+            'rows_upserted': row['rows_upserted'],
+            'rows_failed': row['rows_failed'],
+            'bytes_read': row['bytes_read'],
+            'total_bytes': row['total_bytes'],
+            'progress': round(row['bytes_read'] / row['total_bytes'], 3) if row['total_bytes'] else None,
+            'elapsed_seconds': round(elapsed, 2),
+            'rows_per_second': round(row['rows_parsed'] / elapsed, 1) if elapsed > 0 else None,
+            'created_at': _iso(row['created_at']),
+            'started_at': _iso(started_at),
+            'finished_at': _iso(row['finished_at']),
+            'result': json.loads(row['result']) if row['result'] else None,
+            'error': row['error']
+        }
+
+
+class JobProgress:
+    """ハンドラーから呼ばれる進捗の通知先（DBへの書き込みは間引く）"""
+
+    def __init__(self, store: UploadJobStore, job_id: str, claim_token: str, file):
+        self.store = store
+        self.job_id = job_id
+        self.claim_token = claim_token
+        self.file = file
+        self._last_write = 0.0
+
+    def __call__(self, rows_parsed: int = 0, rows_upserted: int = 0, rows_failed: int = 0, force: bool = False):
+        now = time.monotonic()
+        if not force and now - self._last_write < PROGRESS_WRITE_INTERVAL:
+            return
+        self._last_write = now
+        try:
+            bytes_read = self.file.tell()
+        except (OSError, ValueError):
+            bytes_read = 0
+        self.store.update_progress(self.job_id, self.claim_token, bytes_read=bytes_read, rows_parsed=rows_parsed,
+                                   rows_upserted=rows_upserted, rows_failed=rows_failed)
+
+
+class UploadJobRunner:
+    """
+    待機中のジョブをワーカースレッドで処理する
+
+    handlersには種類ごとの処理関数 handler(file, filename, progress, **options) -> 結果の辞書 を渡す。
+    on_finishedはジョブの終了後に on_finished(kind, result) の形で呼ばれる（失敗時のresultはNone）。
+    """
+
+    def __init__(self, store: UploadJobStore, handlers: Dict[str, Callable],
+                 workers: Optional[int] = None, poll_interval: float = 2.0,
+                 on_finished: Optional[Callable[[str, Optional[Dict]], None]] = None):
+        self.store = store
+        self.handlers = handlers
+        self.workers = workers or int(os.getenv('UPLOAD_JOB_WORKERS', 1))
+        self.poll_interval = poll_interval
+        self.on_finished = on_finished
+        self._wakeup = threading.Event()
+        self._stop_event = threading.Event()
+        self._threads = []
+
+    def submit(self, kind: str, filename: str, stream, options: Optional[Dict] = None) -> str:
+        """ジョブを登録してワーカーを起こす"""
+        if kind not in self.handlers:
+            raise ValueError(f"不明なジョブの種類です: {kind}")
+        job_id = self.store.create(kind, filename, stream, options)
+        self.start()
+        self._wakeup.set()
+        return job_id
+
+    def start(self):
+        """ワーカースレッドを開始（二重起動はしない）"""
+        self._threads = [thread for thread in self._threads if thread.is_alive()]
+        if self._threads:
+            return
+        self._stop_event.clear()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'upload-job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self):
+        self._stop_event.set()
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stop_event.is_set():
+            job = None
+            try:
+                job = self.store.claim_next()
+            except sqlite3.Error as e:
+                print(f"ジョブの取得エラー: {e}")
+            if job is None:
+                self._wakeup.wait(self.poll_interval)
+                self._wakeup.clear()
+                continue
+            self._process(job)
+
+    def _heartbeat(self, job_id: str, claim_token: str, stop_event: threading.Event):
+        """進捗の書き込みがない長い処理中も、実行中のジョブが停止扱いで再実行されないよう生存を通知する"""
+        while not stop_event.wait(HEARTBEAT_INTERVAL):
+            try:
+                if not self.store.heartbeat(job_id, claim_token):
+                    print(f"⚠️ アップロードジョブの所有が外れました（再実行待ち）: {job_id}")
+                    return
+            except sqlite3.Error as e:
+                print(f"ジョブの生存通知エラー: {e}")
+
+    def _process(self, job: sqlite3.Row):
+        job_id = job['id']
+        claim_token = job['claim_token']
+        result = None
+        owned = False
+        stop_heartbeat = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, claim_token, stop_heartbeat),
+                                     name=f'upload-job-heartbeat-{job_id[:8]}', daemon=True)
+        heartbeat.start()
+        print(f"📦 アップロードジョブ開始: {job_id} ({job['kind']}, {job['filename']})")
+        try:
+            with open(job['file_path'], 'rb') as f:
+                progress = JobProgress(self.store, job_id, claim_token, f)
+                options = json.loads(job['options']) if job['options'] else {}
+                result = self.handlers[job['kind']](f, job['filename'], progress, **options)
+            owned = self.store.finish(job_id, claim_token, result=result)
+            if owned:
+                print(f"✅ アップロードジョブ完了: {job_id}")
+        except Exception as e:
+            traceback.print_exc()
+            result = None
+            try:
+                owned = self.store.finish(job_id, claim_token, error=str(e))
+            except sqlite3.Error as store_error:
+                print(f"ジョブの完了書き込みエラー: {store_error}")
+            print(f"❌ アップロードジョブ失敗: {job_id}: {e}")
+        finally:
+            stop_heartbeat.set()
+            # 再実行のため他の実行者に渡ったジョブのファイルは削除しない
+            if owned:
+                try:
+                    os.remove(job['file_path'])
+                except OSError:
+                    pass
+        if not owned:
+            print(f"⚠️ アップロードジョブは再実行待ちのため結果を破棄しました: {job_id}")
+            return
+        if self.on_finished:
+            try:
+                self.on_finished(job['kind'], result)
+            except Exception as e:
+                print(f"ジョブ完了後の処理エラー: {e}")
@@ -0,0 +1,456 @@
+"""
+原価表アップロードのストリーミング処理
+（デコード → パース → 検証 → 重複除去 → チャンク単位のupsert）
+"""
+import csv
+import hashlib
+import json
+import os
+from datetime import datetime
+from decimal import Decimal
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from supabase import Client
+from search_index import normalize_search_key
+from encoding_detector import open_text_stream
+
+# 1回のupsertで送る行数
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', 500))
+
+# エラーレポートに詳細を残す最大行数（件数はすべて数える）
+MAX_REPORTED_ERRORS = 200
+
+# cost_masterのユニーク制約（cost_master_unique_product_key）と同じ列
+COST_MASTER_CONFLICT_COLUMNS = ('ingredient_name', 'supplier_id', 'capacity', 'unit')
+
+# 変更の有無の判定に使わない列（キーと書き込み時に決まる列）
+DIFF_IGNORED_COLUMNS = set(COST_MASTER_CONFLICT_COLUMNS) | {'id', 'updated_at'}
+
+# 既存行の取得で1回のin句に含める材料名の数（URLの長さ制限のため）
+DIFF_LOOKUP_BATCH_SIZE = 50
+
+
+class UploadReport:
+    """アップロード結果の集計と行単位のエラーレポート"""
+
+    def __init__(self, max_errors: int = MAX_REPORTED_ERRORS):
+        self.max_errors = max_errors
+        self.processed = 0
+        self.skipped = 0
+        self.saved = 0
+        self.inserted = 0
+        self.updated = 0
+        self.unchanged = 0
+        self.chunks = 0
+        self.failed_chunks = 0
+        self.error_count = 0
+        self.errors: List[Dict] = []
+
+    def add_error(self, row_number: Optional[int], message: str, values: Optional[Dict] = None):
+        """行エラーを記録（詳細はmax_errors件まで）"""
+        self.error_count += 1
+        if len(self.errors) < self.max_errors:
+            error = {'row': row_number, 'error': message}
+            if values:
+                error['values'] = values
+            self.errors.append(error)
+
+    def to_dict(self) -> Dict:
+        return {
+            'processed': self.processed,
+            'skipped': self.skipped,
+            'saved': self.saved,
+            'inserted': self.inserted,
+            'updated': self.updated,
+            'unchanged': self.unchanged,
+            'chunks': self.chunks,
+            'failed_chunks': self.failed_chunks,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'errors_truncated': self.error_count > len(self.errors)
+        }
+
+
+def is_blank_row(row: Dict) -> bool:
+    """すべてのセルが空の行か（Excelの読み取り専用モードでは書式だけの空行も返される）"""
+    return all(cell_text(value) == '' for value in row.values())
+
+
+def cell_text(value) -> str:
+    """CSV/Excelのセル値を前後の空白を除いた文字列に変換（Excelの整数値は小数点なし）"""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value).strip()
+
+
+def open_csv_rows(stream) -> Tuple[List[str], Iterator[Dict]]:
+    """
+    CSVを1行ずつ辞書として読み込む（文字コードは先頭部分から判定し、1回だけデコードする）
+
+    Returns:
+        (列名のリスト, 行の辞書を返すイテレータ)
+    """
+    text, guess = open_text_stream(stream)
+    print(f"🔍 CSV encoding: {guess.encoding} (confidence={guess.confidence}, {guess.reason})")
+    reader = csv.DictReader(text)
+    fieldnames = reader.fieldnames or []
+    return fieldnames, iter(reader)
+
+
+def open_xlsx_rows(stream) -> Tuple[List[str], Iterator[Dict]]:
+    """
+    Excel（.xlsx）を1行ずつ辞書として読み込む
+
+    読み取り専用モードでシートのXMLを順に読むため、ファイル全体のオブジェクトモデルを作らず、
+    メモリ使用量はファイルサイズによらずほぼ一定になる。数式のセルは保存済みの値を使う。
+    """
+    from openpyxl import load_workbook
+    workbook = load_workbook(stream, read_only=True, data_only=True)
+    worksheet = workbook.active
+    row_iter = worksheet.iter_rows(values_only=True)
+
+    # ヘッダー行を取得
+    headers = list(next(row_iter, None) or [])
+
+    def rows():
+        # データ行を取得
+        try:
+            for values in row_iter:
+                yield dict(zip(headers, values))
+        finally:
+            # 読み取り専用モードはファイルを開いたままにするため明示的に閉じる
+            workbook.close()
+    return headers, rows()
+
+
+def open_xls_rows(stream) -> Tuple[List[str], Iterator[Dict]]:
+    """
+    Excel（.xls）を1行ずつ辞書として読み込む
+
+    シートはon_demandで必要になった時点で読み込み、ファイルがディスク上にある場合は
+    xlrdにパスを渡してメモリマップで読ませる（ファイル全体をbytesとして複製しない）。
+    """
+    import xlrd
+    path = getattr(stream, 'name', None)
+    if isinstance(path, str) and os.path.isfile(path):
+        workbook = xlrd.open_workbook(path, on_demand=True)
+    else:
+        workbook = xlrd.open_workbook(file_contents=stream.read(), on_demand=True)
+    worksheet = workbook.sheet_by_index(0)
+
+    # ヘッダー行を取得
+    headers = worksheet.row_values(0) if worksheet.nrows else []
+
+    def rows():
+        # データ行を取得
+        try:
+            for row in range(1, worksheet.nrows):
+                yield dict(zip(headers, worksheet.row_values(row)))
+        finally:
+            workbook.release_resources()
+    return headers, rows()
+
+
+def open_tabular_file(stream, filename: str) -> Tuple[List[str], Iterator[Dict]]:
+    """ファイル形式に応じて (列名, 行イテレータ) を返す"""
+    filename = filename.lower()
+    if filename.endswith('.csv'):
+        return open_csv_rows(stream)
+    if filename.endswith('.xlsx'):
+        return open_xlsx_rows(stream)
+    if filename.endswith('.xls'):
+        return open_xls_rows(stream)
+    raise ValueError(f"Unsupported file format: {filename}")
+
+
+def detect_cost_master_columns(fieldnames: List[str]) -> Dict[str, str]:
+    """列名から原価表の各項目に対応する列を決める（テンプレート形式を優先）"""
+    fieldnames = [field for field in fieldnames if field]
+    column_mapping = {}
+
+    # まずテンプレート形式をチェック
+    for column in ('ingredient_name', 'capacity', 'unit', 'unit_price'):
+        if column in fieldnames:
+            column_mapping[column] = column
+
+    # 新しい基本形式をチェック（cost_file.csv形式）
+    basic_columns = {
+        '商品名': 'ingredient_name',
+        '容量': 'capacity',
+        '単位': 'unit',
+        '単価': 'unit_price',
+        '取引先名': 'supplier',
+        '伝票日付': 'date'
+    }
+    for field, column in basic_columns.items():
+        if field in fieldnames:
+            column_mapping[column] = field
+
+    # テンプレート形式が見つからない場合は自動検出
+    if not column_mapping:
+        for field in fieldnames:
+            field = str(field)
+            field_lower = field.lower().strip()
+            # 新しいCSV形式の対応（［］付きの列名）
+            if '商品名' in field or 'ingredient' in field_lower or '材料' in field_lower or 'name' in field_lower:
+                column_mapping['ingredient_name'] = field
+            elif '容量' in field or 'capacity' in field_lower:
+                column_mapping['capacity'] = field
+            elif ('単位' in field or 'unit' in field_lower) and 'price' not in field_lower:
+                column_mapping['unit'] = field
+            elif '単価' in field or 'price' in field_lower or 'cost' in field_lower:
+                column_mapping['unit_price'] = field
+            elif '取引先名' in field or 'supplier' in field_lower:
+                column_mapping['supplier'] = field
+            elif '伝票日付' in field or 'date' in field_lower:
+                column_mapping['date'] = field
+
+    return column_mapping
+
+
+def parse_cost_master_row(row: Dict, column_mapping: Dict[str, str], updated_at: str) -> Dict:
+    """
+    アップロードされた1行をcost_masterの行に変換
+
+    Raises:
+        ValueError: 必須項目の欠落や数値の変換エラー
+    """
+    def value(column: str) -> str:
+        return cell_text(row.get(column_mapping.get(column, '')))
+
+    ingredient_name = value('ingredient_name')
+    unit_price_str = value('unit_price')
+    if not ingredient_name:
+        raise ValueError('材料名がありません')
+    if not unit_price_str:
+        raise ValueError('単価がありません')
+    try:
+        unit_price = float(unit_price_str.replace(',', ''))
+    except ValueError:
+        raise ValueError(f'単価が数値ではありません: {unit_price_str}')
+
+    # 容量が空、または数値変換できない場合は空白のまま（自動抽出しない）
+    capacity_str = value('capacity')
+    try:
+        capacity = float(capacity_str) if capacity_str else None
+    except ValueError:
+        capacity = None
+
+    return {
+        'ingredient_name': ingredient_name,
+        'search_key': normalize_search_key(ingredient_name),
+        'capacity': capacity,
+        'unit': value('unit') or '個',
+        'unit_price': unit_price,
+        'supplier_name': value('supplier'),
+        'transaction_date': value('date'),
+        'updated_at': updated_at
+    }
+
+
+def iter_chunks(items: Iterable, size: int) -> Iterator[List]:
+    """イテラブルをsize件ずつのリストに分割"""
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def dedupe_chunk(chunk: List[Tuple[int, Dict]], key_func: Callable[[Dict], tuple]) -> List[Tuple[int, Dict]]:
+    """
+    チャンク内の重複を除去（後の行を優先）
+
+    同じupsert文の中で同じキーの行が2回あるとPostgreSQLがエラーにするため、
+    チャンク内でのみ除去する。チャンクをまたぐ重複は後のチャンクのupsertで上書きされる。
+    """
+    unique = {}
+    for row_number, item in chunk:
+        key = key_func(item)
+        unique.pop(key, None)
+        unique[key] = (row_number, item)
+    return list(unique.values())
+
+
+def cost_master_conflict_key(item: Dict) -> tuple:
+    """cost_masterのユニーク制約のキー（DBの数値型と比較できるよう容量はfloatにそろえる）"""
+    return tuple(_normalize_value(item.get(column)) for column in COST_MASTER_CONFLICT_COLUMNS)
+
+
+def _normalize_value(value):
+    """比較用に値をそろえる（数値はDBのDECIMAL(10, 2)に合わせて小数2桁、空文字はNone）"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, (int, float, Decimal)):
+        return round(float(value), 2)
+    return str(value).strip()
+
+
+def content_hash(item: Dict, columns: Iterable[str]) -> str:
+    """指定した列の値から行の内容のハッシュを作る"""
+    payload = json.dumps([_normalize_value(item.get(column)) for column in columns],
+                         ensure_ascii=False, default=str)
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def fetch_existing_rows(supabase: Client, items: List[Dict], columns: List[str]) -> Dict[tuple, Dict]:
+    """チャンク内の材料名に一致する既存のcost_master行を、ユニークキーごとに返す"""
+    names = sorted({item['ingredient_name'] for item in items})
+    select_columns = ', '.join(['id', *COST_MASTER_CONFLICT_COLUMNS, *columns])
+    existing = {}
+    for start in range(0, len(names), DIFF_LOOKUP_BATCH_SIZE):
+        batch = names[start:start + DIFF_LOOKUP_BATCH_SIZE]
+        result = supabase.table('cost_master').select(select_columns).in_('ingredient_name', batch).execute()
+        for row in result.data or []:
+            # 同じキーの行が複数ある場合（取引先なしの行など）は最初の行を更新対象にする
+            existing.setdefault(cost_master_conflict_key(row), row)
+    return existing
+
+
+def diff_chunk(supabase: Client, chunk: List[Tuple[int, Dict]],
+               report: UploadReport) -> Tuple[List[Tuple[int, Dict]], List[Tuple[int, Dict]]]:
+    """
+    チャンクを既存行と比較し、(新規の行, 内容が変わった行) に分ける
+
+    内容が変わらない行はunchangedとして数えるだけで書き込まない。
+    変わった行には既存行のidを付け、id指定で更新する。
+    """
+    columns = sorted({column for _, item in chunk for column in item} - DIFF_IGNORED_COLUMNS)
+    existing = fetch_existing_rows(supabase, [item for _, item in chunk], columns)
+
+    inserts, updates = [], []
+    for row_number, item in chunk:
+        current = existing.get(cost_master_conflict_key(item))
+        if current is None:
+            inserts.append((row_number, item))
+        elif content_hash(current, columns) == content_hash(item, columns):
+            report.unchanged += 1
+        else:
+            updates.append((row_number, dict(item, id=current['id'])))
+    return inserts, updates
+
+
+def _write_rows(supabase: Client, rows: List[Tuple[int, Dict]], on_conflict: str,
+                report: UploadReport, counter: str) -> Tuple[bool, List[Dict]]:
+    """
+    行をまとめてupsertし、report.saved と report.<counter> を加算
+
+    まとめての書き込みが失敗した場合は1行ずつ再送し、失敗した行をレポートに記録する。
+    Returns:
+        (まとめての書き込みが成功したか, 書き込めた行)
+    """
+    if not rows:
+        return True, []
+    try:
+        result = supabase.table('cost_master').upsert([item for _, item in rows], on_conflict=on_conflict).execute()
+        written = len(result.data or [])
+        report.saved += written
+        setattr(report, counter, getattr(report, counter) + written)
+        return True, [item for _, item in rows]
+    except Exception as e:
+        print(f"⚠️ チャンク{report.chunks}のupsertに失敗、1行ずつ再送します: {e}")
+    saved_items = []
+    for row_number, item in rows:
+        try:
+            result = supabase.table('cost_master').upsert(item, on_conflict=on_conflict).execute()
+            written = len(result.data or [])
+            report.saved += written
+            setattr(report, counter, getattr(report, counter) + written)
+            saved_items.append(item)
+        except Exception as row_error:
+            report.add_error(row_number, f'保存エラー: {row_error}', {'ingredient_name': item.get('ingredient_name')})
+    return False, saved_items
+
+
+def upsert_changed_in_chunks(supabase: Client, numbered_items: Iterable[Tuple[int, Dict]],
+                             report: UploadReport, chunk_size: int = UPLOAD_CHUNK_SIZE,
+                             on_chunk: Optional[Callable[[UploadReport], None]] = None,
+                             on_written: Optional[Callable[[List[Dict]], None]] = None):
+    """
+    (行番号, 行) をチャンク単位で既存行と比較し、新規と変更のあった行だけを書き込む
+
+    新規の行はユニークキーで、変更のあった行はidでupsertする。
+    チャンクが失敗した場合はそのチャンクだけ1行ずつ再送し、
+    失敗した行をレポートに記録する（他のチャンクには影響しない）。
+    on_chunkはチャンクごとに呼ばれる（進捗通知用）。
+    on_writtenはチャンクごとに書き込めた行（新規と変更）を受け取る（単価履歴の記録用）。
+    """
+    for chunk in iter_chunks(numbered_items, chunk_size):
+        chunk = dedupe_chunk(chunk, cost_master_conflict_key)
+        report.chunks += 1
+        try:
+            inserts, updates = diff_chunk(supabase, chunk, report)
+        except Exception as e:
+            # 既存行を確認できない場合は、上書きしないようチャンク全体をエラーにする
+            print(f"⚠️ チャンク{report.chunks}の既存行の取得に失敗: {e}")
+            report.failed_chunks += 1
+            for row_number, item in chunk:
+                report.add_error(row_number, f'既存データの確認エラー: {e}', {'ingredient_name': item.get('ingredient_name')})
+        else:
+            inserted, inserted_items = _write_rows(supabase, inserts, ','.join(COST_MASTER_CONFLICT_COLUMNS),
+                                                   report, 'inserted')
+            updated, updated_items = _write_rows(supabase, updates, 'id', report, 'updated')
+            if not (inserted and updated):
+                report.failed_chunks += 1
+            if on_written and (inserted_items or updated_items):
+                on_written(inserted_items + updated_items)
+        if on_chunk:
+            on_chunk(report)
+
+
+def run_cost_master_upload(supabase: Client, stream, filename: str,
+                           chunk_size: int = UPLOAD_CHUNK_SIZE,
+                           progress: Optional[Callable] = None,
+                           on_written: Optional[Callable[[List[Dict]], None]] = None) -> UploadReport:
+    """
+    原価表ファイルをストリーミングで取り込む
+
+    行は読み込みながら検証・変換され、chunk_size件ごとに既存行と比較して
+    新規と変更のあった行だけが書き込まれるため、
+    メモリ使用量はファイルサイズではなくチャンクサイズに比例する。
+
+    Args:
+        progress: progress(rows_parsed=, rows_upserted=, rows_failed=, force=) の形で進捗を受け取る関数
+        on_written: 書き込めた行（新規と変更）をチャンクごとに受け取る関数
+    """
+    report = UploadReport()
+    fieldnames, rows = open_tabular_file(stream, filename)
+    column_mapping = detect_cost_master_columns(fieldnames)
+    print(f"🔍 File columns: {fieldnames}")
+    print(f"🔍 Column mapping: {column_mapping}")
+
+    updated_at = datetime.now().isoformat()
+
+    def valid_items():
+        # ヘッダーが1行目のため、データ行は2行目から数える
+        for row_number, row in enumerate(rows, 2):
+            if is_blank_row(row):
+                continue
+            try:
+                item = parse_cost_master_row(row, column_mapping, updated_at)
+            except ValueError as e:
+                report.skipped += 1
+                report.add_error(row_number, str(e))
+                continue
+            report.processed += 1
+            yield row_number, item
+
+    def report_progress(report: UploadReport, force: bool = False):
+        if progress:
+            progress(rows_parsed=report.processed + report.skipped, rows_upserted=report.saved,
+                     rows_failed=report.error_count, force=force)
+
+    upsert_changed_in_chunks(supabase, valid_items(), report=report, chunk_size=chunk_size,
+                             on_chunk=report_progress, on_written=on_written)
+    report_progress(report, force=True)
+
+    print(f"📊 Summary: processed={report.processed}, skipped={report.skipped}, "
+          f"saved={report.saved} (inserted={report.inserted}, updated={report.updated}), "
+          f"unchanged={report.unchanged}, chunks={report.chunks}, failed_chunks={report.failed_chunks}")
+    return report